@@ -1,10 +1,13 @@
 import os
 import re
-import shutil
 import sys
 from collections import defaultdict
 
-def renumber_files(input_dir, output_dir):
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from renameplan import RenamePlan, parse_rename_options
+
+def renumber_files(input_dir, output_dir, rename_options=None):
+    """Renumber line files; the checked plan is applied with hardlinks by default and journaled in output_dir."""
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
@@ -40,22 +43,32 @@ def renumber_files(input_dir, output_dir):
 
         max_values[f"m{new_number1:02d}"] = max_number2
 
-    # Copy files with new names
+    # Link (or rename, or copy) files to their new names
+    plan = RenamePlan(input_dir, output_dir)
     for old_name, new_name in new_filenames.items():
-        shutil.copy(os.path.join(input_dir, old_name), os.path.join(output_dir, new_name))
+        plan.add(old_name, new_name)
+    try:
+        journal = plan.apply(**(rename_options or {}))
+    except (ValueError, OSError) as e:
+        print(f"Error: {e}")
+        return None
 
     # Print statistics
     print("Statistics:")
     for key, max_val in max_values.items():
         print(f"{key}: Max number2 = {max_val}")
     print(f"Total files processed: {total_files}")
+    print(f"Rename journal: {journal}")
+    return journal
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python renumber_lines.py <input_dir> <output_dir>")
+    rename_options, args = parse_rename_options(sys.argv[1:])
+    if len(args) != 2:
+        print("Usage: python renumber_lines.py <input_dir> <output_dir> [--method auto|link|reflink|move|copy] [--allow-copy] [--replace]")
         sys.exit(1)
 
-    input_directory = sys.argv[1]
-    output_directory = sys.argv[2]
+    input_directory = args[0]
+    output_directory = args[1]
 
-    renumber_files(input_directory, output_directory)
+    if renumber_files(input_directory, output_directory, rename_options) is None:
+        sys.exit(1)
@@ -4,6 +4,12 @@ import os
 from datetime import datetime
 from PyQt5.QtGui import QImage, QTransform
 from PyQt5.QtCore import QRect
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from projection import ink_profile, find_runs
+
+BACKENDS = ("qt", "numpy", "opencv")
 
 
 def calculate_horizontal_sums(image):
@@ -20,35 +26,9 @@ def calculate_horizontal_sums(image):
 
 
 def calculate_cutlines_locations(sums):
-    element_strips = []
     cutoff = 0
-
-    if len(sums) == 0:
-        return []
-    if sums[0] <= cutoff:
-        background_strip = True
-    else:
-        background_strip = False
-    strip_start = 0
-
-    for i in range(len(sums)):
-        if sums[i] <= cutoff:
-            background = True
-        else:
-            background = False
-        if background == background_strip:
-            continue
-
-        if background:
-            strip_end = i - 1
-            element_strips.append((strip_start, strip_end))
-        strip_start = i
-        background_strip = background
-
-    if strip_start < len(sums) and not background_strip:
-        strip_end = len(sums) - 1
-        element_strips.append((strip_start, strip_end))
-    return [strip for strip in element_strips if strip[1] - strip[0] > 1]  # Filter short strips
+    # Inclusive (start, end) strips; strips of fewer than 3 rows are filtered out
+    return [(start, stop - 1) for start, stop in find_runs(sums, cutoff=cutoff, min_run=3).tolist()]
 
 
 def detect_black_index(image):
@@ -81,6 +61,45 @@ def calculate_letter_boxes_with_splits(image, xstrips):
     return boxes, invalid_strips
 
 
+def qimage_to_ink_array(image):
+    """Convert a QImage to a boolean ink array once, using its black color index."""
+    black_index = detect_black_index(image)
+    indexed = image.convertToFormat(QImage.Format_Indexed8, image.colorTable())
+    (w, h) = (indexed.width(), indexed.height())
+    bits = indexed.constBits()
+    bits.setsize(indexed.bytesPerLine() * h)
+    pixels = np.frombuffer(bits, dtype=np.uint8).reshape(h, indexed.bytesPerLine())[:, :w]
+    return pixels == black_index
+
+
+def read_ink_array(image_path, mask_cache=False):
+    """Decode a mask (e.g. a TIFF) with OpenCV into a boolean ink array, through the mask cache if asked."""
+    import cv2
+    from maskcache import read_image
+    pixels = read_image(image_path, cv2.IMREAD_GRAYSCALE, use_cache=mask_cache)
+    if pixels is None:
+        raise ValueError(f"Unable to read {image_path} with OpenCV.")
+    return pixels < 128
+
+
+def calculate_letter_boxes_from_array(ink, xstrips):
+    """Array counterpart of calculate_letter_boxes_with_splits: columns are summed by slicing each strip."""
+    boxes = []
+    line_counter = 1
+    invalid_strips = []
+
+    for (y0, y1) in xstrips:
+        ystrips = calculate_cutlines_locations(ink_profile(ink[y0:y1], axis=0, background=0))
+        if ystrips:
+            for i, (x0, x1) in enumerate(ystrips):
+                box = QRect(x0, y0, x1 - x0, y1 - y0)
+                boxes.append((line_counter, i + 1, box))
+            line_counter += 1
+        else:
+            invalid_strips.append((y0, y1))
+    return boxes, invalid_strips
+
+
 def create_log_filename(base_name, output_directory):
     timestamp = datetime.now().strftime("%Y-%m-%d-%H-%M")
     log_file_name = f"{base_name}-{timestamp}.log"
@@ -136,14 +155,23 @@ def write_letter_box_images(image, letter_boxes, input_filename, output_director
         cur_image.save(image_path)
 
 
-def segment_image(image_path, djvu_file, output_directory):
+def segment_image(image_path, djvu_file, output_directory, backend="qt", mask_cache=False):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}; use one of {', '.join(BACKENDS)}.")
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
     image = QImage(image_path)
-    strips = calculate_horizontal_sums(image)
-    hor_lines = calculate_cutlines_locations(strips)
-    letter_boxes, invalid_strips = calculate_letter_boxes_with_splits(image, hor_lines)
+    if backend == "qt":
+        strips = calculate_horizontal_sums(image)
+        hor_lines = calculate_cutlines_locations(strips)
+        letter_boxes, invalid_strips = calculate_letter_boxes_with_splits(image, hor_lines)
+    else:
+        # Decode once; line strips and letter boxes are then array slices.
+        # The QImage is still used below so the box PNGs are written exactly as before.
+        ink = read_ink_array(image_path, mask_cache) if backend == "opencv" else qimage_to_ink_array(image)
+        hor_lines = calculate_cutlines_locations(ink_profile(ink, axis=1, background=0))
+        letter_boxes, invalid_strips = calculate_letter_boxes_from_array(ink, hor_lines)
 
     write_index_file(letter_boxes, image_path, djvu_file, output_directory, image.height())
     write_letter_box_images(image, letter_boxes, image_path, output_directory)
@@ -152,12 +180,14 @@ def segment_image(image_path, djvu_file, output_directory):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python script.py <image_path> <djvu_file> [output_directory]")
+    args = [arg for arg in sys.argv[1:] if arg not in ("--numpy", "--opencv", "--mask-cache")]
+    if len(args) < 2:
+        print("Usage: python script.py <image_path> <djvu_file> [output_directory] [--numpy | --opencv [--mask-cache]]")
         sys.exit(1)
 
-    image_path = sys.argv[1]
-    djvu_file = sys.argv[2]
-    output_directory = sys.argv[3] if len(sys.argv) > 3 else "tmp"
+    image_path = args[0]
+    djvu_file = args[1]
+    output_directory = args[2] if len(args) > 2 else "tmp"
+    backend = "opencv" if "--opencv" in sys.argv else "numpy" if "--numpy" in sys.argv else "qt"
 
-    segment_image(image_path, djvu_file, output_directory)
+    segment_image(image_path, djvu_file, output_directory, backend=backend, mask_cache="--mask-cache" in sys.argv)
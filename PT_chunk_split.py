@@ -2,110 +2,166 @@ import cv2
 import os
 import numpy as np
 from datetime import datetime
+from functools import partial
+from parallel import parse_jobs, process_files, throughput_message
+from ptlog import Logger, log_message, parse_log_options
+from provenance import record_regions, parse_provenance
+from glyphpack import GlyphPack, parse_pack
 
 # Script version
-VERSION = "2.2"
-
-def log_message(log_file, message):
-    """Helper function to write messages to the log file."""
-    with open(log_file, 'a') as f:
-        f.write(f"{datetime.now()} - {message}\n")
-    print(message)  # Immediate feedback
-
-def process_image(file_path, output_dir, log_file):
-    """Process a single image to detect and filter contours while preserving top and bottom whitespace."""
+VERSION = "2.8"
+
+def enclosed_region(mask):
+    """Return mask together with everything it encloses (holes and the ink inside them).
+
+    A pixel is enclosed when it cannot reach the border of the box through
+    pixels outside the mask (8-connected, as findContours follows white).
+    """
+    padded = cv2.copyMakeBorder((~mask).astype(np.uint8), 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=1)
+    _, outside = cv2.connectedComponents(padded, connectivity=8)
+    return outside[1:-1, 1:-1] != outside[0, 0]
+
+def top_level_components(binary):
+    """Label the ink once and return (labels, stats, top-level labels sorted left to right).
+
+    Ink is labelled 4-connected and the white background 8-connected, which is
+    how findContours with RETR_TREE splits a black-on-white image. A component
+    is top-level when the white region around it touches the image border
+    (the children of the outermost contour); components nested in another
+    glyph, like the dot inside an 'o', stay part of their enclosing glyph.
+    """
+    ink = (binary == 0).astype(np.uint8)
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=4)
+    _, white = cv2.connectedComponents(1 - ink, connectivity=8)
+    outer = set(np.concatenate((white[0], white[-1], white[:, 0], white[:, -1])).tolist()) - {0}
+
+    top_level = []
+    for label in range(1, count):
+        x, y, w, _, _ = stats[label]
+        first_x = x + int(np.argmax(labels[y, x:x + w] == label))  # Raster-first pixel of the component
+        # The pixel to its left belongs to the white region that encloses the component
+        if first_x == 0 or white[y, first_x - 1] in outer:
+            # Ties on x keep findContours' order, which lists the later-starting border first
+            top_level.append((x, -(y * binary.shape[1] + first_x), label))
+    return labels, stats, [label for _, _, label in sorted(top_level)]
+
+def process_image(file_path, output_dir, logger, provenance=None, packed=None):
+    """Process a single image to extract its glyphs while preserving top and bottom whitespace.
+
+    With a provenance database the glyph boxes are recorded in it. With a
+    packed list the (name, PNG bytes) of every output are appended to it
+    instead of written to output_dir.
+    """
     # Read the binary image
     binary = cv2.imread(file_path, cv2.IMREAD_UNCHANGED)
 
     if binary is None:
-        log_message(log_file, f"ERROR: Unable to read file {file_path}")
+        log_message(logger, f"ERROR: Unable to read file {file_path}")
         return
 
-    # Add a white border to prevent edge detection
-#    binary = cv2.copyMakeBorder(binary, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=255)
+    # One labelling pass gives every glyph and its bounding box
+    labels, stats, top_level = top_level_components(binary)
+    log_message(logger, f"Number of components found: {len(stats) - 1} ({len(top_level)} top-level)")
 
-    # Find contours and hierarchy
-    contours, hierarchy = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_NONE)
-    log_message(log_file, f"Number of contours found: {len(contours)}")
-    log_message(log_file, f"Hierarchy: {hierarchy}")
+    def save(output_file, image):
+        if packed is None:
+            cv2.imwrite(output_file, image)
+        else:
+            packed.append((os.path.basename(output_file), cv2.imencode(".png", image)[1].tobytes()))
 
     base_name = os.path.splitext(os.path.basename(file_path))[0]
-    sorted_contours = sorted(enumerate(contours), key=lambda c: cv2.boundingRect(c[1])[0])
-
     glyph_count = 0
+    regions = []
     img_height, img_width = binary.shape[:2]
-    for index, contour in sorted_contours:
-        x, y, w, h = cv2.boundingRect(contour)
-
-        # Skip the whole-image contour
-        if w == img_width and h == img_height:
-            log_message(log_file, f"Skipping whole-image contour #{index}")
-            continue
-
-        parent = hierarchy[0, index, 3]
-        if parent == 0 or parent == -1:  # Top-level or child of the outermost contour
-            log_message(log_file, f"Processing contour #{index} (Parent: {parent})")
-
-            # Create a mask for the contour
-            mask = np.zeros(binary.shape, dtype=np.uint8)
-            cv2.drawContours(mask, [contour], -1, 255, thickness=cv2.FILLED)
-
-            # Retain only the region inside the contour
-            glyph_region = cv2.bitwise_and(binary, binary, mask=mask)
-            glyph_region[mask == 0] = 255  # Ensure the background is white
-
-            # Trim horizontal space while preserving vertical whitespace
-            nonzero_coords = cv2.findNonZero(mask)
-            x_min, _ = nonzero_coords.min(axis=0)[0]
-            x_max, _ = nonzero_coords.max(axis=0)[0]
-            trimmed_glyph = glyph_region[:, x_min:x_max + 1]
-
-            # Create a full-size blank canvas with a white background preserving vertical space
-            full_canvas = np.full((img_height, trimmed_glyph.shape[1]), 255, dtype=np.uint8)
-            full_canvas[y:y+h, :] = trimmed_glyph[y:y+h, :]
-
-            # Ensure the glyph remains black on a white background
-            glyph_output = full_canvas
-
-            # Save the glyph
-            glyph_count += 1
-            output_file = os.path.join(output_dir, f"{base_name}-{glyph_count}.png")
-            cv2.imwrite(output_file, glyph_output)
-            log_message(log_file, f"Saved glyph to {output_file} (Contour #{index}, Parent: {parent})")
-
-    # Visualize contours
+    for label in top_level:
+        x, y, w, h, area = stats[label]
+        # Keep the component and what it encloses; everything else in its box turns white
+        inside = enclosed_region(labels[y:y+h, x:x+w] == label)
+        glyph_region = np.where(inside, binary[y:y+h, x:x+w], 255).astype(np.uint8)
+
+        # Full-height canvas preserving vertical space, with the one-pixel white margin of the old contour crop
+        left, right = max(x - 1, 0), min(x + w, img_width - 1)
+        full_canvas = np.full((img_height, right - left + 1), 255, dtype=np.uint8)
+        full_canvas[y:y+h, x - left:x - left + w] = glyph_region
+
+        # Save the glyph
+        glyph_count += 1
+        output_file = os.path.join(output_dir, f"{base_name}-{glyph_count}.png")
+        save(output_file, full_canvas)
+        log_message(logger, f"Saved glyph to {output_file} (Component #{label}, box {x},{y},{w},{h}, {area} px)",
+                    event="glyph", source=base_name, glyph=glyph_count, component=int(label),
+                    x=int(x), y=int(y), w=int(w), h=int(h), area=int(area), path=output_file)
+        # The region is the canvas as written: full height, no padding
+        regions.append((os.path.basename(output_file), left, 0, right - left + 1, img_height, 0,
+                        os.path.abspath(output_file) if packed is None else None))
+
+    record_regions(provenance, os.path.basename(file_path), "split", regions)
+
+    # Visualize the glyph boxes
     contour_image = cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)
-    cv2.drawContours(contour_image, contours, -1, (0, 255, 0), 2)
+    for label in top_level:
+        x, y, w, h, _ = stats[label]
+        cv2.rectangle(contour_image, (x, y), (x + w - 1, y + h - 1), (0, 255, 0), 1)
     debug_path = os.path.join(output_dir, f"{base_name}_contours.png")
-    cv2.imwrite(debug_path, contour_image)
-    log_message(log_file, f"Saved contour visualization to {debug_path}")
+    save(debug_path, contour_image)
+    log_message(logger, f"Saved glyph box visualization to {debug_path}")
 
-def process_directory(input_dir):
-    """Process all binary images in the input directory."""
-    log_file = f"contour_processing_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    log_message(log_file, f"Script version: {VERSION}")
-    log_message(log_file, f"Processing input directory: {input_dir}")
+def process_file(file_path, output_dir, logger, provenance=None, pack=False):
+    """Log and process one input file; this is the unit of work of a parallel run.
+
+    Returns the packed outputs if pack is set, else None.
+    """
+    log_message(logger, f"Processing file: {os.path.basename(file_path)}")
+    packed = [] if pack else None
+    process_image(file_path, output_dir, logger, provenance=provenance, packed=packed)
+    return packed
 
-    output_dir = os.path.join(input_dir, "output")
-    os.makedirs(output_dir, exist_ok=True)
+def process_directory(input_dir, jobs=1, log_options=None, provenance=None, pack=None, mp_context=None):
+    """Process all binary images in the input directory.
 
-    for file_name in sorted(os.listdir(input_dir)):
-        if file_name.lower().endswith(('.png', '.jpg', '.tiff')):
-            file_path = os.path.join(input_dir, file_name)
-            log_message(log_file, f"Processing file: {file_name}")
-            process_image(file_path, output_dir, log_file)
+    With a pack archive path the outputs go into the archive instead of the output directory.
+    mp_context is the multiprocessing context of the pool (see parallel.pool_context()).
+    """
+    log_file = f"contour_processing_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    with Logger(log_file, **(log_options or {})) as logger:
+        log_message(logger, f"Script version: {VERSION}")
+        log_message(logger, f"Processing input directory: {input_dir}")
+
+        output_dir = os.path.join(input_dir, "output")
+        if pack is None:
+            os.makedirs(output_dir, exist_ok=True)
+
+        file_paths = [os.path.join(input_dir, file_name) for file_name in sorted(os.listdir(input_dir))
+                      if file_name.lower().endswith(('.png', '.jpg', '.tiff'))]
+        archive = GlyphPack(pack, "a") if pack is not None else None
+
+        def store(file_path, packed):
+            for name, data in packed or ():
+                archive.add(name, data)
+
+        process = partial(process_file, provenance=provenance, pack=archive is not None)
+        _, elapsed = process_files(process, file_paths, output_dir, logger, jobs=jobs,
+                                   on_result=store if archive is not None else None, mp_context=mp_context)
+        if archive is not None:
+            archive.close()
+            log_message(logger, f"Outputs saved to {pack}")
+        log_message(logger, throughput_message(len(file_paths), elapsed, jobs))
 
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) != 2:
-        print("Usage: python contour_filter.py <input_directory>")
+    log_options, args = parse_log_options(sys.argv[1:])
+    jobs, args = parse_jobs(args)
+    provenance, args = parse_provenance(args)
+    pack, args = parse_pack(args)
+    if len(args) != 1:
+        print("Usage: python contour_filter.py <input_directory> [--jobs N] [--provenance DB] [--pack ARCHIVE.ptpack] [--quiet | --verbose] [--log-format text|jsonl]")
         sys.exit(1)
 
-    input_directory = sys.argv[1]
+    input_directory = args[0]
 
     if not os.path.isdir(input_directory):
         print(f"Error: {input_directory} is not a valid directory.")
         sys.exit(1)
 
-    process_directory(input_directory)
+    process_directory(input_directory, jobs=jobs, log_options=log_options, provenance=provenance, pack=pack)
@@ -1,20 +1,27 @@
 import os
 import sys
 import cv2
-import numpy as np
 from datetime import datetime
+from collections import defaultdict
+from functools import partial
+from projection import ink_profile, find_gaps
+from parallel import parse_jobs, process_files, throughput_message
+from ptlog import Logger, log_message, parse_log_options
+from manifest import Manifest, atomic_imwrite
+from provenance import record_regions, parse_provenance
+from glyphpack import GlyphPack, parse_pack
 
 # Script version
-VERSION = "5.0"
+VERSION = "5.7"
 
-def log_message(log_file, message):
-    """Helper function to write messages to the log file."""
-    with open(log_file, 'a') as f:
-        f.write(f"{datetime.now()} - {message}\n")
-    print(message)  # Immediate feedback
+CHUNK_PADDING = 2
 
-def split_into_chunks(image, output_dir, file_basename, log_file):
-    """Split the image into chunks using vertical gaps and save them."""
+def split_into_chunks(image, output_dir, file_basename, logger, packed=None):
+    """Split the image into chunks using vertical gaps and save them.
+
+    Returns the (chunk_number, x0, x1) columns of the saved chunks.
+    With a packed list the (name, PNG bytes) of the chunks are appended to it instead of written to output_dir.
+    """
 #    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
     # Assuming input images are already binary
@@ -22,115 +29,189 @@ def split_into_chunks(image, output_dir, file_basename, log_file):
     binary = image
 
     # Log the shape and pixel values of the binary image
-#    log_message(log_file, f"Binary image shape: {binary.shape}")
-#    log_message(log_file, f"Unique pixel values in binary image: {np.unique(binary)}")
+#    log_message(logger, f"Binary image shape: {binary.shape}")
+#    log_message(logger, f"Unique pixel values in binary image: {np.unique(binary)}")
+
+    chunks = []
+    for chunk_number, x0, x1, padded_chunk, final in chunk_slices(binary, logger):
+        chunk_dir = os.path.join(output_dir, os.path.splitext(file_basename)[0] + "_chunks")
+        output_path = chunk_path(chunk_dir, file_basename, chunk_number)
+        if packed is None:
+            os.makedirs(chunk_dir, exist_ok=True)
+            atomic_imwrite(output_path, padded_chunk)
+        else:
+            packed.append((os.path.basename(output_path), cv2.imencode(".png", padded_chunk)[1].tobytes()))
+
+        label = "Final chunk" if final else "Chunk"
+        log_message(logger, f"{label} {chunk_number}: Columns [{x0}:{x1}] saved to {output_path}",
+                    event="chunk", source=file_basename, chunk=chunk_number, x0=x0, x1=x1, path=output_path)
+        chunks.append((chunk_number, x0, x1))
+
+    if not chunks:
+        log_message(logger, f"No chunks detected for file: {file_basename}")
 
-    gaps = find_vertical_gaps(binary, log_file)
-#    log_message(log_file, f"Detected gaps: {gaps}")
+    return chunks
 
+def chunk_path(chunk_dir, file_basename, chunk_number):
+    """Return the path of a numbered chunk of a line image."""
+    return os.path.join(chunk_dir, f"{os.path.splitext(file_basename)[0]}_chunk_{chunk_number:02d}.png")
+
+def chunk_slices(binary, logger):
+    """Yield (chunk_number, x0, x1, padded_chunk, final) for the chunks between vertical gaps.
+
+    final is True for a chunk that runs to the right edge after the last gap.
+    """
+    gaps = find_vertical_gaps(binary, logger)
+#    log_message(logger, f"Detected gaps: {gaps}")
+
+    for chunk_number, x0, x1, final in chunk_columns(gaps, binary.shape[1]):
+        chunk_image = binary[:, x0:x1]
+        padded_chunk = cv2.copyMakeBorder(chunk_image, *(CHUNK_PADDING,) * 4, cv2.BORDER_CONSTANT, value=255)
+        yield chunk_number, x0, x1, padded_chunk, final
+
+def chunk_columns(gaps, width):
+    """Yield (chunk_number, x0, x1, final) for the columns between the (start, end) gaps of a line."""
     chunk_number = 0
     prev_gap_end = 0
 
     for gap_start, gap_end in gaps:
         # Extract the chunk between the previous gap and the current gap
-        chunk_image = binary[:, prev_gap_end:gap_start]
-        if chunk_image.shape[1] > 0:  # Ignore empty chunks
-            padded_chunk = cv2.copyMakeBorder(chunk_image, 2, 2, 2, 2, cv2.BORDER_CONSTANT, value=255)
-
+        if gap_start > prev_gap_end:  # Ignore empty chunks
             chunk_number += 1
-            chunk_dir = os.path.join(output_dir, os.path.splitext(file_basename)[0] + "_chunks")
-            os.makedirs(chunk_dir, exist_ok=True)
-
-            output_path = os.path.join(chunk_dir, f"{os.path.splitext(file_basename)[0]}_chunk_{chunk_number:02d}.png")
-            cv2.imwrite(output_path, padded_chunk)
-
-            log_message(log_file, f"Chunk {chunk_number}: Columns [{prev_gap_end}:{gap_start}] saved to {output_path}")
+            yield chunk_number, prev_gap_end, gap_start, False
 
         prev_gap_end = gap_end + 1
 
     # Handle the last chunk after the final gap
-    if prev_gap_end < binary.shape[1]:
-        chunk_image = binary[:, prev_gap_end:]
-        padded_chunk = cv2.copyMakeBorder(chunk_image, 2, 2, 2, 2, cv2.BORDER_CONSTANT, value=255)
-
+    if prev_gap_end < width:
         chunk_number += 1
-        chunk_dir = os.path.join(output_dir, os.path.splitext(file_basename)[0] + "_chunks")
-        os.makedirs(chunk_dir, exist_ok=True)
-
-        output_path = os.path.join(chunk_dir, f"{os.path.splitext(file_basename)[0]}_chunk_{chunk_number:02d}.png")
-        cv2.imwrite(output_path, padded_chunk)
-
-        log_message(log_file, f"Final chunk {chunk_number}: Columns [{prev_gap_end}:{binary.shape[1]}] saved to {output_path}")
-
-    if chunk_number == 0:
-        log_message(log_file, f"No chunks detected for file: {file_basename}")
-
-    return chunk_number
+        yield chunk_number, prev_gap_end, width, True
 
-def find_vertical_gaps(binary, log_file):
+def find_vertical_gaps(binary, logger):
     """Find vertical gaps composed of columns of white pixels."""
-    height, width = binary.shape
-    gaps = []
+    return profile_gaps(ink_profile(binary, axis=0), logger)
 
-    in_gap = False
-    gap_start = 0
-
-    for x in range(width):
-        if np.all(binary[:, x] == 255):  # Column is fully white
-            if not in_gap:
-                gap_start = x
-                in_gap = True
-        else:
-            if in_gap:
-                gaps.append((gap_start, x - 1))
-#                log_message(log_file, f"Gap found: Columns [{gap_start}:{x - 1}]")
-                in_gap = False
-
-    if in_gap:  # Handle gap ending at the last column
-        gaps.append((gap_start, width - 1))
-#        log_message(log_file, f"Gap found: Columns [{gap_start}:{width - 1}]")
+def profile_gaps(vertical_projection, logger):
+    """Return the inclusive (start, end) gaps of a line from its per-column ink counts."""
+    gaps = [(start, stop - 1) for start, stop in find_gaps(vertical_projection).tolist()]
 
     if not gaps:
-        log_message(log_file, "No gaps detected; the entire line might be one chunk.")
+        log_message(logger, "No gaps detected; the entire line might be one chunk.")
 
     return gaps
 
-def process_image(file_path, output_dir, log_file):
-    """Process a single image to extract chunks and save them with padded bounding boxes."""
+def process_image(file_path, output_dir, logger, provenance=None, packed=None):
+    """Process a single image to extract chunks and save them with padded bounding boxes.
+
+    Returns the paths written, or None if the image could not be read.
+    With a provenance database the columns of the chunks are recorded in it.
+    With a packed list the chunks go into it as (name, PNG bytes), see split_into_chunks().
+    """
     image = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
 
     if image is None:
-        log_message(log_file, f"ERROR: Unable to read file {file_path}")
-        return
+        log_message(logger, f"ERROR: Unable to read file {file_path}")
+        return None
 
     file_basename = os.path.splitext(os.path.basename(file_path))[0]
-    split_into_chunks(image, output_dir, file_basename, log_file)
-
-def process_directory(input_dir):
-    """Process all PNG files in the input directory."""
+    chunks = split_into_chunks(image, output_dir, file_basename, logger, packed=packed)
+    chunk_dir = os.path.join(output_dir, file_basename + "_chunks")
+    paths = [chunk_path(chunk_dir, file_basename, chunk_number) for chunk_number, _, _ in chunks]
+    record_regions(provenance, os.path.basename(file_path), "chunks",
+                   [(os.path.basename(path), x0, 0, x1 - x0, image.shape[0], CHUNK_PADDING,
+                     None if packed is not None else os.path.abspath(path))
+                    for path, (_, x0, x1) in zip(paths, chunks)])
+    return paths
+
+def process_file(file_path, output_dir, logger, provenance=None, pack=False):
+    """Log and process one input file; this is the unit of work of a parallel run.
+
+    Returns (paths, packed chunks); packed chunks is None unless pack is set.
+    """
+    log_message(logger, f"Processing file: {os.path.basename(file_path)}")
+    packed = [] if pack else None
+    return process_image(file_path, output_dir, logger, provenance=provenance, packed=packed), packed
+
+def packed_chunks(archive):
+    """Return {line image base name: [names of its plain numbered chunks]} of an archive."""
+    chunks = defaultdict(list)
+    for name in archive.names():
+        line, separator, number = name.rpartition("_chunk_")
+        if separator and number.endswith(".png") and number[:-len(".png")].isdigit():
+            chunks[line].append(name)
+    return chunks
+
+def process_directory(input_dir, jobs=1, log_options=None, force=False, provenance=None, pack=None):
+    """Process all PNG files in the input directory.
+
+    Lines whose content, parameters and script VERSION match the manifest are
+    skipped unless force is set; chunks a line no longer produces are removed.
+    With a pack archive path the chunks go into the archive instead of the
+    chunks directory. The manifest only tracks files, so every line is then
+    processed, and the chunks it no longer produces are dropped from the archive.
+    """
     log_file = f"chunk_extraction_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    log_message(log_file, f"Script version: {VERSION}")
-    log_message(log_file, f"Processing input directory: {input_dir}")
-
-    output_dir = os.path.join(input_dir, "chunks")
-    os.makedirs(output_dir, exist_ok=True)
-
-    for file_name in sorted(os.listdir(input_dir)):
-        if file_name.lower().endswith('.png'):
-            file_path = os.path.join(input_dir, file_name)
-            log_message(log_file, f"Processing file: {file_name}")
-            process_image(file_path, output_dir, log_file)
+    with Logger(log_file, **(log_options or {})) as logger:
+        log_message(logger, f"Script version: {VERSION}")
+        log_message(logger, f"Processing input directory: {input_dir}")
+
+        output_dir = os.path.join(input_dir, "chunks")
+        file_paths = [os.path.join(input_dir, file_name) for file_name in sorted(os.listdir(input_dir))
+                      if file_name.lower().endswith('.png')]
+        if pack is not None:
+            with GlyphPack(pack, "a") as archive:
+                previous = packed_chunks(archive)
+
+                def store(file_path, result):
+                    paths, packed = result
+                    if paths is None:
+                        return
+                    names = {name for name, _ in packed}
+                    line = os.path.splitext(os.path.basename(file_path))[0]
+                    for stale in [name for name in previous.get(line, ()) if name not in names]:
+                        archive.remove(stale)
+                        log_message(logger, f"Removed stale output: {stale}")
+                    for name, data in packed:
+                        archive.add(name, data)
+
+                process = partial(process_file, provenance=provenance, pack=True)
+                _, elapsed = process_files(process, file_paths, output_dir, logger, jobs=jobs, on_result=store)
+            log_message(logger, f"Outputs saved to {pack}")
+            log_message(logger, throughput_message(len(file_paths), elapsed, jobs))
+            return
+
+        os.makedirs(output_dir, exist_ok=True)
+        manifest = Manifest(output_dir, "PT_chunks", VERSION, {"padding": CHUNK_PADDING})
+        for removed in manifest.prune(file_paths):
+            log_message(logger, f"Removed output of a deleted input: {removed}")
+        pending = manifest.pending(file_paths, force=force)
+        log_message(logger, f"{len(file_paths) - len(pending)} unchanged files skipped, {len(pending)} to process")
+
+        def record(file_path, result):
+            outputs, _ = result
+            if outputs is not None:
+                for stale in manifest.update(file_path, outputs):
+                    log_message(logger, f"Removed stale output: {stale}")
+
+        process = partial(process_file, provenance=provenance)
+        _, elapsed = process_files(process, pending, output_dir, logger, jobs=jobs, on_result=record)
+        log_message(logger, throughput_message(len(pending), elapsed, jobs))
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python PT_chunks.py <input_directory>")
+    log_options, args = parse_log_options(sys.argv[1:])
+    jobs, args = parse_jobs(args)
+    provenance, args = parse_provenance(args)
+    pack, args = parse_pack(args)
+    force = "--force" in args
+    args = [arg for arg in args if arg != "--force"]
+    if len(args) != 1:
+        print("Usage: python PT_chunks.py <input_directory> [--force] [--jobs N] [--provenance DB] [--pack ARCHIVE.ptpack] [--quiet | --verbose] [--log-format text|jsonl]")
         sys.exit(1)
 
-    input_directory = sys.argv[1]
+    input_directory = args[0]
 
     if not os.path.isdir(input_directory):
         print(f"Error: {input_directory} is not a valid directory.")
         sys.exit(1)
 
-    process_directory(input_directory)
-    
+    process_directory(input_directory, jobs=jobs, log_options=log_options, force=force, provenance=provenance, pack=pack)
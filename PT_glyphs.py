@@ -1,74 +1,167 @@
 # https://chatgpt.com/c/67876b18-42a4-800d-a329-dd2bc7f6e2ac
+import io
 import os
+import csv
 import sys
 import cv2
 import numpy as np
 from datetime import datetime
+from functools import partial
+from parallel import parse_jobs, process_files, throughput_message
+from ptlog import Logger, log_message, parse_log_options
+from manifest import atomic_write_bytes
+from provenance import record_regions, parse_provenance
+from glyphpack import GlyphPack, parse_pack
 
 # Script version
-VERSION = "4.0"
+VERSION = "4.6"
 
-def log_message(log_file, message):
-    """Helper function to write messages to the log file."""
-    with open(log_file, 'a') as f:
-        f.write(f"{datetime.now()} - {message}\n")
-    print(message)  # Immediate feedback
+GLYPH_PADDING = 2
 
-def process_image(file_path, output_dir, log_file):
-    """Process a single image to extract glyphs and save them with padded bounding boxes."""
+# Index of every glyph written by a run, in the glyphs directory
+INDEX_NAME = "glyph_index.csv"
+INDEX_FIELDS = ("source", "glyph", "x", "y", "w", "h", "pixels", "area")
+
+def process_image(file_path, output_dir, logger, provenance=None, packed=None):
+    """Process a single image to extract glyphs and save them with padded bounding boxes.
+
+    Returns the glyph index rows of the image; with a provenance database the boxes are recorded in it too.
+    With a packed list the (name, PNG bytes) of the glyphs are appended to it instead of written to output_dir.
+    """
     image = cv2.imread(file_path, cv2.IMREAD_GRAYSCALE)
 
     if image is None:
-        log_message(log_file, f"ERROR: Unable to read file {file_path}")
+        log_message(logger, f"ERROR: Unable to read file {file_path}")
         return
 
     binary = image  # Correctly assign binary to the loaded image
 
     # Find contours
-    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    log_message(log_file, f"{len(contours)} contours found in {file_path}")
+    contours = find_glyph_contours(binary)
+    log_message(logger, f"{len(contours)} contours found in {file_path}")
 
     base_name = os.path.splitext(os.path.basename(file_path))[0]
-    glyph_count = 0
 
-    for contour in contours:
+    rows = []
+    for (glyph_count, padded_glyph), contour in zip(glyph_crops(binary, contours), contours):
+        # Save the glyph
+        output_file = glyph_path(output_dir, base_name, glyph_count)
+        if packed is None:
+            cv2.imwrite(output_file, padded_glyph)  # No need to invert back since input is already correct
+        else:
+            packed.append((os.path.basename(output_file), cv2.imencode(".png", padded_glyph)[1].tobytes()))
+        log_message(logger, f"Saved glyph {glyph_count} to {output_file}",
+                    event="glyph", source=base_name, glyph=glyph_count, path=output_file)
+        rows.append((base_name, glyph_count) + glyph_box(binary, contour))
+
+    record_regions(provenance, os.path.basename(file_path), "glyphs",
+                   [(os.path.basename(glyph_path(output_dir, base_name, glyph)), x, y, w, h, GLYPH_PADDING,
+                     None if packed is not None else os.path.abspath(glyph_path(output_dir, base_name, glyph)))
+                    for _, glyph, x, y, w, h, _, _ in rows])
+    return rows
+
+def find_glyph_contours(binary):
+    """Return the external contours of a binary chunk image."""
+    contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return contours
+
+def glyph_box(binary, contour):
+    """Return (x, y, w, h, ink pixel count, contour area) of a glyph contour."""
+    x, y, w, h = cv2.boundingRect(contour)
+    pixels = int(np.count_nonzero(binary[y:y+h, x:x+w] != 255))
+    return x, y, w, h, pixels, cv2.contourArea(contour)
+
+def glyph_index_bytes(rows):
+    """Return the glyph index CSV of the rows of a run."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(INDEX_FIELDS)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+def write_glyph_index(output_dir, rows):
+    """Write the rows of a run to the glyph index CSV; returns its path."""
+    index_path = os.path.join(output_dir, INDEX_NAME)
+    atomic_write_bytes(index_path, glyph_index_bytes(rows))
+    return index_path
+
+def read_glyph_index(index_path):
+    """Read a glyph index as a list of dicts with integer coordinates, for filtering, sorting and re-cropping."""
+    with open(index_path, newline='', encoding='utf-8') as f:
+        return [{field: (row[field] if field == "source" else float(row[field]) if field == "area" else int(row[field]))
+                 for field in INDEX_FIELDS} for row in csv.DictReader(f)]
+
+def glyph_path(output_dir, base_name, glyph_count):
+    """Return the path of a numbered glyph of a chunk."""
+    return os.path.join(output_dir, f"{base_name}-{glyph_count}.png")
+
+def glyph_crops(binary, contours):
+    """Yield (glyph_count, padded_glyph) for the bounding box of every contour."""
+    for glyph_count, contour in enumerate(contours, start=1):
         # Get bounding box
         x, y, w, h = cv2.boundingRect(contour)
         glyph = binary[y:y+h, x:x+w]
 
         # Pad the glyph to make it a rectangular bounding box
-        padded_glyph = cv2.copyMakeBorder(glyph, 2, 2, 2, 2, cv2.BORDER_CONSTANT, value=255)
+        yield glyph_count, cv2.copyMakeBorder(glyph, *(GLYPH_PADDING,) * 4, cv2.BORDER_CONSTANT, value=255)
 
-        # Save the glyph
-        glyph_count += 1
-        output_file = os.path.join(output_dir, f"{base_name}-{glyph_count}.png")
-        cv2.imwrite(output_file, padded_glyph)  # No need to invert back since input is already correct
-        log_message(log_file, f"Saved glyph {glyph_count} to {output_file}")
+def process_file(file_path, output_dir, logger, provenance=None, pack=False):
+    """Log and process one input file; this is the unit of work of a parallel run.
 
-def process_directory(input_dir):
-    """Process all PNG files in the input directory."""
-    log_file = f"glyph_extraction_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    log_message(log_file, f"Script version: {VERSION}")
-    log_message(log_file, f"Processing input directory: {input_dir}")
+    Returns (index rows, packed glyphs); packed glyphs is None unless pack is set.
+    """
+    log_message(logger, f"Processing file: {os.path.basename(file_path)}")
+    packed = [] if pack else None
+    return process_image(file_path, output_dir, logger, provenance=provenance, packed=packed), packed
 
-    output_dir = os.path.join(input_dir, "glyphs")
-    os.makedirs(output_dir, exist_ok=True)
+def process_directory(input_dir, jobs=1, log_options=None, provenance=None, pack=None):
+    """Process all PNG files in the input directory.
 
-    for file_name in sorted(os.listdir(input_dir)):
-        if file_name.lower().endswith('.png'):
-            file_path = os.path.join(input_dir, file_name)
-            log_message(log_file, f"Processing file: {file_name}")
-            process_image(file_path, output_dir, log_file)
+    With a pack archive path the glyphs and their index go into the archive instead of the glyphs directory.
+    """
+    log_file = f"glyph_extraction_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    with Logger(log_file, **(log_options or {})) as logger:
+        log_message(logger, f"Script version: {VERSION}")
+        log_message(logger, f"Processing input directory: {input_dir}")
+
+        output_dir = os.path.join(input_dir, "glyphs")
+        if pack is None:
+            os.makedirs(output_dir, exist_ok=True)
+
+        file_paths = [os.path.join(input_dir, file_name) for file_name in sorted(os.listdir(input_dir))
+                      if file_name.lower().endswith('.png')]
+        archive = GlyphPack(pack, "a") if pack is not None else None
+
+        def store(file_path, result):
+            for name, data in result[1] or ():
+                archive.add(name, data)
+
+        process = partial(process_file, provenance=provenance, pack=archive is not None)
+        results, elapsed = process_files(process, file_paths, output_dir, logger, jobs=jobs,
+                                         on_result=store if archive is not None else None)
+        rows = [row for file_rows, _ in results if file_rows for row in file_rows]
+        if archive is not None:
+            archive.add(INDEX_NAME, glyph_index_bytes(rows))
+            archive.close()
+            log_message(logger, f"{len(rows)} glyphs and their index saved to {pack}")
+        else:
+            index_path = write_glyph_index(output_dir, rows)
+            log_message(logger, f"Glyph index with {len(rows)} entries saved to {index_path}")
+        log_message(logger, throughput_message(len(file_paths), elapsed, jobs))
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python glyph_extraction.py <input_directory>")
+    log_options, args = parse_log_options(sys.argv[1:])
+    jobs, args = parse_jobs(args)
+    provenance, args = parse_provenance(args)
+    pack, args = parse_pack(args)
+    if len(args) != 1:
+        print("Usage: python glyph_extraction.py <input_directory> [--jobs N] [--provenance DB] [--pack ARCHIVE.ptpack] [--quiet | --verbose] [--log-format text|jsonl]")
         sys.exit(1)
 
-    input_directory = sys.argv[1]
+    input_directory = args[0]
 
     if not os.path.isdir(input_directory):
         print(f"Error: {input_directory} is not a valid directory.")
         sys.exit(1)
 
-    process_directory(input_directory)
+    process_directory(input_directory, jobs=jobs, log_options=log_options, provenance=provenance, pack=pack)
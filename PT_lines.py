@@ -1,78 +1,133 @@
 import os
 import sys
 import cv2
-import numpy as np
 from datetime import datetime
+from functools import partial
+from projection import ink_profile, find_runs
+from parallel import parse_jobs, process_files, throughput_message
+from ptlog import QUIET, Logger, log_message, parse_log_options
+from manifest import Manifest, atomic_imwrite
+from provenance import ProvenanceStore, parse_provenance
+from maskcache import parse_mask_cache, read_image
 
 # Script version
-VERSION = "1.2"
+VERSION = "1.9"
 
-def log_message(log_file, message):
-    """Helper function to write messages to the log file."""
-    with open(log_file, 'a') as f:
-        f.write(f"{datetime.now()} - {message}\n")
+THRESHOLD = 127
+MIN_LINE_HEIGHT = 10
 
-def split_into_lines(image, output_dir):
-    """Split the image into horizontal lines and save them to the output directory."""
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY_INV)
-
-    # Sum along columns to find horizontal projections
-    horizontal_projection = np.sum(binary, axis=1)
-
-    # Detect line positions based on projection
-    line_positions = []
-    in_line = False
-    for i, value in enumerate(horizontal_projection):
-        if value > 0 and not in_line:
-            in_line = True
-            start = i
-        elif value == 0 and in_line:
-            in_line = False
-            end = i
-            # Ignore lines shorter than 10 pixels
-            if (end - start) >= 10:
-                line_positions.append((start, end))
-
-    line_number = 0
-    for start, end in line_positions:
-        line_number += 1
-        line_image = image[start:end, :]
-#        output_path = os.path.join(output_dir, f"{line_number:02d}_{os.path.basename(output_dir)}.png")
-        output_path = os.path.join(output_dir, f"{os.path.basename(output_dir)}_{line_number:02d}.png")
-        cv2.imwrite(output_path, line_image)
-
-    return len(line_positions)
-
-def process_directory(input_dir):
-    """Main function to process all PNG files in the input directory."""
-    log_file = f"PT_lines_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    log_message(log_file, f"Script version: {VERSION}")
+def line_slices(image):
+    """Yield (line_number, start, end, line_image) for every horizontal line of a page image."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    _, binary = cv2.threshold(gray, THRESHOLD, 255, cv2.THRESH_BINARY_INV)
+
+    # Count ink along rows to find horizontal projections
+    horizontal_projection = ink_profile(binary, axis=1, background=0)
 
-    for file_name in os.listdir(input_dir):
-        if file_name.lower().endswith('.png'):
-            file_path = os.path.join(input_dir, file_name)
-            image = cv2.imread(file_path)
+    for line_number, (start, end) in enumerate(line_positions(horizontal_projection), start=1):
+        yield line_number, start, end, image[start:end, :]
 
-            if image is None:
-                log_message(log_file, f"ERROR: Unable to read file {file_name}")
-                continue
+def line_positions(horizontal_projection):
+    """Return the (start, end) rows of the lines of a page from its per-row ink counts."""
+    # Detect line positions based on projection, ignoring lines shorter than 10 pixels.
+    # A line still open at the bottom edge was never closed by the old scanner, so drop it too.
+    runs = find_runs(horizontal_projection, min_run=MIN_LINE_HEIGHT)
+    return [(start, end) for start, end in runs.tolist() if end < len(horizontal_projection)]
 
-            output_dir = os.path.join(input_dir, f"{os.path.splitext(file_name)[0]}_lines")
-            os.makedirs(output_dir, exist_ok=True)
+def line_path(output_dir, line_number):
+    """Return the path of a numbered line inside a <page>_lines directory."""
+#    return os.path.join(output_dir, f"{line_number:02d}_{os.path.basename(output_dir)}.png")
+    return os.path.join(output_dir, f"{os.path.basename(output_dir)}_{line_number:02d}.png")
 
-            line_count = split_into_lines(image, output_dir)
-            log_message(log_file, f"{file_name}: {line_count} lines detected and saved.")
+def split_into_lines(image, output_dir):
+    """Split the image into horizontal lines and save them to the output directory.
+
+    Returns the (line_number, start, end) rows of the saved lines.
+    """
+    lines = []
+    for line_number, start, end, line_image in line_slices(image):
+        atomic_imwrite(line_path(output_dir, line_number), line_image)
+        lines.append((line_number, start, end))
+
+    return lines
+
+def record_lines(provenance, file_path, image, output_dir, lines):
+    """Record the page and the rows of its lines in the provenance store."""
+    height, width = image.shape[:2]
+    regions = [(os.path.basename(line_path(output_dir, line_number)), 0, start, width, end - start, 0,
+                os.path.abspath(line_path(output_dir, line_number))) for line_number, start, end in lines]
+    with ProvenanceStore(provenance) as store:
+        store.record_page(file_path, width, height)
+        store.replace_children(os.path.basename(file_path), "lines", regions)
+
+def process_image(file_path, input_dir, logger, provenance=None, mask_cache=False):
+    """Split one page image into lines saved next to it; this is the unit of work of a parallel run.
+
+    Returns the paths written, or None if the image could not be read.
+    With a provenance database the page rows of the lines are recorded in it.
+    With mask_cache the decoded page is memory-mapped from the mask cache.
+    """
+    file_name = os.path.basename(file_path)
+    image = read_image(file_path, use_cache=mask_cache)
+
+    if image is None:
+        log_message(logger, f"ERROR: Unable to read file {file_name}")
+        return None
+
+    output_dir = os.path.join(input_dir, f"{os.path.splitext(file_name)[0]}_lines")
+    os.makedirs(output_dir, exist_ok=True)
+
+    lines = split_into_lines(image, output_dir)
+    line_count = len(lines)
+    if provenance is not None:
+        record_lines(provenance, file_path, image, output_dir, lines)
+    log_message(logger, f"{file_name}: {line_count} lines detected and saved.",
+                event="page", source=file_name, lines=line_count, path=output_dir)
+    return [line_path(output_dir, line_number) for line_number in range(1, line_count + 1)]
+
+def process_directory(input_dir, jobs=1, log_options=None, force=False, provenance=None, mask_cache=False):
+    """Main function to process all PNG files in the input directory.
+
+    Pages whose content, parameters and script VERSION match the manifest are
+    skipped unless force is set; lines a page no longer produces are removed.
+    """
+    log_file = f"PT_lines_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    with Logger(log_file, **(log_options or {"verbosity": QUIET})) as logger:
+        log_message(logger, f"Script version: {VERSION}")
+
+        file_paths = [os.path.join(input_dir, file_name) for file_name in sorted(os.listdir(input_dir))
+                      if file_name.lower().endswith('.png')]
+        manifest = Manifest(input_dir, "PT_lines", VERSION, {"threshold": THRESHOLD, "min_line_height": MIN_LINE_HEIGHT})
+        for removed in manifest.prune(file_paths):
+            log_message(logger, f"Removed output of a deleted input: {removed}")
+        pending = manifest.pending(file_paths, force=force)
+        log_message(logger, f"{len(file_paths) - len(pending)} unchanged files skipped, {len(pending)} to process")
+
+        def record(file_path, outputs):
+            if outputs is not None:
+                for stale in manifest.update(file_path, outputs):
+                    log_message(logger, f"Removed stale output: {stale}")
+
+        process = partial(process_image, provenance=provenance, mask_cache=mask_cache)
+        _, elapsed = process_files(process, pending, input_dir, logger, jobs=jobs, on_result=record)
+        log_message(logger, throughput_message(len(pending), elapsed, jobs))
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python PT_lines.py <input_directory>")
+    log_options, args = parse_log_options(sys.argv[1:], verbosity=QUIET)
+    jobs, args = parse_jobs(args)
+    provenance, args = parse_provenance(args)
+    mask_cache, args = parse_mask_cache(args)
+    force = "--force" in args
+    args = [arg for arg in args if arg != "--force"]
+    if len(args) != 1:
+        print("Usage: python PT_lines.py <input_directory> [--force] [--jobs N] [--provenance DB] [--mask-cache] [--verbose] [--log-format text|jsonl]")
         sys.exit(1)
 
-    input_directory = sys.argv[1]
+    input_directory = args[0]
 
     if not os.path.isdir(input_directory):
         print(f"Error: {input_directory} is not a valid directory.")
         sys.exit(1)
 
-    process_directory(input_directory)
+    process_directory(input_directory, jobs=jobs, log_options=log_options, force=force, provenance=provenance,
+                      mask_cache=mask_cache)
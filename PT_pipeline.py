@@ -0,0 +1,179 @@
+import os
+import sys
+import cv2
+from datetime import datetime
+from functools import partial
+from collections import defaultdict
+from parallel import parse_jobs, process_files, throughput_message
+from ptlog import Logger, log_message, parse_log_options
+from PT_lines import line_slices, line_path, line_positions
+from PT_chunks import chunk_slices, chunk_path, chunk_columns, profile_gaps
+from PT_glyphs import GLYPH_PADDING, find_glyph_contours, glyph_crops, glyph_path
+from PT_chunks import CHUNK_PADDING
+from provenance import ProvenanceStore, parse_provenance
+from maskcache import parse_mask_cache, read_image
+from bitimage import BitImage
+
+# Script version
+VERSION = "1.4"
+
+STAGES = ("lines", "chunks", "glyphs")
+
+def page_lines(image, lines_dir_name):
+    """Stage 1: yield (line_name, start, end, line_image, gray_line) for every line of a page mask."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    for line_number, start, end, line_image in line_slices(image):
+        line_name = os.path.splitext(os.path.basename(line_path(lines_dir_name, line_number)))[0]
+        yield line_name, start, end, line_image, gray[start:end, :]
+
+def line_chunks(lines, logger):
+    """Stage 2: yield (line_name, chunk_number, x0, x1, padded_chunk, final) for every chunk of every line."""
+    for line_name, _, _, _, gray_line in lines:
+        for chunk_number, x0, x1, padded_chunk, final in chunk_slices(gray_line, logger):
+            yield line_name, chunk_number, x0, x1, padded_chunk, final
+
+def packed_page_lines(page, lines_dir_name):
+    """Stage 1 on a BitImage: yield (line_name, start, end, line, line) with the line still packed."""
+    for line_number, (start, end) in enumerate(line_positions(page.row_counts()), start=1):
+        line_name = os.path.splitext(os.path.basename(line_path(lines_dir_name, line_number)))[0]
+        line = page.crop(start, end)
+        yield line_name, start, end, line, line
+
+def packed_line_chunks(lines, logger):
+    """Stage 2 on BitImage lines: the chunks are cut from the packed line and unpacked one at a time."""
+    for line_name, _, _, _, line in lines:
+        for chunk_number, x0, x1, final in chunk_columns(profile_gaps(line.column_counts(), logger), line.width):
+            yield line_name, chunk_number, x0, x1, line.crop(0, line.height, x0, x1).to_gray(CHUNK_PADDING), final
+
+def chunk_glyphs(padded_chunk):
+    """Stage 3: yield (glyph_count, box, padded_glyph) for every glyph crop of a chunk."""
+    contours = find_glyph_contours(padded_chunk)
+    for (glyph_count, padded_glyph), contour in zip(glyph_crops(padded_chunk, contours), contours):
+        yield glyph_count, cv2.boundingRect(contour), padded_glyph
+
+def record_page(provenance, file_path, image, regions):
+    """Record the page and the regions cut at every stage, as the separate scripts do."""
+    height, width = image.shape[:2]
+    with ProvenanceStore(provenance) as store:
+        store.record_page(file_path, width, height)
+        for (parent, stage), children in regions.items():
+            store.replace_children(parent, stage, children)
+
+def process_page(file_path, input_dir, logger, write=("chunks",), provenance=None, mask_cache=False, packed=False):
+    """Stream one page mask through lines, chunks and (if written) glyphs.
+
+    Files are written only for the stages listed in write, under the same
+    directories and names that PT_lines, PT_chunks and PT_glyphs produce when
+    run one after another. Returns (lines, chunks, glyphs) counts.
+    With a provenance database the regions of every stage that ran are recorded in it.
+    With mask_cache the decoded page is memory-mapped from the mask cache.
+    With packed the page is kept as a BitImage and only chunks are unpacked;
+    the files written are the same for bilevel masks.
+    """
+    log_message(logger, f"Processing file: {os.path.basename(file_path)}")
+    if packed:
+        image = BitImage.read(file_path, use_cache=mask_cache)
+        lines_of, chunks_of = packed_page_lines, packed_line_chunks
+    else:
+        image = read_image(file_path, use_cache=mask_cache)  # Read as PT_lines does, so written lines are identical
+        lines_of, chunks_of = page_lines, line_chunks
+    if image is None:
+        log_message(logger, f"ERROR: Unable to read file {file_path}")
+        return 0, 0, 0
+
+    lines_dir = os.path.join(input_dir, f"{os.path.splitext(os.path.basename(file_path))[0]}_lines")
+    chunks_dir = os.path.join(lines_dir, "chunks")
+    counts = {stage: 0 for stage in STAGES}
+    regions = defaultdict(list)  # (parent, stage) -> (name, x, y, w, h, pad, path)
+
+    def written_lines():
+        for line_name, start, end, line_image, gray_line in lines_of(image, os.path.basename(lines_dir)):
+            counts["lines"] += 1
+            output_path = os.path.join(lines_dir, f"{line_name}.png")
+            if "lines" in write:
+                os.makedirs(lines_dir, exist_ok=True)
+                cv2.imwrite(output_path, line_image.to_bgr() if packed else line_image)
+            regions[os.path.basename(file_path), "lines"].append(
+                (f"{line_name}.png", 0, start, image.shape[1], end - start, 0,
+                 os.path.abspath(output_path) if "lines" in write else None))
+            yield line_name, start, end, line_image, gray_line
+
+    if "chunks" not in write and "glyphs" not in write:
+        for _ in written_lines():
+            pass
+    else:
+        for line_name, chunk_number, x0, x1, padded_chunk, final in chunks_of(written_lines(), logger):
+            counts["chunks"] += 1
+            chunk_dir = os.path.join(chunks_dir, f"{line_name}_chunks")
+            output_path = chunk_path(chunk_dir, line_name, chunk_number)
+            label = "Final chunk" if final else "Chunk"
+            regions[f"{line_name}.png", "chunks"].append(
+                (os.path.basename(output_path), x0, 0, x1 - x0, padded_chunk.shape[0] - 2 * CHUNK_PADDING, CHUNK_PADDING,
+                 os.path.abspath(output_path) if "chunks" in write else None))
+            if "chunks" in write:
+                os.makedirs(chunk_dir, exist_ok=True)
+                cv2.imwrite(output_path, padded_chunk)
+                log_message(logger, f"{label} {chunk_number}: Columns [{x0}:{x1}] saved to {output_path}",
+                            event="chunk", source=line_name, chunk=chunk_number, x0=x0, x1=x1, path=output_path)
+            else:
+                log_message(logger, f"{label} {chunk_number}: Columns [{x0}:{x1}] of {line_name}",
+                            event="chunk", source=line_name, chunk=chunk_number, x0=x0, x1=x1)
+
+            if "glyphs" in write:
+                glyph_dir = os.path.join(chunk_dir, "glyphs")
+                os.makedirs(glyph_dir, exist_ok=True)
+                base_name = os.path.splitext(os.path.basename(output_path))[0]
+                for glyph_count, (x, y, w, h), padded_glyph in chunk_glyphs(padded_chunk):
+                    counts["glyphs"] += 1
+                    output_file = glyph_path(glyph_dir, base_name, glyph_count)
+                    cv2.imwrite(output_file, padded_glyph)
+                    regions[os.path.basename(output_path), "glyphs"].append(
+                        (os.path.basename(output_file), x, y, w, h, GLYPH_PADDING, os.path.abspath(output_file)))
+
+    if provenance is not None:
+        record_page(provenance, file_path, image, regions)
+
+    log_message(logger, f"{os.path.basename(file_path)}: {counts['lines']} lines, "
+                          f"{counts['chunks']} chunks, {counts['glyphs']} glyphs")
+    return counts["lines"], counts["chunks"], counts["glyphs"]
+
+def process_directory(input_dir, write=("chunks",), jobs=1, log_options=None, provenance=None, mask_cache=False,
+                      packed=False):
+    """Stream every PNG page mask in the input directory through the pipeline."""
+    log_file = f"PT_pipeline_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+    with Logger(log_file, **(log_options or {})) as logger:
+        log_message(logger, f"Script version: {VERSION}")
+        log_message(logger, f"Processing input directory: {input_dir} (writing: {', '.join(write) or 'nothing'})")
+
+        file_paths = [os.path.join(input_dir, file_name) for file_name in sorted(os.listdir(input_dir))
+                      if file_name.lower().endswith('.png')]
+        process = partial(process_page, write=tuple(write), provenance=provenance, mask_cache=mask_cache,
+                          packed=packed)
+        _, elapsed = process_files(process, file_paths, input_dir, logger, jobs=jobs)
+        log_message(logger, throughput_message(len(file_paths), elapsed, jobs))
+
+if __name__ == "__main__":
+    log_options, args = parse_log_options(sys.argv[1:])
+    jobs, args = parse_jobs(args)
+    provenance, args = parse_provenance(args)
+    mask_cache, args = parse_mask_cache(args)
+    packed = "--packed" in args
+    args = [arg for arg in args if arg != "--packed"]
+    write = ("chunks",)
+    if "--write" in args:
+        index = args.index("--write")
+        write = tuple(args[index + 1].split(",")) if index + 1 < len(args) else ()
+        del args[index:index + 2]
+
+    if len(args) != 1 or not write or any(stage not in STAGES for stage in write):
+        print("Usage: python PT_pipeline.py <input_directory> [--write lines,chunks,glyphs] [--jobs N] [--provenance DB] [--mask-cache] [--packed] [--quiet | --verbose] [--log-format text|jsonl]")
+        sys.exit(1)
+
+    input_directory = args[0]
+
+    if not os.path.isdir(input_directory):
+        print(f"Error: {input_directory} is not a valid directory.")
+        sys.exit(1)
+
+    process_directory(input_directory, write=write, jobs=jobs, log_options=log_options, provenance=provenance,
+                      mask_cache=mask_cache, packed=packed)
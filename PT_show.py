@@ -4,10 +4,10 @@ import shutil
 from PyQt5.QtWidgets import QApplication, QWidget, QGridLayout, QLabel, QScrollArea, QMessageBox
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtCore import Qt
-import re
-from itertools import groupby
+from glyphpack import GlyphPack, is_pack
+from nameindex import parse_index_cache, parse_name, scan
 
-SCRIPT_VERSION = "6.2"
+SCRIPT_VERSION = "6.4"
 
 # Color and log mapping for each key
 KEY_ACTIONS = {
@@ -18,17 +18,20 @@ KEY_ACTIONS = {
 }
 
 class ImageGrid(QWidget):
-    def __init__(self, image_dir, batches, current_batch=0):
+    def __init__(self, image_dir, batches, current_batch=0, pack=None):
         super().__init__()
         self.image_dir = image_dir
         self.batches = batches
         self.current_batch = current_batch
         self.current_index = 0
         self.image_class = {}  # Store the class for each image
+        self.pack = pack  # Images come from this glyph archive instead of image_dir
+        # Classified images of an archive go to a directory named after it
+        self.sort_dir = os.path.splitext(image_dir)[0] if pack is not None else image_dir
 
         # Create subdirectories if not exist
         for _, subdir, _ in KEY_ACTIONS.values():
-            os.makedirs(os.path.join(image_dir, subdir), exist_ok=True)
+            os.makedirs(os.path.join(self.sort_dir, subdir), exist_ok=True)
 
         # Set focus policy to ensure key events are captured
         self.setFocusPolicy(Qt.StrongFocus)
@@ -43,10 +46,9 @@ class ImageGrid(QWidget):
 
         # Extract batch identifiers for the title
         batch_example = self.images[0] if self.images else "unknown"
-        match = re.match(r"m(\d+)_R_lines_(\d+)_chunk_\d+\.png", batch_example)
-        if match:
-            number1, number2 = match.groups()
-            self.setWindowTitle(f"Batch {self.current_batch + 1}: mask {number1} line {number2}")
+        chunk = parse_name(batch_example).get("chunks")
+        if chunk is not None:
+            self.setWindowTitle(f"Batch {self.current_batch + 1}: mask {chunk.mask:02d} line {chunk.line:02d}")
         else:
             self.setWindowTitle(f"Batch {self.current_batch + 1}: Unknown Format")
 
@@ -66,7 +68,7 @@ class ImageGrid(QWidget):
             row = index // self.max_col
             col = index % self.max_col
             label = QLabel(self)
-            pixmap = QPixmap(os.path.join(self.image_dir, image))
+            pixmap = self.load_pixmap(image)
             label.setPixmap(pixmap)
             image_width = max(image_width, pixmap.width())
             image_height = max(image_height, pixmap.height())
@@ -100,6 +102,14 @@ class ImageGrid(QWidget):
         self.resize(total_width, total_height)
         self.setFocus()
 
+    def load_pixmap(self, image):
+        """Load an image from the directory, or decode it from the archive without extracting it."""
+        if self.pack is None:
+            return QPixmap(os.path.join(self.image_dir, image))
+        pixmap = QPixmap()
+        pixmap.loadFromData(self.pack.read(image), "PNG")
+        return pixmap
+
     def update_selection(self, new_index):
         """Update the selection highlighting."""
         if 0 <= self.current_index < len(self.labels):
@@ -126,11 +136,19 @@ class ImageGrid(QWidget):
         for index, color in self.image_class.items():
             filename = self.images[index]
             _, subdir, _ = next((v for k, v in KEY_ACTIONS.items() if v[0] == color), (None, None, None))
-            if subdir:
+            if subdir and self.pack is not None:
+                # Extract the image and drop it from the archive, the counterpart of moving the file
+                with open(os.path.join(self.sort_dir, subdir, filename), 'wb') as f:
+                    f.write(self.pack.read(filename))
+                self.pack.remove(filename)
+                print(f"Moved: {filename} -> {subdir}")
+            elif subdir:
                 source = os.path.join(self.image_dir, filename)
                 destination = os.path.join(self.image_dir, subdir, filename)
                 shutil.move(source, destination)
                 print(f"Moved: {filename} -> {subdir}")
+        if self.pack is not None:
+            self.pack.flush()
 
     def keyPressEvent(self, event):
         """Handle keyboard input."""
@@ -142,37 +160,44 @@ class ImageGrid(QWidget):
             self.close()
             next_batch = self.current_batch + 1
             if next_batch < len(self.batches):
-                self.new_window = ImageGrid(self.image_dir, self.batches, next_batch)
+                self.new_window = ImageGrid(self.image_dir, self.batches, next_batch, pack=self.pack)
                 self.new_window.show()
             else:
                 print("All images processed.")
                 QMessageBox.information(None, "Completed", "All images have been classified.")
                 QApplication.quit()
 
-def group_files(files):
-    grouped = []
-    def key_func(filename):
-        match = re.match(r"m(\d+)_R_lines_(\d+)_chunk_\d+\.png", filename)
-        return (int(match.group(1)), int(match.group(2))) if match else (None, None)
-    files.sort(key=key_func)
-    for _, group in groupby(files, key=key_func):
-        grouped.append(sorted(list(group)))
-    return grouped
+def group_files(index):
+    """One batch per mask line of chunks, in line order, then one per <prefix>_NN.png prefix; the rest form a last batch."""
+    grouped = [[chunk.name for chunk in chunks] for _, chunks in sorted(index.chunks_by_line().items())]
+    batched = {chunk.name for chunk in index.chunks}
+    for prefix, records in sorted(index.numbered_by_prefix().items()):
+        names = [record.name for record in records if record.name not in batched]
+        if names:
+            grouped.append(names)
+            batched.update(names)
+    others = [name for name in index.images() if name not in batched]
+    return grouped + ([others] if others else [])
 
 def main():
     print(f"Script version: {SCRIPT_VERSION}")
-    image_dir = sys.argv[1]
-    files = [f for f in os.listdir(image_dir) if f.lower().endswith('.png')]
-    if not files:
+    index_cache, args = parse_index_cache(sys.argv[1:])
+    image_dir = args[0]
+    pack = GlyphPack(image_dir, "a") if is_pack(image_dir) else None
+    index = scan(image_dir, cache=index_cache)
+    if not index.images():
         print("All images processed.")
         QMessageBox.information(None, "Completed", "All images have been classified.")
         sys.exit(0)
 
-    batches = group_files(files)
+    batches = group_files(index)
     app = QApplication(sys.argv)
-    window = ImageGrid(image_dir, batches)
+    window = ImageGrid(image_dir, batches, pack=pack)
     window.show()
-    sys.exit(app.exec_())
+    status = app.exec_()
+    if pack is not None:
+        pack.close()
+    sys.exit(status)
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,36 @@
 #!/usr/bin/env python3
 import os
 import sys
+import json
+import time
 import shutil
+import threading
 import subprocess
+from datetime import datetime
+from functools import partial
+from ptlog import QUIET
+from parallel import parse_jobs, pool_context
+from manifest import atomic_write_bytes, write_if_changed
+from nameindex import parse_name, scan
+from stagegraph import StageGraph
+import batch_join_chunks
+import PT_chunk_split
+import renumber_glyphs
+import glyphids2tex
+import glyph2tex
+import tablebuild
 
-VERSION = "1.1"
+VERSION = "1.5"
+
+# Working directories and files, relative to the directory PTglyphs runs in
+GLYPH_DIR = 'glyph-test'
+TEX_DIR = 'glyphs4tex/'
+META_FILE = 'meta.csv'
+TABLES_DIR = 'tables'
+APPROVALS_FILE = 'PTglyphs_approvals.json'
+
+WATCH_INTERVAL = 1.0  # Seconds between polls
+WATCH_SETTLE = 0.2  # A change is handled once the directory stays the same this long
 
 def log(msg):
     print(f"[PTglyphs v{VERSION}] {msg}")
@@ -16,100 +42,323 @@ def error_exit(msg):
 def is_dir_empty(path):
     return not any(os.scandir(path))
 
-def confirm(prompt, dry_run=False):
-    if dry_run:
-        log(f"[dry-run] {prompt} -- assuming 'yes'")
-        return True
-    resp = input(f"{prompt} [y/N]: ").strip().lower()
-    return resp in ('y', 'yes')
+class Approvals:
+    """The answers to the "is the output acceptable?" questions, recorded in a JSON file.
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python3 PTglyphs.py <dir> [--dry-run]")
-        sys.exit(1)
+    Every answer is saved with the files it was given for. A non-interactive
+    run asks nobody: it accepts an output only if the same files (names and
+    sizes) were approved before, and treats anything else as a rejection.
+    """
 
-    base_dir = sys.argv[1]
-    dry_run = '--dry-run' in sys.argv
+    def __init__(self, path=APPROVALS_FILE, interactive=True, dry_run=False):
+        self.path = path
+        self.interactive = interactive
+        self.dry_run = dry_run
+        self.lock = threading.Lock()  # Stages run concurrently; one question at a time
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.records = json.load(f)
+        except FileNotFoundError:
+            self.records = {}
+        except ValueError:
+            error_exit(f"'{path}' is not a valid approvals file.")
 
-    glyph_test = 'glyph-test'
-    if os.path.exists(glyph_test) and not is_dir_empty(glyph_test):
-        error_exit("'glyph-test' directory is not empty.")
+    def ask(self, key, prompt, paths):
+        """Return whether the output made of paths is acceptable, asking or looking up the recorded answer."""
+        files = sorted([os.path.basename(path), os.path.getsize(path)] for path in paths if os.path.exists(path))
+        with self.lock:
+            if self.dry_run:
+                log(f"[dry-run] {prompt} -- assuming 'yes'")
+                return True
+            recorded = self.records.get(key)
+            if not self.interactive:
+                approved = recorded is not None and recorded["approved"] and recorded["files"] == files
+                log(f"{prompt} -- {'approved' if approved else 'no approval'} recorded in {self.path} for these files")
+                return approved
+            approved = input(f"{prompt} [y/N]: ").strip().lower() in ('y', 'yes')
+            self.records[key] = {"approved": approved, "files": files,
+                                 "time": datetime.now().isoformat(timespec="seconds")}
+            atomic_write_bytes(self.path, json.dumps(self.records, indent=1).encode('utf-8'))
+            return approved
 
-    # Step 2: Process join directory
-    join_dir = os.path.join(base_dir, 'join')
-    if os.path.exists(join_dir):
-        if is_dir_empty(join_dir):
-            error_exit(f"'{join_dir}' exists but is empty.")
+def copy_glyph_pngs(prefixes=None):
+    """Copy the PNGs of GLYPH_DIR (those starting with one of prefixes, if given) to tables/glyphs."""
+    for f in os.listdir(GLYPH_DIR):
+        if f.endswith('.png') and (prefixes is None or f.startswith(prefixes)):
+            shutil.copy2(os.path.join(GLYPH_DIR, f), os.path.join(TABLES_DIR, 'glyphs', f))
+
+def sync_tex(prefixes=None):
+    """Bring tables/ up to date with the files of TEX_DIR (those starting with one of prefixes, if given).
+
+    A file is copied when tables/ lacks it or holds different content, so a
+    table whose TeX was regenerated is never left stale there. Returns the names copied.
+    """
+    copied = []
+    for root, _, files in os.walk(TEX_DIR):
+        target_root = os.path.join(TABLES_DIR, os.path.relpath(root, TEX_DIR))
+        for f in sorted(files):
+            if prefixes is None or f.startswith(prefixes):
+                with open(os.path.join(root, f), 'rb') as source:
+                    data = source.read()
+                os.makedirs(target_root, exist_ok=True)
+                if write_if_changed(os.path.join(target_root, f), data):
+                    copied.append(os.path.relpath(os.path.join(root, f), TEX_DIR))
+    return copied
+
+def snapshot(base_dir):
+    """Return {chunk name: (table, size, mtime_ns)} for the chunks renumber_glyphs reads, plus the metadata file."""
+    state = {}
+    with os.scandir(base_dir) as entries:
+        for entry in entries:
+            chunk = parse_name(entry.name).get("chunks")
+            if chunk is not None and entry.is_file():
+                st = entry.stat()
+                state[entry.name] = (chunk.mask, st.st_size, st.st_mtime_ns)
+    if os.path.exists(META_FILE):
+        state[META_FILE] = (None, os.path.getsize(META_FILE), os.stat(META_FILE).st_mtime_ns)
+    return state
+
+def changed_tables(previous, current):
+    """Return the tables whose chunks were added, removed or modified; all of them if the metadata changed."""
+    if previous.get(META_FILE) != current.get(META_FILE):
+        return {table for table, _, _ in list(previous.values()) + list(current.values()) if table is not None}
+    tables = set()
+    for name in previous.keys() | current.keys():
+        if previous.get(name) != current.get(name):
+            tables.update(state[0] for state in (previous.get(name), current.get(name)) if state is not None)
+    return tables
 
-        log(f"Running batch_join_chunks.py on {join_dir}")
-        subprocess.run(['python3', 'batch_join_chunks.py', join_dir] + (['--dry-run'] if dry_run else []), check=True)
+def regenerate_tables(base_dir, tables):
+    """Renumber the chunks of the given tables into GLYPH_DIR and regenerate their TeX, leaving other tables alone.
 
-        # Check if + output exists
-        joined_files = [f for f in os.listdir(join_dir) if '+' in f]
-        if not joined_files:
-            error_exit("No joined files (with '+') found in join directory.")
+    Returns the tables whose TeX changed, or None if renumbering failed.
+    """
+    prefixes = tuple(f"t{table:02d}_" for table in tables)
+    tables_glyph_dir = os.path.join(TABLES_DIR, 'glyphs')
+    for directory in (GLYPH_DIR, tables_glyph_dir):
+        if os.path.isdir(directory):
+            for glyph in scan(directory).glyphs:
+                if glyph.table in tables:
+                    os.remove(os.path.join(directory, glyph.name))
 
-        log("Joined files:")
-        for f in joined_files:
-            log(f"  {f}")
+    journal = renumber_glyphs.rename_files(base_dir, GLYPH_DIR, log_options={"verbosity": QUIET}, tables=tables,
+                                           rename_options={"journal_path": os.path.join(GLYPH_DIR, "rename_journal_watch.json")})
+    if journal is None:
+        log(f"ERROR: renumbering failed, see {os.path.join(GLYPH_DIR, 'renumber_log.txt')}")
+        return None
+    changed = glyphids2tex.generate_tex_files(GLYPH_DIR, TEX_DIR, META_FILE, tables=tables) | \
+        glyph2tex.generate_tex_files(GLYPH_DIR, TEX_DIR, tables=tables)
+    remaining = set(scan(GLYPH_DIR).glyphs_by_table())
+    for table in tables - remaining:  # All of its chunks are gone
+        for suffix in ("_glyphs.tex", "_glyphids.tex"):
+            tex_path = os.path.join(TEX_DIR, f"t{table:02d}{suffix}")
+            if os.path.exists(tex_path):
+                os.remove(tex_path)
+                changed.add(table)
+
+    # The same copies as a full run: the tables' PNGs, and TeX files that differ in tables/
+    if os.path.isdir(tables_glyph_dir):
+        copy_glyph_pngs(prefixes)
+    sync_tex(prefixes)
+    return changed
+
+def watch(base_dir, interval=WATCH_INTERVAL):
+    """Poll base_dir and regenerate the glyphs and TeX of the tables whose chunks change, until interrupted.
+
+    Every table is regenerated once at the start. LaTeX is not run; compile tables/PTfonts.tex when needed.
+    """
+    os.makedirs(GLYPH_DIR, exist_ok=True)
+    os.makedirs(TEX_DIR, exist_ok=True)
+    previous = snapshot(base_dir)
+    start = time.perf_counter()
+    tables = {table for table, _, _ in previous.values() if table is not None}
+    regenerate_tables(base_dir, tables)
+    log(f"Regenerated {len(tables)} tables in {time.perf_counter() - start:.2f} s; "
+        f"watching {base_dir} every {interval:g} s (Ctrl-C to stop)")
+    try:
+        while True:
+            time.sleep(interval)
+            current = snapshot(base_dir)
+            if current == previous:
+                continue
+            while True:  # Let a burst of moves (e.g. a batch classified in PT_show) finish first
+                time.sleep(WATCH_SETTLE)
+                settled = snapshot(base_dir)
+                if settled == current:
+                    break
+                current = settled
+            tables = changed_tables(previous, current)
+            start = time.perf_counter()
+            changed = regenerate_tables(base_dir, tables)
+            if changed is not None:
+                log(f"Regenerated {', '.join(f't{table:02d}' for table in sorted(tables))} "
+                    f"in {time.perf_counter() - start:.2f} s; TeX changed for "
+                    f"{', '.join(f't{table:02d}' for table in sorted(changed)) or 'none'}")
+            previous = current
+    except KeyboardInterrupt:
+        log("Stopped watching.")
+
+
+# join and split run side by side on StageGraph threads, so their pools must not fork this process
+def join_stage(join_dir, dry_run, jobs):
+    log(f"Running batch_join_chunks on {join_dir}")
+    batch_join_chunks.process_directory(join_dir, dry_run=dry_run, jobs=jobs, mp_context=pool_context())
+
+def copy_joins_stage(base_dir, join_dir, approvals, dry_run):
+    # Check if + output exists
+    joined_files = [f for f in os.listdir(join_dir) if '+' in f]
+    if not joined_files:
+        error_exit("No joined files (with '+') found in join directory.")
+
+    log("Joined files:")
+    for f in joined_files:
+        log(f"  {f}")
+
+    if not approvals.ask("join", "Is the join output acceptable?", [os.path.join(join_dir, f) for f in joined_files]):
+        error_exit("User rejected join output.")
+
+    for f in joined_files:
+        src = os.path.join(join_dir, f)
+        dst = os.path.join(base_dir, f)
+        log(f"Copying {src} -> {dst}")
+        if not dry_run:
+            shutil.copy2(src, dst)
+
+def split_stage(split_dir, dry_run, jobs):
+    log(f"Running PT_chunk_split on {split_dir}")
+    if not dry_run:
+        PT_chunk_split.process_directory(split_dir, jobs=jobs, mp_context=pool_context())
 
-        if not confirm("Is the join output acceptable?", dry_run=dry_run):
-            error_exit("User rejected join output.")
+def copy_splits_stage(base_dir, split_dir, approvals, dry_run):
+    output_dir = os.path.join(split_dir, 'output')
+    if dry_run and not os.path.isdir(output_dir):
+        log(f"[dry-run] No {output_dir} yet; nothing to copy.")
+        return
+    split_files = [f for f in os.listdir(output_dir) if not f.endswith('contours.png')]
 
-        for f in joined_files:
-            src = os.path.join(join_dir, f)
-            dst = os.path.join(base_dir, f)
-            log(f"Copying {src} -> {dst}")
-            if not dry_run:
-                shutil.copy2(src, dst)
+    if not approvals.ask("split", "Is the split output acceptable?", [os.path.join(output_dir, f) for f in split_files]):
+        error_exit("User rejected split output.")
 
-    # Step 3: Process split directory
+    for f in split_files:
+        src = os.path.join(output_dir, f)
+        dst = os.path.join(base_dir, f)
+        log(f"Copying {src} -> {dst}")
+        if not dry_run:
+            shutil.copy2(src, dst)
+
+def renumber_stage(base_dir):
+    if renumber_glyphs.rename_files(base_dir, GLYPH_DIR) is None:
+        error_exit(f"Renumbering failed, see {os.path.join(GLYPH_DIR, 'renumber_log.txt')}")
+
+def sync_tex_stage():
+    copied = sync_tex()
+    log(f"Updated {len(copied)} TeX files in {TABLES_DIR}/" + (f": {', '.join(copied)}" if copied else ""))
+
+def latex_stage(per_table=False, jobs=1):
+    if per_table:
+        try:
+            tablebuild.build(os.path.join(TABLES_DIR, 'PTfonts.tex'), jobs=jobs, log=log)
+        except RuntimeError as e:
+            error_exit(str(e))
+        return
+    subprocess.run(['xelatex', '-file-line-error', '-interaction=nonstopmode', 'PTfonts.tex'], cwd=TABLES_DIR, check=True)
+
+def build_graph(base_dir, approvals, dry_run=False, jobs=1, per_table=False):
+    """Return the stages of a full run: join and split side by side, then renumbering, TeX and LaTeX.
+
+    With per_table the LaTeX document is built one table at a time by tablebuild.
+    """
+    graph = StageGraph()
+    inputs = []  # The stages that put chunks into base_dir
+
+    # Process join directory
+    join_dir = os.path.join(base_dir, 'join')
+    if os.path.exists(join_dir):
+        if is_dir_empty(join_dir):
+            error_exit(f"'{join_dir}' exists but is empty.")
+        graph.add("join", partial(join_stage, join_dir, dry_run, jobs))
+        graph.add("copy joins", partial(copy_joins_stage, base_dir, join_dir, approvals, dry_run), after=["join"])
+        inputs.append("copy joins")
+
+    # Process split directory
     split_dir = os.path.join(base_dir, 'split')
     if os.path.exists(split_dir):
         if is_dir_empty(split_dir):
             error_exit(f"'{split_dir}' exists but is empty.")
+        graph.add("split", partial(split_stage, split_dir, dry_run, jobs))
+        graph.add("copy splits", partial(copy_splits_stage, base_dir, split_dir, approvals, dry_run), after=["split"])
+        inputs.append("copy splits")
 
-        files = os.listdir(split_dir)
-        if not files:
-            error_exit(f"'{split_dir}' has no files.")
+    if dry_run:
+        return graph
 
-        log(f"Running PT_chunk_split.py on {split_dir}")
-        if not dry_run:
-            subprocess.run(['python3', 'PT_chunk_split.py', split_dir], check=True)
+    # Glyph processing; the two TeX generators and the PNG copy only read GLYPH_DIR
+    if not os.path.isfile(META_FILE):
+        error_exit(f"'{META_FILE}' is not a valid file.")
+    graph.add("renumber", partial(renumber_stage, base_dir), after=inputs)
+    graph.add("glyphids2tex", partial(glyphids2tex.generate_tex_files, GLYPH_DIR, TEX_DIR, META_FILE), after=["renumber"])
+    graph.add("glyph2tex", partial(glyph2tex.generate_tex_files, GLYPH_DIR, TEX_DIR), after=["renumber"])
+    graph.add("copy glyphs", copy_glyph_pngs, after=["renumber"])
+    graph.add("sync tex", sync_tex_stage, after=["glyphids2tex", "glyph2tex"])
 
-        if not confirm("Is the split output acceptable?", dry_run=dry_run):
-            error_exit("User rejected split output.")
+    # Compile TeX
+    graph.add("latex", partial(latex_stage, per_table, jobs), after=["copy glyphs", "sync tex"])
+    return graph
 
-        output_dir = os.path.join(split_dir, 'output')
-        for f in os.listdir(output_dir):
-            if f.endswith('contours.png'):
-                continue
-            src = os.path.join(output_dir, f)
-            dst = os.path.join(base_dir, f)
-            log(f"Copying {src} -> {dst}")
-            if not dry_run:
-                shutil.copy2(src, dst)
+def parse_approvals(args):
+    """Remove '--approvals FILE' and '--non-interactive' from an argument list.
 
-    # Step 4: Run glyph processing scripts
-    if not dry_run:
-        subprocess.run(['python3', 'renumber_glyphs.py', base_dir, 'glyph-test'], check=True)
-        subprocess.run(['python3', 'glyphids2tex.py', 'glyph-test', 'glyphs4tex/', 'meta.csv'], check=True)
-        subprocess.run(['python3', 'glyph2tex.py', 'glyph-test', 'glyphs4tex/'], check=True)
-
-        # Copy PNGs
-        for f in os.listdir('glyph-test'):
-            if f.endswith('.png'):
-                shutil.copy2(os.path.join('glyph-test', f), os.path.join('tables', 'glyphs', f))
-
-        # Copy only new TeX files
-        subprocess.run(['rsync', '-av', '--ignore-existing', 'glyphs4tex/', 'tables/'], check=True)
-
-        # Step 5: Compile TeX
-        os.chdir('tables')
-        subprocess.run(['xelatex', '-file-line-error', '-interaction=nonstopmode', 'PTfonts.tex'], check=True)
-        os.chdir('..')
-    else:
+    Returns ((approvals file, whether to ask), remaining arguments).
+    """
+    args = list(args)
+    path = APPROVALS_FILE
+    if "--approvals" in args:
+        index = args.index("--approvals")
+        if index + 1 >= len(args):
+            error_exit("--approvals needs a file name.")
+        path = args[index + 1]
+        del args[index:index + 2]
+    interactive = "--non-interactive" not in args
+    return (path, interactive), [arg for arg in args if arg != "--non-interactive"]
+
+def main():
+    jobs, args = parse_jobs(sys.argv[1:])
+    (approvals_path, interactive), args = parse_approvals(args)
+    if len(args) < 1:
+        print("Usage: python3 PTglyphs.py <dir> [--dry-run] [--jobs N] [--per-table] [--approvals FILE] [--non-interactive]")
+        print("       python3 PTglyphs.py <dir> --watch [--interval SECONDS]")
+        sys.exit(1)
+
+    base_dir = args[0]
+    dry_run = '--dry-run' in args
+
+    if '--watch' in args:
+        interval = WATCH_INTERVAL
+        if '--interval' in args:
+            try:
+                interval = float(args[args.index('--interval') + 1])
+            except (IndexError, ValueError):
+                error_exit("--interval needs a number of seconds.")
+        if not os.path.isdir(base_dir):
+            error_exit(f"'{base_dir}' is not a directory.")
+        watch(base_dir, interval)
+        return
+
+    if os.path.exists(GLYPH_DIR) and not is_dir_empty(GLYPH_DIR):
+        error_exit(f"'{GLYPH_DIR}' directory is not empty.")
+
+    approvals = Approvals(approvals_path, interactive=interactive, dry_run=dry_run)
+    graph = build_graph(base_dir, approvals, dry_run=dry_run, jobs=jobs, per_table='--per-table' in args)
+    start = time.perf_counter()
+    graph.run(on_start=lambda name: log(f"Stage {name} started"),
+              on_finish=lambda name, seconds: log(f"Stage {name} finished in {seconds:.2f} s"))
+    if dry_run:
         log("[dry-run] Skipping glyph processing and LaTeX compilation.")
+    log(f"Ran {len(graph)} stages in {time.perf_counter() - start:.2f} s")
+    if not dry_run:
+        changed = graph.results["glyphids2tex"] | graph.results["glyph2tex"]
+        log(f"TeX changed for {len(changed)} tables" +
+            (f": {', '.join(f't{table:02d}' for table in sorted(changed))}" if changed else ""))
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,21 @@
+import io
 import os
 import re
 import cv2
+import time
+import struct
+import contextlib
 import numpy as np
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from parallel import parse_jobs
+from provenance import ProvenanceStore, parse_provenance
+from nameindex import parse_index_cache, scan
 
 # Script version
-VERSION = "1.1"
+VERSION = "1.4"
+
+CHUNK_PADDING = 2  # Padding PT_chunks puts around every chunk
 
 def log(msg):
     print(f"[batch_join_chunks v{VERSION}] {msg}")
@@ -22,7 +32,10 @@ def find_consecutive_groups(files):
         prefix, number = extract_prefix_and_number(f)
         if prefix is not None:
             grouped[prefix].append((number, f))
+    return consecutive_runs(grouped)
 
+def consecutive_runs(grouped):
+    """Return (prefix, names) for every run of two or more consecutive numbers in {prefix: [(number, name), ...]}."""
     sequences = []
     for prefix, numbered_files in grouped.items():
         numbered_files.sort()
@@ -40,7 +53,7 @@ def find_consecutive_groups(files):
             sequences.append((prefix, group))
     return sequences
 
-def remove_horizontal_padding(img, side='both', pad=2):
+def remove_horizontal_padding(img, side='both', pad=CHUNK_PADDING):
     h, w = img.shape[:2]
     if side == 'left':
         return img[:, pad:]
@@ -51,58 +64,125 @@ def remove_horizontal_padding(img, side='both', pad=2):
     else:
         raise ValueError("Invalid side argument")
 
+def png_size(path):
+    """Return (width, height) from the IHDR chunk of a PNG file, or None if it is not a PNG."""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+    if len(header) < 24 or header[:8] != b'\x89PNG\r\n\x1a\n' or header[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', header[16:24])
+
+def trimmed_columns(i, count, width, pad=CHUNK_PADDING):
+    """Return the (start, stop) columns kept of the i-th of count chunks: inner paddings are removed."""
+    if i == 0:
+        return 0, width - pad
+    elif i == count - 1:
+        return pad, width
+    return pad, width - pad
+
 def join_sequence(filepaths, output_path, dry_run=False):
+    """Join chunk files side by side without their inner paddings.
+
+    Returns the (start, stop) columns kept of each file, or None if nothing was written.
+    """
     if dry_run:
         log(f"[dry-run] Would join {len(filepaths)} files into {output_path}")
         return
 
-    imgs = []
-    for i, fp in enumerate(filepaths):
+    # Size the joined image from the PNG headers, so every chunk is copied once into one canvas
+    sizes = []
+    for fp in filepaths:
+        size = png_size(fp)
+        if size is None:
+            log(f"Failed to read {fp}")
+            return
+        sizes.append(size)
+    columns = [trimmed_columns(i, len(filepaths), width) for i, (width, _) in enumerate(sizes)]
+    min_height = min(height for _, height in sizes)
+    joined = np.empty((min_height, sum(stop - start for start, stop in columns)), dtype=np.uint8)
+
+    x = 0
+    for fp, (width, height), (start, stop) in zip(filepaths, sizes, columns):
         img = cv2.imread(fp, cv2.IMREAD_GRAYSCALE)
-        if img is None:
+        if img is None or img.shape != (height, width):
             log(f"Failed to read {fp}")
             return
-        if i == 0:
-            img = remove_horizontal_padding(img, side='right')
-        elif i == len(filepaths) - 1:
-            img = remove_horizontal_padding(img, side='left')
-        else:
-            img = remove_horizontal_padding(img, side='both')
-        imgs.append(img)
-
-    # Match heights if needed
-    min_height = min(img.shape[0] for img in imgs)
-    imgs_resized = [cv2.resize(im, (im.shape[1], min_height)) for im in imgs]
-
-    joined = np.hstack(imgs_resized)
+        img = img[:, start:stop]
+        # Match heights if needed
+        if height != min_height:
+            img = cv2.resize(img, (img.shape[1], min_height))
+            log(f"Resized {os.path.basename(fp)} from height {height} to {min_height}")
+        joined[:, x:x + img.shape[1]] = img
+        x += img.shape[1]
+
     cv2.imwrite(output_path, joined)
     log(f"Saved joined file: {output_path}")
-
-def process_directory(directory, dry_run=False):
-    files = sorted(f for f in os.listdir(directory) if f.lower().endswith(".png"))
-    sequences = find_consecutive_groups(files)
+    return columns
+
+def _join_with_captured_output(task):
+    """Join one sequence in a pool worker; its messages are returned to be printed in order."""
+    filepaths, output_path, dry_run = task
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        joined = join_sequence(filepaths, output_path, dry_run=dry_run)
+    return joined, output.getvalue()
+
+def process_directory(directory, dry_run=False, provenance=None, jobs=1, index_cache=False, mp_context=None):
+    """Join every run of consecutive chunks in the directory, in a pool of jobs processes if jobs > 1.
+
+    mp_context is the multiprocessing context of the pool (see parallel.pool_context()).
+    """
+    store = ProvenanceStore(provenance) if provenance is not None and not dry_run else None
+    numbered = scan(directory, cache=index_cache).numbered_by_prefix()
+    sequences = consecutive_runs({prefix: [(record.number, record.name) for record in records]
+                                  for prefix, records in numbered.items()})
     if not sequences:
         log("No consecutive sequences found.")
         return
 
+    tasks = []
     for prefix, group in sequences:
         first_num = extract_prefix_and_number(group[0])[1]
         last_num = extract_prefix_and_number(group[-1])[1]
         output_name = f"{prefix}_{first_num:02d}+{last_num:02d}.png"
-        output_path = os.path.join(directory, output_name)
-        join_sequence([os.path.join(directory, f) for f in group], output_path, dry_run=dry_run)
+        tasks.append(([os.path.join(directory, f) for f in group], os.path.join(directory, output_name), dry_run))
+
+    start = time.perf_counter()
+    if jobs <= 1:
+        results = [join_sequence(*task) for task in tasks]
+    else:
+        results = []
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context) as pool:
+            for joined, text in pool.map(_join_with_captured_output, tasks):
+                print(text, end="")  # The messages of each sequence, in directory order
+                results.append(joined)
+
+    for (_, output_path, _), (_, group), columns in zip(tasks, sequences, results):
+        if columns and store is not None:
+            output_name = os.path.basename(output_path)
+            # The joined file puts the kept columns of the chunks side by side, without the gaps between them
+            if not store.record_join(group, output_name, columns, path=os.path.abspath(output_path), pad=CHUNK_PADDING):
+                log(f"No provenance recorded for {output_name}: its chunks are not all in {provenance}")
+
+    log(f"Joined {len(tasks)} sequences in {time.perf_counter() - start:.2f} s with {jobs} job(s)")
+
+    if store is not None:
+        store.close()
 
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) not in [2, 3]:
-        print("Usage: python batch_join_chunks.py <directory> [--dry-run]")
+    provenance, args = parse_provenance(sys.argv[1:])
+    jobs, args = parse_jobs(args)
+    index_cache, args = parse_index_cache(args)
+    if len(args) not in [1, 2]:
+        print("Usage: python batch_join_chunks.py <directory> [--dry-run] [--jobs N] [--index-cache] [--provenance DB]")
         sys.exit(1)
 
-    input_dir = sys.argv[1]
-    dry_run = '--dry-run' in sys.argv
+    input_dir = args[0]
+    dry_run = '--dry-run' in args
 
     if not os.path.isdir(input_dir):
         print(f"Error: {input_dir} is not a valid directory.")
         sys.exit(1)
 
-    process_directory(input_dir, dry_run=dry_run)
+    process_directory(input_dir, dry_run=dry_run, provenance=provenance, jobs=jobs, index_cache=index_cache)
@@ -0,0 +1,308 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+from datetime import datetime
+from collections import defaultdict
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "MOVED"))
+import PT_lines
+import PT_chunks
+import PT_chunk_split
+import batch_join_chunks
+import projection
+import bitimage
+from manifest import atomic_imwrite
+from ptlog import QUIET, Logger
+
+# Script version
+VERSION = "1.1"
+
+FIXED_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "4split", "output")
+RESULTS_FILE = "benchmark_results.jsonl"
+
+# Synthetic page defaults: a glyph table of lines x slots, density is the share of filled slots
+PAGE_DEFAULTS = {"width": 1600, "height": 2200, "lines": 10, "density": 0.7, "pages": 2, "seed": 0}
+
+# Stage -> module whose VERSION the timing belongs to
+STAGE_MODULES = {
+    "lines": PT_lines,
+    "lines_packed": bitimage,
+    "gaps": PT_chunks,
+    "gaps_packed": bitimage,
+    "horizontal_sums": None,  # MOVED/segment_character_table.py has no VERSION
+    "horizontal_sums_numpy": projection,
+    "chunk_split": PT_chunk_split,
+    "join": batch_join_chunks,
+}
+STAGES = tuple(STAGE_MODULES)
+
+def synthetic_page(width, height, lines, density, seed=0):
+    """Return a binary glyph-table mask: black glyphs on white in evenly spaced lines.
+
+    Glyphs are filled blobs, rings (with holes) and rings with a dot inside,
+    so the contour and component code sees nesting as on real tables.
+    """
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width), 255, dtype=np.uint8)
+    pitch = height // (lines + 1)
+    glyph = max(8, int(pitch * 0.6))
+    slots = max(1, (width - glyph) // (glyph + glyph // 2))
+    for line in range(lines):
+        top = pitch // 2 + line * pitch
+        for slot in np.flatnonzero(rng.random(slots) < density):
+            cx = glyph // 2 + 4 + slot * (glyph + glyph // 2)
+            cy = top + glyph // 2 + int(rng.integers(-glyph // 8, glyph // 8 + 1))
+            axes = (int(rng.integers(glyph // 4, glyph // 2)), int(rng.integers(glyph // 4, glyph // 2)))
+            kind = rng.integers(3)
+            cv2.ellipse(page, (cx, cy), axes, 0, 0, 360, 0, -1 if kind == 0 else max(2, glyph // 10))
+            if kind == 2:
+                cv2.circle(page, (cx, cy), max(1, glyph // 12), 0, -1)
+    return page
+
+def prepare_synthetic(work_dir, width, height, lines, density, pages, seed):
+    """Write synthetic pages and derive the lines, chunks and chunk sequences the stages work on."""
+    corpus = {"pages": [], "lines": [], "chunks": [], "sequences": []}
+    page_dir = os.path.join(work_dir, "pages")
+    os.makedirs(page_dir)
+    for number in range(1, pages + 1):
+        page = synthetic_page(width, height, lines, density, seed + number)
+        page_path = os.path.join(page_dir, f"m{number:02d}_R.png")
+        cv2.imwrite(page_path, page)
+        corpus["pages"].append(page_path)
+        for line_number, _, _, line_image in PT_lines.line_slices(page):
+            corpus["lines"].append(line_image)
+            chunk_dir = os.path.join(work_dir, "chunks", f"m{number:02d}_R_lines_{line_number:02d}")
+            os.makedirs(chunk_dir)
+            paths = []
+            for chunk_number, _, _, padded_chunk, _ in PT_chunks.chunk_slices(line_image, Logger(None, verbosity=QUIET)):
+                paths.append(PT_chunks.chunk_path(chunk_dir, os.path.basename(chunk_dir), chunk_number))
+                cv2.imwrite(paths[-1], padded_chunk)
+            corpus["chunks"].extend(paths)
+            corpus["sequences"].extend(paths[i:i + 3] for i in range(0, len(paths) - 2, 3))
+    return corpus
+
+def prepare_fixed(work_dir):
+    """Use the split glyphs of 4split/output as lines and chunks; the pieces of one chunk form a sequence."""
+    corpus = {"pages": [], "lines": [], "chunks": [], "sequences": []}
+    groups = defaultdict(list)
+    for file_name in sorted(os.listdir(FIXED_CORPUS)):
+        if not file_name.lower().endswith(".png") or file_name.endswith("_contours.png"):
+            continue
+        path = os.path.join(FIXED_CORPUS, file_name)
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            continue
+        corpus["lines"].append(image)
+        corpus["chunks"].append(path)
+        if image.shape[1] > 2 * batch_join_chunks.CHUNK_PADDING:  # Narrower pieces are empty once unpadded
+            groups[file_name.rsplit("-", 1)[0]].append(path)
+    corpus["sequences"] = [paths for paths in groups.values() if len(paths) > 1]
+    return corpus
+
+def run_lines(corpus, out_dir):
+    for page_path in corpus["pages"]:
+        PT_lines.split_into_lines(cv2.imread(page_path), out_dir)
+    return len(corpus["pages"])
+
+def run_lines_packed(corpus, out_dir):
+    for page_path in corpus["pages"]:
+        page = bitimage.BitImage.read(page_path)
+        for line_number, (start, end) in enumerate(PT_lines.line_positions(page.row_counts()), start=1):
+            atomic_imwrite(PT_lines.line_path(out_dir, line_number), page.crop(start, end).to_bgr())
+    return len(corpus["pages"])
+
+def run_gaps(corpus, out_dir):
+    logger = Logger(None, verbosity=QUIET)
+    for line_image in corpus["lines"]:
+        PT_chunks.find_vertical_gaps(line_image, logger)
+    return len(corpus["lines"])
+
+def run_gaps_packed(corpus, out_dir):
+    logger = Logger(None, verbosity=QUIET)
+    for line in corpus["packed_lines"]:
+        PT_chunks.profile_gaps(line.column_counts(), logger)
+    return len(corpus["packed_lines"])
+
+def run_horizontal_sums(corpus, out_dir):
+    from segment_character_table import calculate_horizontal_sums
+    for qimage in corpus["qimages"]:
+        calculate_horizontal_sums(qimage)
+    return len(corpus["qimages"])
+
+def run_horizontal_sums_numpy(corpus, out_dir):
+    from segment_character_table import qimage_to_ink_array
+    for qimage in corpus["qimages"]:
+        projection.ink_profile(qimage_to_ink_array(qimage), axis=1, background=0)
+    return len(corpus["qimages"])
+
+def run_chunk_split(corpus, out_dir):
+    logger = Logger(None, verbosity=QUIET)
+    for chunk_path in corpus["chunks"]:
+        PT_chunk_split.process_image(chunk_path, out_dir, logger)
+    return len(corpus["chunks"])
+
+def run_join(corpus, out_dir):
+    with contextlib.redirect_stdout(io.StringIO()):  # join_sequence prints every join
+        for number, paths in enumerate(corpus["sequences"]):
+            batch_join_chunks.join_sequence(paths, os.path.join(out_dir, f"joined_{number:04d}.png"))
+    return sum(len(paths) for paths in corpus["sequences"])
+
+RUNNERS = {
+    "lines": run_lines,
+    "lines_packed": run_lines_packed,
+    "gaps": run_gaps,
+    "gaps_packed": run_gaps_packed,
+    "horizontal_sums": run_horizontal_sums,
+    "horizontal_sums_numpy": run_horizontal_sums_numpy,
+    "chunk_split": run_chunk_split,
+    "join": run_join,
+}
+
+def add_qimages(corpus):
+    """Convert the line images to 1-bit QImages for the Qt stages; False without PyQt5."""
+    try:
+        from PyQt5.QtGui import QImage
+    except ImportError:
+        return False
+    corpus["qimages"] = []
+    for line_image in corpus["lines"]:
+        line_image = np.ascontiguousarray(line_image)
+        height, width = line_image.shape
+        qimage = QImage(line_image.data, width, height, line_image.strides[0], QImage.Format_Grayscale8)
+        corpus["qimages"].append(qimage.convertToFormat(QImage.Format_Mono))
+    return True
+
+def measure(runner, corpus, work_dir, repeat):
+    """Return (items, best seconds, peak traced bytes) of a stage.
+
+    Timing runs are not traced; one more run under tracemalloc gives the
+    peak of Python and NumPy allocations (OpenCV's internal buffers are not seen).
+    """
+    best = None
+    for _ in range(repeat):
+        out_dir = tempfile.mkdtemp(dir=work_dir)
+        start = time.perf_counter()
+        items = runner(corpus, out_dir)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        shutil.rmtree(out_dir)
+
+    out_dir = tempfile.mkdtemp(dir=work_dir)
+    tracemalloc.start()
+    runner(corpus, out_dir)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    shutil.rmtree(out_dir)
+    return items, best, peak
+
+def versions():
+    """Return the VERSION of every module the stages exercise."""
+    return {module.__name__: module.VERSION for module in (PT_lines, PT_chunks, PT_chunk_split, batch_join_chunks, projection,
+                                                        bitimage)}
+
+def run_benchmarks(corpus_names, stages, params, repeat, results_file):
+    """Run the stages on each corpus, print a table and append the results to results_file."""
+    records = []
+    for corpus_name in corpus_names:
+        with tempfile.TemporaryDirectory() as work_dir:
+            if corpus_name == "synthetic":
+                corpus = prepare_synthetic(work_dir, **params)
+            else:
+                corpus = prepare_fixed(work_dir)
+            has_qt = add_qimages(corpus)
+            corpus["packed_lines"] = [bitimage.BitImage.from_gray(line) for line in corpus["lines"]]
+
+            print(f"{corpus_name}: {len(corpus['pages'])} pages, {len(corpus['lines'])} lines, "
+                  f"{len(corpus['chunks'])} chunks, {len(corpus['sequences'])} sequences")
+            for stage in stages:
+                if stage.startswith("horizontal_sums") and not has_qt:
+                    print(f"  {stage:22s} skipped (PyQt5 is not installed)")
+                    continue
+                if stage.startswith("lines") and not corpus["pages"]:
+                    continue  # The fixed corpus has no pages
+                items, seconds, peak = measure(RUNNERS[stage], corpus, work_dir, repeat)
+                module = STAGE_MODULES[stage]
+                record = {
+                    "time": datetime.now().isoformat(timespec="seconds"),
+                    "corpus": corpus_name,
+                    "params": params if corpus_name == "synthetic" else {},
+                    "stage": stage,
+                    "stage_version": module.VERSION if module is not None else None,
+                    "items": items,
+                    "seconds": round(seconds, 6),
+                    "images_per_s": round(items / seconds, 2) if seconds > 0 else None,
+                    "peak_kib": round(peak / 1024, 1),
+                    "versions": versions(),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "opencv": cv2.__version__,
+                }
+                records.append(record)
+                print(f"  {stage:22s} {items:6d} images {seconds:9.4f} s {record['images_per_s'] or 0:10.1f} images/s "
+                      f"peak {record['peak_kib']:10.1f} KiB")
+
+    with open(results_file, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+    print(f"Results appended to {results_file}")
+
+def compare(results_file):
+    """Print, per corpus and stage, the latest result of every stage version recorded in results_file."""
+    latest = {}
+    with open(results_file, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            key = (record["corpus"], json.dumps(record["params"], sort_keys=True), record["stage"], record["stage_version"])
+            latest[key] = record  # Later lines win
+
+    for (corpus_name, params, stage, stage_version), record in sorted(latest.items(), key=lambda item: item[0][:3]):
+        print(f"{corpus_name:9s} {stage:22s} v{stage_version or '-':6s} {record['seconds']:9.4f} s "
+              f"{record['images_per_s'] or 0:10.1f} images/s peak {record['peak_kib']:10.1f} KiB ({record['time']})")
+
+def pop_option(args, name, default, convert):
+    """Remove '--name value' from args and return the converted value, or default."""
+    if name not in args:
+        return default
+    index = args.index(name)
+    try:
+        value = convert(args[index + 1])
+    except (IndexError, ValueError):
+        print(f"Error: {name} needs a value.")
+        sys.exit(1)
+    del args[index:index + 2]
+    return value
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    results_file = pop_option(args, "--results", RESULTS_FILE, str)
+
+    if "--compare" in args:
+        if not os.path.exists(results_file):
+            print(f"Error: {results_file} does not exist.")
+            sys.exit(1)
+        compare(results_file)
+        sys.exit(0)
+
+    corpus_option = pop_option(args, "--corpus", "both", str)
+    stages = tuple(pop_option(args, "--stages", ",".join(STAGES), str).split(","))
+    repeat = pop_option(args, "--repeat", 3, int)
+    params = {name: pop_option(args, f"--{name}", default, type(default)) for name, default in PAGE_DEFAULTS.items()}
+
+    if args or corpus_option not in ("synthetic", "fixed", "both") or any(stage not in STAGES for stage in stages) or repeat < 1:
+        print("Usage: python benchmark.py [--corpus synthetic|fixed|both] [--stages " + ",".join(STAGES) + "]")
+        print("                           [--width W] [--height H] [--lines N] [--density D] [--pages N] [--seed S]")
+        print("                           [--repeat N] [--results FILE]")
+        print("       python benchmark.py --compare [--results FILE]")
+        sys.exit(1)
+
+    corpus_names = ("synthetic", "fixed") if corpus_option == "both" else (corpus_option,)
+    run_benchmarks(corpus_names, stages, params, repeat, results_file)
@@ -0,0 +1,103 @@
+import cv2
+import numpy as np
+
+# Module version
+VERSION = "1.0"
+
+# Gray values at or below THRESHOLD are ink, as with PT_lines' THRESH_BINARY_INV.
+# For the bilevel masks of this project this is the same as "not white".
+THRESHOLD = 127
+
+# Lookup tables indexed by a packed byte b:
+# POPCOUNT[b] is its number of set bits, SPREAD[b] its 8 bits (most significant first)
+# spread over the 8 bytes of a uint64, and GRAY[b] the 8 gray pixels it stands for.
+BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)
+POPCOUNT = BITS.sum(axis=1).astype(np.uint8)
+SPREAD = np.ascontiguousarray(BITS).view(np.uint64).ravel()
+GRAY = np.where(BITS, 0, 255).astype(np.uint8)
+
+class BitImage:
+    """A bilevel image stored 8 pixels per byte, one set bit per ink pixel.
+
+    Rows are packed with np.packbits (the leftmost pixel in the most
+    significant bit) and the bits past the width are always zero, so ink is
+    counted per byte with lookup tables and never unpacked. Row ranges are
+    views; column ranges are shifted copies of the packed bytes. Pixels are
+    unpacked only where OpenCV needs them, by to_gray() and to_bgr().
+    """
+
+    def __init__(self, bits, width):
+        self.bits = bits
+        self.width = width
+
+    @classmethod
+    def from_gray(cls, gray, threshold=THRESHOLD):
+        """Pack a grayscale (or BGR) image; pixels at or below threshold are ink."""
+        if gray.ndim == 3:
+            gray = cv2.cvtColor(gray, cv2.COLOR_BGR2GRAY)
+        return cls(np.packbits(gray <= threshold, axis=1), gray.shape[1])
+
+    @classmethod
+    def read(cls, path, threshold=THRESHOLD, use_cache=False):
+        """Read and pack an image file; returns None if it cannot be read, as cv2.imread does."""
+        from maskcache import read_image
+        gray = read_image(path, cv2.IMREAD_GRAYSCALE, use_cache=use_cache)
+        return None if gray is None else cls.from_gray(gray, threshold)
+
+    @property
+    def height(self):
+        return self.bits.shape[0]
+
+    @property
+    def shape(self):
+        return self.height, self.width
+
+    @property
+    def nbytes(self):
+        return self.bits.nbytes
+
+    def row_counts(self):
+        """Count the ink pixels of every row (ink_profile(..., axis=1) of the unpacked image)."""
+        return POPCOUNT[self.bits].sum(axis=1, dtype=np.int64)
+
+    def column_counts(self):
+        """Count the ink pixels of every column (ink_profile(..., axis=0) of the unpacked image).
+
+        SPREAD turns each byte into eight one-byte counters, so summing up to
+        255 rows at a time adds eight columns per uint64 without carries.
+        """
+        height, byte_width = self.bits.shape
+        counts = np.zeros(byte_width * 8, dtype=np.int64)
+        for y in range(0, height, 255):
+            counts += SPREAD[self.bits[y:y + 255]].sum(axis=0, dtype=np.uint64).view(np.uint8)
+        return counts[:self.width]
+
+    def crop(self, y0, y1, x0=0, x1=None):
+        """Return the rows [y0:y1] and columns [x0:x1] as a BitImage, without unpacking."""
+        x1 = self.width if x1 is None else min(x1, self.width)
+        rows = self.bits[y0:y1]
+        if x0 == 0 and x1 == self.width:
+            return BitImage(rows, self.width)
+        width = max(x1 - x0, 0)
+        first, shift = divmod(x0, 8)
+        part = rows[:, first:first + (width + shift + 7) // 8]
+        if shift:
+            following = np.zeros_like(part)
+            following[:, :-1] = part[:, 1:]
+            part = ((part << shift) | (following >> (8 - shift))).astype(np.uint8)
+        part = part[:, :(width + 7) // 8]
+        if width % 8:
+            part = part.copy()
+            part[:, -1] &= np.uint8((0xFF << (8 - width % 8)) & 0xFF)
+        return BitImage(part, width)
+
+    def to_gray(self, pad=0):
+        """Unpack to a uint8 image (ink 0, background 255) with pad white pixels around it."""
+        height, width = self.shape
+        gray = GRAY[self.bits].reshape(height, self.bits.shape[1] * 8)[:, :width]
+        return cv2.copyMakeBorder(gray, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=255) if pad else \
+            np.ascontiguousarray(gray)
+
+    def to_bgr(self, pad=0):
+        """Unpack to a 3-channel image, as cv2.imread returns a mask by default."""
+        return cv2.cvtColor(self.to_gray(pad), cv2.COLOR_GRAY2BGR)
@@ -0,0 +1,341 @@
+import os
+import sys
+import csv
+import sqlite3
+import xml.etree.ElementTree as ET
+from nameindex import parse_name
+
+# Module version
+VERSION = "1.1"
+
+# Bumped when the tables change; a catalog of another schema is dropped and synced again
+SCHEMA_VERSION = 2
+
+# Directories PT_show sorts images into; an image's classification is the one it sits in
+CLASSIFICATIONS = ("glyph", "split", "join", "noise")
+
+RDF = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}"
+XMP_RATING = "{http://ns.adobe.com/xap/1.0/}Rating"
+
+# images holds every chunk and glyph file of the project with the table data
+# (printer symbol and font) of its table copied in, so the common questions
+# are answered from one indexed table. sidecars and xmp are keyed by path and
+# joined to the image of the same name in the same directory: a name is not
+# unique across a project (t01_l01g01.png is in glyphs-final/, tables/glyphs/
+# and the test directories alike). Sidecars kept in a directory of their own
+# are found by name with Catalog.sidecars() and Catalog.xmp_files().
+# The size and mtime of each file let sync() skip files that did not change.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tables (
+    number INTEGER PRIMARY KEY,
+    filename TEXT,
+    printer TEXT,
+    symbol TEXT,
+    font TEXT,
+    fascicule TEXT,
+    plate TEXT
+);
+CREATE TABLE IF NOT EXISTS printers (
+    id TEXT PRIMARY KEY,
+    printer TEXT,
+    period TEXT,
+    place TEXT
+);
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    table_number INTEGER,
+    line INTEGER,
+    number INTEGER,
+    classification TEXT,
+    symbol TEXT,
+    font TEXT,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS images_position ON images (table_number, line, number);
+CREATE INDEX IF NOT EXISTS images_name ON images (directory, name);
+CREATE INDEX IF NOT EXISTS images_printer ON images (symbol, classification);
+CREATE INDEX IF NOT EXISTS images_font ON images (font);
+CREATE INDEX IF NOT EXISTS images_classification ON images (classification);
+CREATE TABLE IF NOT EXISTS sidecars (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    glyph_id TEXT,
+    year TEXT,
+    description TEXT,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS sidecars_name ON sidecars (name, directory);
+CREATE TABLE IF NOT EXISTS xmp (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    rating INTEGER,
+    subjects TEXT,
+    size INTEGER,
+    mtime_ns INTEGER
+);
+CREATE INDEX IF NOT EXISTS xmp_name ON xmp (name, directory);
+"""
+
+def read_tables(meta_file, names_file=None):
+    """Return {table number: row} from meta.csv, completed by names.csv for tables meta.csv lacks."""
+    tables = {}
+    for path in (meta_file, names_file):
+        if path is None or not os.path.exists(path):
+            continue
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                number = int(row['number'])
+                if number not in tables:
+                    tables[number] = (number, row.get('filename'), row['printer'], row['printer'][:2],
+                                      row['font'], row['fascicule'], row['plate'])
+    return tables
+
+def read_printers(printers_file):
+    """Return the rows of printers.csv: id;printer;period;place, skipping its free-text lines."""
+    printers = []
+    if not os.path.exists(printers_file):
+        return printers
+    with open(printers_file, encoding='utf-8') as f:
+        next(f, None)  # Header
+        for line in f:
+            fields = [field.strip() for field in line.rstrip("\n").split(";")]
+            if len(fields) < 2 or not fields[0]:
+                continue
+            period = fields[2] if len(fields) > 2 else ""
+            place = "; ".join(fields[3:])
+            if len(fields) > 4:  # "pierwsza drukarnia: 1510–1516; Kraków" has a stray separator
+                period, place = "; ".join(fields[2:-1]), fields[-1]
+            printers.append((fields[0], fields[1], period, place))
+    return printers
+
+def read_sidecar(path):
+    """Return (glyph id, year, description) from a glyphs2meta sidecar."""
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            return row.get('id'), row.get('year'), row.get('description')
+    return None, None, None
+
+def read_xmp(path):
+    """Return (rating, subjects) from an XMP sidecar; subjects are the bag values joined by newlines."""
+    try:
+        root = ET.parse(path).getroot()
+    except ET.ParseError:
+        return None, None
+    rating = None
+    for element in root.iter():
+        if element.tag == XMP_RATING:
+            rating = element.text
+        elif XMP_RATING in element.attrib:  # Exiv2 writes simple properties as attributes
+            rating = element.attrib[XMP_RATING]
+    subjects = [li.text for bag in root.iter(f"{RDF}Bag") for li in bag.iter(f"{RDF}li") if li.text]
+    try:
+        rating = int(rating) if rating is not None else None
+    except ValueError:
+        rating = None
+    return rating, "\n".join(subjects)
+
+def walk_files(root):
+    """Yield (relative path, name, size, mtime_ns) for every file under root, skipping hidden directories."""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or entry.name == "__pycache__":
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    st = entry.stat()
+                    yield os.path.relpath(entry.path, root), entry.name, st.st_size, st.st_mtime_ns
+
+class Catalog:
+    """SQLite catalog of a project: its tables, printers, chunk and glyph images, sidecars and XMP files.
+
+    sync() loads meta.csv, names.csv and printers.csv and walks the project
+    once, reading only the files that are new or changed since the last
+    sync. The query helpers then answer from indexes what the scripts
+    otherwise find by scanning directories.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.connection.executescript("DROP TABLE IF EXISTS tables; DROP TABLE IF EXISTS printers; "
+                                          "DROP TABLE IF EXISTS images; DROP TABLE IF EXISTS sidecars; DROP TABLE IF EXISTS xmp;")
+            self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.connection.executescript(SCHEMA)
+
+    def _known(self, table):
+        return {row["path"]: (row["size"], row["mtime_ns"])
+                for row in self.connection.execute(f"SELECT path, size, mtime_ns FROM {table}")}
+
+    def sync(self, root, meta_file=None, names_file=None, printers_file=None):
+        """Bring the catalog up to date with the project under root; returns {table: rows added or changed}.
+
+        The metadata files default to meta.csv, names.csv and printers.csv in root.
+        """
+        meta_file = meta_file or os.path.join(root, "meta.csv")
+        names_file = names_file or os.path.join(root, "names.csv")
+        printers_file = printers_file or os.path.join(root, "printers.csv")
+        tables = read_tables(meta_file, names_file)
+        printers = read_printers(printers_file)
+
+        known = {table: self._known(table) for table in ("images", "sidecars", "xmp")}
+        seen = {table: set() for table in known}
+        images, sidecars, xmps = [], [], []
+        for path, name, size, mtime_ns in walk_files(root):
+            directory = os.path.dirname(path)
+            if name.endswith(".png"):
+                records = parse_name(name)
+                record = records.get("glyphs") or records.get("chunks")
+                if record is None:
+                    continue
+                seen["images"].add(path)
+                if known["images"].get(path) == (size, mtime_ns):
+                    continue
+                kind, table_number = ("glyph", record.table) if "glyphs" in records else ("chunk", record.mask)
+                line, number = record.line, record.glyph if kind == "glyph" else record.chunk
+                parent = os.path.basename(directory)
+                images.append((path, directory, name, kind, table_number, line, number,
+                               parent if parent in CLASSIFICATIONS else None, size, mtime_ns))
+            elif name.endswith(".csv") and "glyphs" in parse_name(name[:-4] + ".png"):
+                seen["sidecars"].add(path)
+                if known["sidecars"].get(path) != (size, mtime_ns):
+                    sidecars.append((path, directory, name[:-4] + ".png", *read_sidecar(os.path.join(root, path)), size, mtime_ns))
+            elif name.endswith(".xmp") and ".png" in name:
+                seen["xmp"].add(path)
+                if known["xmp"].get(path) != (size, mtime_ns):
+                    xmps.append((path, directory, name[:name.index(".png") + 4], *read_xmp(os.path.join(root, path)), size, mtime_ns))
+
+        with self.connection:
+            self.connection.execute("DELETE FROM tables")
+            self.connection.executemany("INSERT INTO tables VALUES (?, ?, ?, ?, ?, ?, ?)", tables.values())
+            self.connection.execute("DELETE FROM printers")
+            self.connection.executemany("INSERT OR REPLACE INTO printers VALUES (?, ?, ?, ?)", printers)
+            for table in known:
+                gone = [(path,) for path in known[table].keys() - seen[table]]
+                self.connection.executemany(f"DELETE FROM {table} WHERE path = ?", gone)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO images (path, directory, name, kind, table_number, line, number, classification, size, mtime_ns) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", images)
+            self.connection.executemany("INSERT OR REPLACE INTO sidecars VALUES (?, ?, ?, ?, ?, ?, ?, ?)", sidecars)
+            self.connection.executemany("INSERT OR REPLACE INTO xmp VALUES (?, ?, ?, ?, ?, ?, ?)", xmps)
+            # The table data of every image, also for tables whose metadata changed
+            self.connection.execute(
+                "UPDATE images SET symbol = (SELECT symbol FROM tables WHERE number = images.table_number), "
+                "font = (SELECT font FROM tables WHERE number = images.table_number)")
+        return {"images": len(images), "sidecars": len(sidecars), "xmp": len(xmps)}
+
+    def images(self, table=None, printer=None, font=None, classification=None, kind=None):
+        """Return the images matching every criterion given, in table, line and number order.
+
+        printer is a printer symbol (e.g. "Ha"); classification is one of CLASSIFICATIONS.
+        Each row also has the glyph id, year, description, rating and subjects of
+        the CSV and XMP sidecars in its directory; an image with several XMP
+        files there is returned once for each.
+        """
+        conditions, parameters = [], []
+        for column, value in (("table_number", table), ("symbol", printer), ("font", font),
+                              ("classification", classification), ("kind", kind)):
+            if value is not None:
+                conditions.append(f"images.{column} = ?")
+                parameters.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self.connection.execute(
+            "SELECT images.*, sidecars.glyph_id, sidecars.year, sidecars.description, xmp.rating, xmp.subjects "
+            "FROM images LEFT JOIN sidecars ON sidecars.directory = images.directory AND sidecars.name = images.name "
+            "LEFT JOIN xmp ON xmp.directory = images.directory AND xmp.name = images.name "
+            f"{where} ORDER BY images.table_number, images.line, images.number, images.path",
+            parameters).fetchall()
+
+    def sidecars(self, name):
+        """Return every CSV sidecar of an image name in the project, in path order.
+
+        glyphs2meta may write sidecars to a directory of their own, where
+        images() does not join them; the path of each row tells them apart.
+        """
+        return self.connection.execute("SELECT * FROM sidecars WHERE name = ? ORDER BY path", (name,)).fetchall()
+
+    def xmp_files(self, name):
+        """Return every XMP sidecar of an image name in the project, in path order."""
+        return self.connection.execute("SELECT * FROM xmp WHERE name = ? ORDER BY path", (name,)).fetchall()
+
+    def table(self, number):
+        """Return the meta.csv row of a table, or None."""
+        return self.connection.execute("SELECT * FROM tables WHERE number = ?", (number,)).fetchone()
+
+    def printer(self, printer_id):
+        """Return the printers.csv row of a printer symbol, or None."""
+        return self.connection.execute("SELECT * FROM printers WHERE id = ?", (printer_id,)).fetchone()
+
+    def counts(self):
+        """Return [(kind, classification, count), ...] over the whole project."""
+        return self.connection.execute(
+            "SELECT kind, classification, COUNT(*) AS count FROM images GROUP BY kind, classification "
+            "ORDER BY kind, classification").fetchall()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def parse_catalog_db(args):
+    """Remove '--db FILE' from an argument list and return (catalog path, remaining arguments)."""
+    args = list(args)
+    path = "catalog.sqlite"
+    if "--db" in args:
+        index = args.index("--db")
+        if index + 1 >= len(args):
+            print("Error: --db needs a file name.")
+            sys.exit(1)
+        path = args[index + 1]
+        del args[index:index + 2]
+    return path, args
+
+QUERY_OPTIONS = {"--table": "table", "--printer": "printer", "--font": "font",
+                 "--classification": "classification", "--kind": "kind"}
+
+if __name__ == "__main__":
+    db_path, args = parse_catalog_db(sys.argv[1:])
+    if not args or args[0] not in ("sync", "query", "stats") or (args[0] == "sync" and len(args) != 2):
+        print("Usage: python catalog.py sync <project_directory> [--db FILE]")
+        print("       python catalog.py query [--table N] [--printer SYMBOL] [--font F] "
+              "[--classification glyph|split|join|noise] [--kind chunk|glyph] [--db FILE]")
+        print("       python catalog.py stats [--db FILE]")
+        sys.exit(1)
+
+    with Catalog(db_path) as catalog:
+        if args[0] == "sync":
+            if not os.path.isdir(args[1]):
+                print(f"Error: {args[1]} is not a valid directory.")
+                sys.exit(1)
+            changed = catalog.sync(args[1])
+            print(f"Synced {db_path}: " + ", ".join(f"{count} {table}" for table, count in changed.items()) + " added or changed")
+        elif args[0] == "stats":
+            for row in catalog.counts():
+                print(f"{row['kind']}\t{row['classification'] or '-'}\t{row['count']}")
+        else:
+            criteria = {}
+            options = args[1:]
+            for i in range(0, len(options), 2):
+                if options[i] not in QUERY_OPTIONS or i + 1 >= len(options):
+                    print(f"Error: unknown or incomplete option {options[i]}.")
+                    sys.exit(1)
+                criteria[QUERY_OPTIONS[options[i]]] = int(options[i + 1]) if options[i] == "--table" else options[i + 1]
+            for row in catalog.images(**criteria):
+                print(f"{row['path']}\t{row['classification'] or '-'}\t{row['glyph_id'] or ''}")
@@ -1,21 +1,13 @@
-# distribute1.py - Version 1.4
+# distribute1.py - Version 1.5
 
 import os
 import sys
 import cv2
 import numpy as np
-import glob
 import matplotlib.pyplot as plt
+from nameindex import parse_index_cache, scan
 
-print("distribute1.py - Version 1.4")
-
-
-def get_number_from_filename(filename, pattern):
-    import re
-    match = re.search(pattern, filename)
-    if match:
-        return int(match.group(1))
-    return None
+print("distribute1.py - Version 1.5")
 
 
 def display_images(image_paths, title):
@@ -50,32 +42,20 @@ def display_images(image_paths, title):
 
 
 def main():
-    if len(sys.argv) != 2:
-        print("Usage: python distribute1.py <dir>")
+    index_cache, args = parse_index_cache(sys.argv[1:])
+    if len(args) != 1:
+        print("Usage: python distribute1.py <dir> [--index-cache]")
         sys.exit(1)
 
-    input_dir = sys.argv[1]
+    input_dir = args[0]
 
     if not os.path.isdir(input_dir):
         print(f"Error: {input_dir} is not a directory.")
         sys.exit(1)
 
-    files = glob.glob(os.path.join(input_dir, '*.png'))
-    number1_set = sorted(set(get_number_from_filename(f, r'm(\d+)_') for f in files))
-
-    for number1 in number1_set:
-        number2_groups = {}
-        for file in files:
-            num1 = get_number_from_filename(file, r'm(\d+)_')
-            num2 = get_number_from_filename(file, r'_lines_(\d+)_')
-            if num1 == number1:
-                if num2 not in number2_groups:
-                    number2_groups[num2] = []
-                number2_groups[num2].append(file)
-
-        for number2, image_group in sorted(number2_groups.items()):
-            display_images(image_group, f"Number1: {number1}, Number2: {number2}")
-            input("Press Enter to continue...")
+    for (number1, number2), chunks in sorted(scan(input_dir, cache=index_cache).chunks_by_line().items()):
+        display_images([os.path.join(input_dir, chunk.name) for chunk in chunks], f"Number1: {number1}, Number2: {number2}")
+        input("Press Enter to continue...")
 
 
 if __name__ == "__main__":
@@ -1,63 +1,65 @@
 import os
-import re
-from collections import defaultdict
+from glyphpack import is_pack
+from nameindex import parse_index_cache, scan
+from manifest import write_if_changed
 
-def parse_filename(filename):
-    """Extract number1, number2, number3 from filename."""
-    match = re.match(r"t(\d+)_l(\d+)g(\d+)\.png", filename)
-    if match:
-        return tuple(map(int, match.groups())), filename  # Convert numbers to int for sorting
-    return None
+def generate_tex_files(input_dir, output_dir, index_cache=False, tables=None):
+    """Generate LaTeX files based on grouped image filenames (of a directory or a glyph archive).
 
-def generate_tex_files(input_dir, output_dir):
-    """Generate LaTeX files based on grouped image filenames."""
+    With tables (a set of number1 values) only the files of those tables are generated.
+    Each file is rendered in memory and written only if its content changed;
+    returns the set of tables whose file was written.
+    """
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     # Group files by t<number1>
-    grouped_files = defaultdict(list)
-    
-    for filename in sorted(os.listdir(input_dir)):  # Ensure alphabetical order
-        parsed = parse_filename(filename)
-        if parsed:
-            (number1, number2, number3), fname = parsed
-            grouped_files[number1].append(fname)
+    grouped_files = {number1: [glyph.name for glyph in glyphs]
+                     for number1, glyphs in scan(input_dir, cache=index_cache).glyphs_by_table().items()
+                     if tables is None or number1 in tables}
 
     # Process each group and create a .tex file
+    changed = set()
     for number1, files in grouped_files.items():
         tex_filename = f"t{number1:02d}_glyphs.tex"
         tex_path = os.path.join(output_dir, tex_filename)
 
-        with open(tex_path, "w") as tex_file:
-            # Write preamble
-            tex_file.write("\\exdisplay \\bg \\gla\n")
+        # Preamble
+        lines = ["\\exdisplay \\bg \\gla\n"]
 
-            # Write file references
-            for i, file_name in enumerate(sorted(files), start=1):
-                tex_file.write(f"% {i}\n{{\\PTglyph{{5}}{{{file_name}}}}}\n")
+        # File references
+        for i, file_name in enumerate(sorted(files), start=1):
+            lines.append(f"% {i}\n{{\\PTglyph{{5}}{{{file_name}}}}}\n")
 
-            # Write postamble
-            tex_file.write("//\n")
-            tex_file.write("%%% Local Variables:\n")
-            tex_file.write("%%% mode: latex\n")
-            tex_file.write("%%% TeX-engine: luatex\n")
-            tex_file.write("%%% TeX-master: shared\n")
-            tex_file.write("%%% End:\n")
+        # Postamble
+        lines.append("//\n")
+        lines.append("%%% Local Variables:\n")
+        lines.append("%%% mode: latex\n")
+        lines.append("%%% TeX-engine: luatex\n")
+        lines.append("%%% TeX-master: shared\n")
+        lines.append("%%% End:\n")
 
-        print(f"Generated {tex_filename}")
+        if write_if_changed(tex_path, "".join(lines).encode('utf-8')):
+            changed.add(number1)
+            print(f"Generated {tex_filename}")
+
+    print(f"{len(changed)} of {len(grouped_files)} tables changed" +
+          (f": {', '.join(f't{number1:02d}' for number1 in sorted(changed))}" if changed else ""))
+    return changed
 
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) != 3:
-        print("Usage: python glyph2tex.py <input_directory> <output_directory>")
+    index_cache, args = parse_index_cache(sys.argv[1:])
+    if len(args) != 2:
+        print("Usage: python glyph2tex.py <input_directory | archive.ptpack> <output_directory> [--index-cache]")
         sys.exit(1)
 
-    input_directory = sys.argv[1]
-    output_directory = sys.argv[2]
+    input_directory = args[0]
+    output_directory = args[1]
 
-    if not os.path.isdir(input_directory):
-        print(f"Error: {input_directory} is not a valid directory.")
+    if not os.path.isdir(input_directory) and not (is_pack(input_directory) and os.path.isfile(input_directory)):
+        print(f"Error: {input_directory} is not a valid directory or glyph archive.")
         sys.exit(1)
 
-    generate_tex_files(input_directory, output_directory)
+    generate_tex_files(input_directory, output_directory, index_cache=index_cache)
@@ -1,14 +1,7 @@
 import os
-import re
 import csv
-from collections import defaultdict
-
-def parse_filename(filename):
-    """Extract number1, number2, number3 from filename."""
-    match = re.match(r"t(\d+)_l(\d+)g(\d+)\.png", filename)
-    if match:
-        return tuple(map(int, match.groups())), filename  # Convert numbers to int for sorting
-    return None
+from nameindex import parse_index_cache, scan
+from manifest import write_if_changed
 
 def load_metadata(metadata_file):
     """Load metadata CSV into a dictionary mapping number1 to its glyph ID components."""
@@ -42,8 +35,13 @@ def load_metadata(metadata_file):
             metadata[number1] = (printer_symbol, font_part)
     return metadata
 
-def generate_tex_files(input_dir, output_dir, metadata_file):
-    """Generate LaTeX files based on grouped image filenames and metadata."""
+def generate_tex_files(input_dir, output_dir, metadata_file, index_cache=False, tables=None):
+    """Generate LaTeX files based on grouped image filenames and metadata.
+
+    With tables (a set of number1 values) only the files of those tables are generated.
+    Each file is rendered in memory and written only if its content changed;
+    returns the set of tables whose file was written.
+    """
 
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
@@ -51,50 +49,53 @@ def generate_tex_files(input_dir, output_dir, metadata_file):
     metadata = load_metadata(metadata_file)
 
     # Group files by t<number1>
-    grouped_files = defaultdict(list)
-
-    for filename in sorted(os.listdir(input_dir)):  # Ensure alphabetical order
-        parsed = parse_filename(filename)
-        if parsed:
-            (number1, number2, number3), fname = parsed
-            grouped_files[number1].append((number2, number3, fname))
+    grouped_files = {number1: [(glyph.line, glyph.glyph, glyph.name) for glyph in glyphs]
+                     for number1, glyphs in scan(input_dir, cache=index_cache).glyphs_by_table().items()
+                     if tables is None or number1 in tables}
 
     # Process each group and create a .tex file
+    changed = set()
     for number1, files in grouped_files.items():
         tex_filename = f"t{number1:02d}_glyphids.tex"
         tex_path = os.path.join(output_dir, tex_filename)
 
         printer_symbol, font_part = metadata.get(number1, (f"X{number1}", f"{number1}_"))  # Default if missing
 
-        with open(tex_path, "w") as tex_file:
-            # Write preamble
-            tex_file.write("\\glpismo\n")
+        # Preamble
+        lines = ["\\glpismo\n"]
+
+        # File references
+        for i, (number2, number3, file_name) in enumerate(sorted(files), start=1):
+            glyph_id = f"{printer_symbol}-{font_part}{number2:02d}{number3:02d}"
+            lines.append(f"% {i}\n{{\\PTglyphid{{{glyph_id}}}}}\n")
 
-            # Write file references
-            for i, (number2, number3, file_name) in enumerate(sorted(files), start=1):
-                glyph_id = f"{printer_symbol}-{font_part}{number2:02d}{number3:02d}"
-                tex_file.write(f"% {i}\n{{\\PTglyphid{{{glyph_id}}}}}\n")
+        # Postamble
+        lines.append("//\n")
+        lines.append("\\endgl \\xe\n")
+        lines.append("%%% Local Variables:\n")
+        lines.append("%%% mode: latex\n")
+        lines.append("%%% TeX-engine: luatex\n")
+        lines.append("%%% TeX-master: shared\n")
+        lines.append("%%% End:\n")
 
-            # Write postamble
-            tex_file.write("//\n")
-            tex_file.write("\\endgl \\xe\n")
-            tex_file.write("%%% Local Variables:\n")
-            tex_file.write("%%% mode: latex\n")
-            tex_file.write("%%% TeX-engine: luatex\n")
-            tex_file.write("%%% TeX-master: shared\n")
-            tex_file.write("%%% End:\n")
+        if write_if_changed(tex_path, "".join(lines).encode('utf-8')):
+            changed.add(number1)
+            print(f"Generated {tex_filename}")
 
-        print(f"Generated {tex_filename}")
+    print(f"{len(changed)} of {len(grouped_files)} tables changed" +
+          (f": {', '.join(f't{number1:02d}' for number1 in sorted(changed))}" if changed else ""))
+    return changed
 
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) != 4:
-        print("Usage: python glyphids2tex.py <input_directory> <output_directory> <metadata_file>")
+    index_cache, args = parse_index_cache(sys.argv[1:])
+    if len(args) != 3:
+        print("Usage: python glyphids2tex.py <input_directory> <output_directory> <metadata_file> [--index-cache]")
         sys.exit(1)
 
-    input_directory = sys.argv[1]
-    output_directory = sys.argv[2]
-    metadata_filepath = sys.argv[3]
+    input_directory = args[0]
+    output_directory = args[1]
+    metadata_filepath = args[2]
 
     if not os.path.isdir(input_directory):
         print(f"Error: {input_directory} is not a valid directory.")
@@ -104,4 +105,4 @@ if __name__ == "__main__":
         print(f"Error: {metadata_filepath} is not a valid file.")
         sys.exit(1)
 
-    generate_tex_files(input_directory, output_directory, metadata_filepath)
+    generate_tex_files(input_directory, output_directory, metadata_filepath, index_cache=index_cache)
@@ -0,0 +1,246 @@
+import os
+import sys
+import json
+import mmap
+import struct
+import cv2
+import numpy as np
+
+# Module version
+VERSION = "1.0"
+
+# Layout: MAGIC, the entry bytes one after another, a JSON index {name: [offset, length]},
+# then a trailer with the index offset and length followed by MAGIC again.
+# Entries are stored as the encoded files (PNG), so exporting gives back the original bytes.
+MAGIC = b"PTPACK01"
+TRAILER = struct.Struct("<QQ8s")
+PACK_SUFFIX = ".ptpack"
+
+def is_pack(path):
+    """True if path names a glyph archive rather than a directory."""
+    return path.endswith(PACK_SUFFIX)
+
+class GlyphPack:
+    """One file holding many small images, read by name through a memory map.
+
+    mode "r" opens an existing archive; mode "a" creates it if needed and
+    appends. Added entries go after the end of the file and a new index and
+    trailer are written after them on flush() and close, so the previous
+    index stays valid until then and an interrupted writer loses only its
+    own entries. Replaced and removed entries, and the old indexes, stay in
+    the file unused until the archive is rewritten by compact().
+    """
+
+    def __init__(self, path, mode="r"):
+        if mode not in ("r", "a"):
+            raise ValueError(f"Unknown mode {mode}; use 'r' or 'a'.")
+        self.path = path
+        self.mode = mode
+        self.index = {}
+        self._map = None
+        self._dirty = False
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        if mode == "r" or exists:
+            self._file = open(path, 'rb' if mode == "r" else 'r+b')
+            self._data_end, trailer_end = self._read_index()
+            if mode == "a":
+                self._data_end = trailer_end  # New entries go after the trailer
+        else:
+            self._file = open(path, 'w+b')
+            self._file.write(MAGIC)
+            self._data_end = len(MAGIC)
+            self._dirty = True
+        if mode == "r" and self._data_end > len(MAGIC):
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _read_index(self):
+        """Load the index of the last complete trailer; returns (index offset, end of that trailer).
+
+        Entries an interrupted writer left after the trailer are ignored.
+        """
+        self._file.seek(0, os.SEEK_END)
+        size = self._file.tell()
+        self._file.seek(0)
+        if size < len(MAGIC) + TRAILER.size or self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path} is not a glyph archive")
+        with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            end = size
+            while end >= len(MAGIC) + TRAILER.size:
+                index_offset, index_length, magic = TRAILER.unpack(view[end - TRAILER.size:end])
+                if magic == MAGIC and index_offset >= len(MAGIC) and index_offset + index_length == end - TRAILER.size:
+                    try:
+                        index = json.loads(view[index_offset:end - TRAILER.size])
+                    except ValueError:
+                        index = None
+                    if isinstance(index, dict):
+                        self.index = {name: tuple(entry) for name, entry in index.items()}
+                        return index_offset, end
+                found = view.rfind(MAGIC, len(MAGIC), end - 1)
+                if found < 0:
+                    break
+                end = found + len(MAGIC)
+        raise ValueError(f"{self.path} has no index; its writer was interrupted")
+
+    def names(self):
+        """Return the entry names in alphabetical order."""
+        return sorted(self.index)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def read(self, name):
+        """Return the stored bytes of an entry; raises KeyError for an unknown name."""
+        offset, length = self.index[name]
+        if self._map is not None:
+            return self._map[offset:offset + length]
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def imread(self, name, flags=cv2.IMREAD_UNCHANGED):
+        """Decode an entry as cv2.imread would decode the file."""
+        if self._map is not None:
+            offset, length = self.index[name]
+            return cv2.imdecode(np.frombuffer(self._map, dtype=np.uint8, count=length, offset=offset), flags)
+        return cv2.imdecode(np.frombuffer(self.read(name), dtype=np.uint8), flags)
+
+    def add(self, name, data):
+        """Store data under name, replacing an entry of the same name."""
+        if self.mode != "a":
+            raise ValueError(f"{self.path} is open for reading")
+        self._file.seek(self._data_end)
+        self._file.write(data)
+        self.index[name] = (self._data_end, len(data))
+        self._data_end += len(data)
+        self._dirty = True
+
+    def add_image(self, name, image):
+        """Encode an image as its name's extension says (PNG for glyphs) and store it."""
+        ok, encoded = cv2.imencode(os.path.splitext(name)[1], image)
+        if not ok:
+            raise ValueError(f"Unable to encode image for {name}")
+        self.add(name, encoded.tobytes())
+
+    def remove(self, name):
+        if self.mode != "a":
+            raise ValueError(f"{self.path} is open for reading")
+        del self.index[name]
+        self._dirty = True
+
+    def export(self, output_dir, names=None):
+        """Write entries (all by default) to output_dir as separate files; returns the paths written."""
+        os.makedirs(output_dir, exist_ok=True)
+        paths = []
+        for name in self.names() if names is None else names:
+            path = os.path.join(output_dir, name)
+            with open(path, 'wb') as f:
+                f.write(self.read(name))
+            paths.append(path)
+        return paths
+
+    def compact(self):
+        """Rewrite the archive without the bytes of replaced and removed entries and of old indexes.
+
+        The compacted archive is written next to this one and replaces it only once it is complete.
+        """
+        if self.mode != "a":
+            raise ValueError(f"{self.path} is open for reading")
+        temp_path = self.path + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)  # Left by an interrupted compact()
+        with GlyphPack(temp_path, "a") as compacted:
+            for name in self.names():
+                compacted.add(name, self.read(name))
+            compacted.flush()
+            os.fsync(compacted._file.fileno())
+        self._file.close()
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, 'r+b')
+        _, self._data_end = self._read_index()
+        self._dirty = False
+
+    def flush(self):
+        """Write the index and trailer after the data; later entries go after them."""
+        if self.mode != "a" or not self._dirty:
+            return
+        index = json.dumps({name: list(entry) for name, entry in sorted(self.index.items())}).encode('utf-8')
+        self._file.seek(self._data_end)
+        self._file.write(index)
+        self._file.write(TRAILER.pack(self._data_end, len(index), MAGIC))
+        self._file.truncate()  # Drops what an interrupted writer left after the previous trailer
+        self._file.flush()
+        self._data_end = self._file.tell()
+        self._dirty = False
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def parse_pack(args):
+    """Remove '--pack ARCHIVE' from an argument list and return (archive path or None, remaining arguments)."""
+    args = list(args)
+    pack_path = None
+    if "--pack" in args:
+        index = args.index("--pack")
+        if index + 1 >= len(args) or not is_pack(args[index + 1]):
+            print(f"Error: --pack needs an archive path ending in {PACK_SUFFIX}.")
+            sys.exit(1)
+        pack_path = os.path.abspath(args[index + 1])
+        del args[index:index + 2]
+    return pack_path, args
+
+def list_images(source):
+    """Return the sorted PNG names of a directory or of a glyph archive."""
+    if is_pack(source):
+        with GlyphPack(source) as pack:
+            return [name for name in pack.names() if name.lower().endswith('.png')]
+    return sorted(f for f in os.listdir(source) if f.lower().endswith('.png'))
+
+def pack_directory(input_dir, pack_path):
+    """Add every PNG of input_dir to the archive; returns the number of files packed."""
+    file_names = sorted(f for f in os.listdir(input_dir) if f.lower().endswith('.png'))
+    with GlyphPack(pack_path, "a") as pack:
+        for file_name in file_names:
+            with open(os.path.join(input_dir, file_name), 'rb') as f:
+                pack.add(file_name, f.read())
+    return len(file_names)
+
+if __name__ == "__main__":
+    commands = {"pack": 4, "export": 4, "list": 3}
+    if len(sys.argv) < 2 or commands.get(sys.argv[1]) != len(sys.argv):
+        print(f"Usage: python glyphpack.py pack <input_directory> <archive{PACK_SUFFIX}>")
+        print(f"       python glyphpack.py export <archive{PACK_SUFFIX}> <output_directory>")
+        print(f"       python glyphpack.py list <archive{PACK_SUFFIX}>")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == "pack":
+        input_directory, archive = sys.argv[2], sys.argv[3]
+        if not os.path.isdir(input_directory):
+            print(f"Error: {input_directory} is not a valid directory.")
+            sys.exit(1)
+        if not is_pack(archive):
+            print(f"Error: the archive name must end in {PACK_SUFFIX}.")
+            sys.exit(1)
+        print(f"Packed {pack_directory(input_directory, archive)} files into {archive}")
+    elif command == "export":
+        with GlyphPack(sys.argv[2]) as pack:
+            print(f"Exported {len(pack.export(sys.argv[3]))} files to {sys.argv[3]}")
+    else:
+        with GlyphPack(sys.argv[2]) as pack:
+            for name in pack.names():
+                print(f"{name}\t{pack.index[name][1]}")
@@ -1,13 +1,13 @@
+import io
 import os
-import re
+import sys
 import csv
+import sqlite3
+from nameindex import parse_index_cache, scan
+from manifest import atomic_write_bytes, write_if_changed
 
-def parse_filename(filename):
-    """Extract table, row, glyph numbers from PNG filename."""
-    match = re.match(r"t(\d+)_l(\d+)g(\d+)\.png", filename)
-    if match:
-        return tuple(match.groups())  # Strings for consistency
-    return None
+HEADER = ["table", "row", "glyph", "id", "printer", "font", "fascicule", "year", "plate", "description"]
+CATALOG_SUFFIXES = (".csv", ".sqlite", ".db")
 
 def load_metadata(meta_file):
     """Load metadata CSV into a dictionary mapping table number to its properties."""
@@ -35,22 +35,61 @@ def create_identifier(printer, font, row, glyph):
     """Generate an identifier following the format from glyphids2tex.py."""
     return f"{printer}-{font}{row:02d}{glyph:02d}"
 
-def generate_sidecar_files(input_dir, output_dir, dsed_dir, meta_file):
-    """Generate CSV sidecar files for each PNG file in input_dir."""
+def csv_bytes(rows):
+    """Render rows as the sidecar files are written (csv module defaults, UTF-8)."""
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(HEADER)
+    writer.writerows(rows)
+    return text.getvalue().encode('utf-8')
+
+def is_up_to_date(path, *sources):
+    """True if path exists and is not older than any of the sources that exist."""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+    return all(os.stat(source).st_mtime_ns <= mtime for source in sources if os.path.exists(source))
+
+def write_catalog(catalog_path, rows):
+    """Write all glyph rows, each preceded by its file name, to one CSV or SQLite file."""
+    if catalog_path.endswith(".csv"):
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow(["file"] + HEADER)
+        writer.writerows(rows)
+        atomic_write_bytes(catalog_path, text.getvalue().encode('utf-8'))
+        return
+    columns = ", ".join(f'"{column}" TEXT' for column in ["file"] + HEADER)
+    connection = sqlite3.connect(catalog_path)
+    with connection:
+        connection.execute(f"CREATE TABLE IF NOT EXISTS glyphs ({columns}, PRIMARY KEY (file))")
+        connection.execute('CREATE INDEX IF NOT EXISTS glyphs_position ON glyphs ("table", "row", "glyph")')
+        connection.execute('CREATE INDEX IF NOT EXISTS glyphs_printer ON glyphs ("printer", "font")')
+        connection.execute("DELETE FROM glyphs")
+        connection.executemany(f"INSERT INTO glyphs VALUES ({', '.join('?' * (len(HEADER) + 1))})", rows)
+    connection.close()
+
+def generate_sidecar_files(input_dir, output_dir, dsed_dir, meta_file, index_cache=False, catalog=None, force=False):
+    """Generate CSV sidecar files for each PNG file in input_dir.
+
+    The dsed file of a table is read once for all its glyphs. A sidecar not
+    older than its PNG, meta_file and dsed file is left alone unless force
+    is set, and one whose content would not change is not rewritten. With
+    catalog (a .csv, .sqlite or .db path) every row is also written to that one file.
+    Returns the number of sidecars written.
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
     metadata = load_metadata(meta_file)
+    dsed_data = {}  # table -> (dsed path, year, description)
+    catalog_rows = []
+    written = 0
     
-    for filename in os.listdir(input_dir):
-        if not filename.endswith(".png"):
-            continue
-        
-        parsed = parse_filename(filename)
-        if not parsed:
-            continue
-        
-        table, row, glyph = parsed
+    for record in scan(input_dir, cache=index_cache).glyphs:
+        filename = record.name
+        table, row, glyph = (f"{number:02d}" for number in (record.table, record.line, record.glyph))  # Strings as in meta.csv
         meta_entry = metadata.get(table)
         
         if not meta_entry:
@@ -62,25 +101,54 @@ def generate_sidecar_files(input_dir, output_dir, dsed_dir, meta_file):
         
         id_value = create_identifier(printer_symbol, font_part, int(row), int(glyph))
         
-        dsed_filename = meta_entry['filename'].replace(".djvu", "_4dsed.txt")
-        year, description = load_dsed_file(dsed_dir, dsed_filename)
+        if table not in dsed_data:
+            dsed_filename = meta_entry['filename'].replace(".djvu", "_4dsed.txt")
+            dsed_data[table] = (os.path.join(dsed_dir, dsed_filename), *load_dsed_file(dsed_dir, dsed_filename))
+        dsed_path, year, description = dsed_data[table]
         
         sidecar_filename = os.path.join(output_dir, filename.replace(".png", ".csv"))
+        values = [table, row, glyph, id_value, meta_entry['printer'], meta_entry['font'], fascicule, year, plate, description]
+        catalog_rows.append([filename] + values)
         
-        with open(sidecar_filename, 'w', newline='', encoding='utf-8') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(["table", "row", "glyph", "id", "printer", "font", "fascicule", "year", "plate", "description"])
-            writer.writerow([table, row, glyph, id_value, meta_entry['printer'], meta_entry['font'], fascicule, year, plate, description])
-    
+        if not force and is_up_to_date(sidecar_filename, os.path.join(input_dir, filename), meta_file, dsed_path):
+            continue
+        if write_if_changed(sidecar_filename, csv_bytes([values])):
+            written += 1
+        else:
+            os.utime(sidecar_filename)  # Checked against its newer sources: skip it next time
+
+    if catalog is not None:
+        write_catalog(catalog, catalog_rows)
+    return written
+
+def parse_catalog(args):
+    """Remove '--catalog FILE' from an argument list and return (catalog path or None, remaining arguments)."""
+    args = list(args)
+    catalog = None
+    if "--catalog" in args:
+        index = args.index("--catalog")
+        if index + 1 >= len(args) or not args[index + 1].endswith(CATALOG_SUFFIXES):
+            print(f"Error: --catalog needs a file name ending in {', '.join(CATALOG_SUFFIXES)}.")
+            sys.exit(1)
+        catalog = args[index + 1]
+        del args[index:index + 2]
+    return catalog, args
+
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) != 5:
-        print("Usage: python glyphs2meta.py <input_directory> <output_directory> <dsed_directory> <meta_file>")
+    index_cache, args = parse_index_cache(sys.argv[1:])
+    catalog, args = parse_catalog(args)
+    force = "--force" in args
+    args = [arg for arg in args if arg != "--force"]
+    if len(args) != 4:
+        print("Usage: python glyphs2meta.py <input_directory> <output_directory> <dsed_directory> <meta_file> "
+              "[--index-cache] [--catalog FILE.csv|FILE.sqlite] [--force]")
         sys.exit(1)
 
-    input_directory = sys.argv[1]
-    output_directory = sys.argv[2]
-    dsed_directory = sys.argv[3]
-    metadata_filepath = sys.argv[4]
+    input_directory = args[0]
+    output_directory = args[1]
+    dsed_directory = args[2]
+    metadata_filepath = args[3]
 
-    generate_sidecar_files(input_directory, output_directory, dsed_directory, metadata_filepath)
+    written = generate_sidecar_files(input_directory, output_directory, dsed_directory, metadata_filepath,
+                                     index_cache=index_cache, catalog=catalog, force=force)
+    print(f"Wrote {written} sidecar files")
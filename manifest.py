@@ -0,0 +1,125 @@
+import os
+import json
+import hashlib
+import tempfile
+import cv2
+
+# Module version
+VERSION = "1.0"
+
+def file_hash(path):
+    """Return the SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def atomic_write_bytes(path, data):
+    """Write data to path through a temporary file and os.replace, so readers never see a partial file."""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")  # Not picked up as a *.png input
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def write_if_changed(path, data):
+    """Atomically write data to path unless the file already holds exactly data; returns whether it was written."""
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    atomic_write_bytes(path, data)
+    return True
+
+def atomic_imwrite(path, image):
+    """cv2.imwrite counterpart that writes the encoded image atomically."""
+    ok, encoded = cv2.imencode(os.path.splitext(path)[1], image)
+    if not ok:
+        raise ValueError(f"Unable to encode image for {path}")
+    atomic_write_bytes(path, encoded.tobytes())
+    return True
+
+class Manifest:
+    """Per-stage record of input hash, parameters, script VERSION and outputs.
+
+    It lives as .<stage>_manifest.json in the stage's output directory and is
+    saved after every input, so an interrupted run resumes where it stopped.
+    Output paths are stored relative to that directory.
+    """
+
+    def __init__(self, directory, stage, version, params):
+        self.directory = directory
+        self.path = os.path.join(directory, f".{stage}_manifest.json")
+        self.version = version
+        self.params = params
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                self.entries = json.load(f).get("inputs", {})
+
+    def _stat(self, input_path):
+        st = os.stat(input_path)
+        return st.st_size, st.st_mtime_ns
+
+    def is_current(self, input_path):
+        """True if input_path was processed with the same content, parameters and VERSION and its outputs still exist."""
+        entry = self.entries.get(os.path.basename(input_path))
+        if entry is None or entry["version"] != self.version or entry["params"] != self.params:
+            return False
+        if not all(os.path.exists(os.path.join(self.directory, output)) for output in entry["outputs"]):
+            return False
+        size, mtime_ns = self._stat(input_path)
+        if (size, mtime_ns) == (entry["size"], entry["mtime_ns"]):
+            return True  # Unchanged since it was hashed
+        return file_hash(input_path) == entry["hash"]
+
+    def _remove_outputs(self, outputs):
+        for output in outputs:
+            path = os.path.join(self.directory, output)
+            if os.path.exists(path):
+                os.remove(path)
+            parent = os.path.dirname(path)
+            if os.path.abspath(parent) != os.path.abspath(self.directory) and os.path.isdir(parent) and not os.listdir(parent):
+                os.rmdir(parent)  # e.g. the <line>_chunks directory of a deleted line
+
+    def update(self, input_path, outputs):
+        """Record the outputs of input_path, remove the ones it no longer produces, and save."""
+        name = os.path.basename(input_path)
+        outputs = [os.path.relpath(output, self.directory) for output in outputs]
+        previous = self.entries.get(name, {}).get("outputs", [])
+        current = set(outputs)
+        stale = [output for output in previous if output not in current]
+        self._remove_outputs(stale)
+        size, mtime_ns = self._stat(input_path)
+        self.entries[name] = {
+            "hash": file_hash(input_path), "size": size, "mtime_ns": mtime_ns,
+            "version": self.version, "params": self.params, "outputs": outputs,
+        }
+        self.save()
+        return stale
+
+    def prune(self, input_paths):
+        """Forget inputs that are gone and remove their outputs; returns the removed output paths."""
+        present = {os.path.basename(path) for path in input_paths}
+        removed = []
+        for name in [name for name in self.entries if name not in present]:
+            removed.extend(self.entries.pop(name)["outputs"])
+        self._remove_outputs(removed)
+        if removed:
+            self.save()
+        return removed
+
+    def pending(self, input_paths, force=False):
+        """Return the inputs that need processing (all of them with force)."""
+        return list(input_paths) if force else [path for path in input_paths if not self.is_current(path)]
+
+    def save(self):
+        data = {"stage_version": self.version, "inputs": self.entries}
+        atomic_write_bytes(self.path, json.dumps(data, indent=1, sort_keys=True).encode('utf-8'))
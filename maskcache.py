@@ -0,0 +1,113 @@
+import os
+import sys
+import glob
+import tempfile
+import cv2
+import numpy as np
+
+# Module version
+VERSION = "1.0"
+
+# A decoded mask is kept as a hidden .npy file next to its source:
+#   m01_R.png -> .m01_R.png.<flags>.<size>-<mtime_ns>.npy
+# The source size and mtime are part of the name, so a changed mask simply
+# misses and its old cache files are replaced on the next read.
+CACHE_SUFFIX = ".npy"
+
+def cache_path(path, flags=cv2.IMREAD_COLOR):
+    """Return the cache file of path decoded with the cv2.imread flags, for its current size and mtime."""
+    st = os.stat(path)
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}.{flags}.{st.st_size}-{st.st_mtime_ns}{CACHE_SUFFIX}")
+
+def cache_files(path, flags=None):
+    """Return the cache files of path, for the given flags or for all of them, current or not."""
+    directory, name = os.path.split(os.path.abspath(path))
+    pattern = f".{glob.escape(name)}.{'*' if flags is None else flags}.*{CACHE_SUFFIX}"
+    return sorted(glob.glob(os.path.join(glob.escape(directory), pattern)))
+
+def _store(path, image):
+    """Save image to path through a temporary file, so a concurrent reader never maps a partial array."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, image)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def imread(path, flags=cv2.IMREAD_COLOR):
+    """cv2.imread counterpart that memory-maps a cached decode of the file.
+
+    On a miss the file is decoded once and saved next to it; older cache files
+    of the same source and flags are removed. The array returned from the
+    cache is read-only and shared through the page cache by every process that
+    maps it. Returns None if the file cannot be read, as cv2.imread does.
+    """
+    try:
+        cached = cache_path(path, flags)
+    except OSError:
+        return None
+    if os.path.exists(cached):
+        try:
+            return np.load(cached, mmap_mode='r')
+        except (OSError, ValueError):
+            pass  # Truncated or foreign file: decode again
+    image = cv2.imread(path, flags)
+    if image is None:
+        return None
+    try:
+        for stale in cache_files(path, flags):
+            if stale != cached:
+                os.remove(stale)
+        _store(cached, image)
+    except OSError:
+        return image  # Read-only directory: work without the cache
+    return np.load(cached, mmap_mode='r')
+
+def clear(path):
+    """Remove the cache files of a mask, or of every file in a directory; returns the number removed."""
+    sources = [path] if not os.path.isdir(path) else \
+        [os.path.join(path, name) for name in os.listdir(path) if not name.startswith('.')]
+    removed = 0
+    for source in sources:
+        for cached in cache_files(source):
+            os.remove(cached)
+            removed += 1
+    return removed
+
+def parse_mask_cache(args):
+    """Remove '--mask-cache' from an argument list and return (whether it was given, remaining arguments)."""
+    args = list(args)
+    enabled = "--mask-cache" in args
+    return enabled, [arg for arg in args if arg != "--mask-cache"]
+
+def read_image(path, flags=cv2.IMREAD_COLOR, use_cache=False):
+    """Read an image with cv2.imread, or through the mask cache when use_cache is set."""
+    return imread(path, flags) if use_cache else cv2.imread(path, flags)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("warm", "clear"):
+        print("Usage: python maskcache.py warm <mask_or_directory>... [--grayscale]")
+        print("       python maskcache.py clear <mask_or_directory>...")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    flags = cv2.IMREAD_GRAYSCALE if "--grayscale" in sys.argv else cv2.IMREAD_COLOR
+    targets = [arg for arg in sys.argv[2:] if arg != "--grayscale"]
+    if command == "clear":
+        print(f"Removed {sum(clear(target) for target in targets)} cache files")
+        sys.exit(0)
+
+    warmed = 0
+    for target in targets:
+        paths = [target] if not os.path.isdir(target) else \
+            [os.path.join(target, name) for name in sorted(os.listdir(target))
+             if name.lower().endswith(('.png', '.tif', '.tiff'))]
+        for path in paths:
+            if imread(path, flags) is None:
+                print(f"Warning: Unable to read {path}")
+            else:
+                warmed += 1
+    print(f"Cached {warmed} masks")
@@ -1,76 +1,136 @@
 import os
+import csv
 import xml.etree.ElementTree as ET
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from parallel import parse_jobs
+from manifest import write_if_changed
 
-def update_xmp_with_csv(xmp_file, csv_file, output_xmp):
-    """Update the existing XMP file with metadata from a CSV file."""
-    # Ensure the CSV file exists
-    if not os.path.exists(csv_file):
-        print(f"Error: CSV file not found: {csv_file}")
-        return
-    
-    # Load CSV metadata
-    csv_data = pd.read_csv(csv_file)
-    
+RDF = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}"
+METADATA_COLUMNS = ['id', 'printer', 'font', 'fascicule', 'year', 'plate', 'description']
+
+def load_sidecars(input_dir):
+    """Read every CSV sidecar of the directory in one pass; returns {base name: [metadata values, ...]}.
+
+    Values are kept as written in the sidecar (e.g. font "01"); empty ones are dropped.
+    """
+    sidecars = {}
+    with os.scandir(input_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".csv") and entry.is_file():
+                with open(entry.path, newline='', encoding='utf-8') as f:
+                    values = [row[column] for row in csv.DictReader(f) for column in METADATA_COLUMNS]
+                sidecars[entry.name[:-len(".csv")]] = [value for value in values if value]
+    return sidecars
+
+def update_xmp(xmp_file, values, output_xmp):
+    """Add values missing from the subject bag of an XMP file and save it as output_xmp if that changes it.
+
+    Returns a message describing what was done.
+    """
     # Read and parse the XMP file
     tree = ET.parse(xmp_file)
     root = tree.getroot()
-    
+
     # Locate RDF:Description node
-    rdf_description = root.find(".//{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Description")
-    
+    rdf_description = root.find(f".//{RDF}Description")
+
     if rdf_description is None:
-        print(f"Error: RDF Description not found in XMP file: {xmp_file}")
-        return
-    
+        return f"Error: RDF Description not found in XMP file: {xmp_file}"
+
     # Locate RDF:Bag node within dc:subject
-    rdf_bag = rdf_description.find(".//{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Bag")
-    
+    rdf_bag = rdf_description.find(f".//{RDF}Bag")
+
     if rdf_bag is None:
         # Create RDF:Bag if it does not exist
-        rdf_bag = ET.SubElement(rdf_description, "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}Bag")
-    
+        rdf_bag = ET.SubElement(rdf_description, f"{RDF}Bag")
+
     # Add CSV metadata to the XMP file
-    for _, row in csv_data.iterrows():
-        metadata_values = [
-            str(row['id']), str(row['printer']), str(row['font']), str(row['fascicule']),
-            str(row['year']), str(row['plate']), str(row['description'])
-        ]
-        
-        for value in metadata_values:
-            if value and not any(li.text == value for li in rdf_bag):
-                ET.SubElement(rdf_bag, "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}li").text = value
-    
+    present = {li.text for li in rdf_bag}
+    for value in values:
+        if value not in present:
+            ET.SubElement(rdf_bag, f"{RDF}li").text = value
+            present.add(value)
+
     # Save updated XMP file
-    with open(output_xmp, "wb") as f:
-        tree.write(f, encoding="utf-8", xml_declaration=True)
-    print(f"Updated XMP file saved: {output_xmp}")
+    data = ET.tostring(root, encoding="utf-8", xml_declaration=True)
+    if write_if_changed(output_xmp, data):
+        return f"Updated XMP file saved: {output_xmp}"
+    return f"Unchanged XMP file: {output_xmp}"
 
-def process_directory(input_dir, output_dir):
-    """Process all XMP and corresponding CSV files in the input directory."""
+def update_xmp_with_csv(xmp_file, csv_file, output_xmp):
+    """Update the existing XMP file with metadata from a CSV file."""
+    # Ensure the CSV file exists
+    if not os.path.exists(csv_file):
+        print(f"Error: CSV file not found: {csv_file}")
+        return
+
+    with open(csv_file, newline='', encoding='utf-8') as f:
+        values = [row[column] for row in csv.DictReader(f) for column in METADATA_COLUMNS]
+    print(update_xmp(xmp_file, [value for value in values if value], output_xmp))
+
+def _update_task(task):
+    return update_xmp(*task)
+
+def is_up_to_date(output_xmp, *sources):
+    """True if output_xmp exists and is not older than any of its sources."""
+    try:
+        output_mtime = os.stat(output_xmp).st_mtime_ns
+        return all(os.stat(source).st_mtime_ns <= output_mtime for source in sources)
+    except FileNotFoundError:
+        return False
+
+def process_directory(input_dir, output_dir, jobs=1, force=False):
+    """Process all XMP and corresponding CSV files in the input directory.
+
+    The sidecars are read once up front. An output newer than its XMP and
+    CSV is skipped unless force is set, and the XML of the others is
+    parsed and written in a pool of jobs processes if jobs > 1.
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    
-    for file in os.listdir(input_dir):
+
+    sidecars = load_sidecars(input_dir)
+    tasks = []
+    skipped = 0
+    for file in sorted(os.listdir(input_dir)):
         if file.endswith(".xmp"):
             base_name = file.replace(".png.gq.xmp", "")
             csv_file = os.path.join(input_dir, base_name + ".csv")
             xmp_file = os.path.join(input_dir, file)
             output_xmp = os.path.join(output_dir, file)
-            
-            if os.path.exists(csv_file):
-                update_xmp_with_csv(xmp_file, csv_file, output_xmp)
-            else:
+
+            if base_name not in sidecars:
                 print(f"Warning: No CSV file found for {file}, skipping update.")
+            elif not force and output_xmp != xmp_file and is_up_to_date(output_xmp, xmp_file, csv_file):
+                skipped += 1
+            else:
+                tasks.append((xmp_file, sidecars[base_name], output_xmp))
+
+    if jobs <= 1:
+        messages = map(_update_task, tasks)
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        messages = pool.map(_update_task, tasks, chunksize=max(1, len(tasks) // (jobs * 8)))
+    updated = 0
+    for message in messages:
+        if not message.startswith("Unchanged"):
+            print(message)
+            updated += message.startswith("Updated")
+    if jobs > 1:
+        pool.shutdown()
+    print(f"Updated {updated} of {len(tasks) + skipped} XMP files ({skipped} up to date)")
 
 # Example usage
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) != 3:
-        print("Usage: python meta2geeqie.py <input_directory> <output_directory>")
+    jobs, args = parse_jobs(sys.argv[1:])
+    force = "--force" in args
+    args = [arg for arg in args if arg != "--force"]
+    if len(args) != 2:
+        print("Usage: python meta2geeqie.py <input_directory> <output_directory> [--jobs N] [--force]")
         sys.exit(1)
-    
-    input_directory = os.path.abspath(sys.argv[1])
-    output_directory = os.path.abspath(sys.argv[2])
-    
-    process_directory(input_directory, output_directory)
+
+    input_directory = os.path.abspath(args[0])
+    output_directory = os.path.abspath(args[1])
+
+    process_directory(input_directory, output_directory, jobs=jobs, force=force)
@@ -0,0 +1,181 @@
+import os
+import re
+import sys
+import json
+from collections import defaultdict
+from typing import NamedTuple, Optional
+from manifest import atomic_write_bytes
+
+# Module version
+VERSION = "1.1"
+
+# A cached index is only trusted if it was written this long after the last change
+# to its directory: a file added in the same timestamp tick (2 s on FAT) as the
+# index was written leaves the directory's mtime as the index recorded it.
+RACY_NS = 2_000_000_000
+
+# The naming schemes of the project; one file name may belong to several of them
+# (a chunk is also a <prefix>_NN.png to batch_join_chunks).
+CHUNK_PATTERN = re.compile(r"m(\d+)_R_lines_(\d+)_chunk_(\d+)(?:([+-])(\d+))?\.png")  # join +NN, split -N
+LINE_PATTERN = re.compile(r"m(\d+)_R_lines_(\d+)(?:-(\d+))?\.png")
+GLYPH_PATTERN = re.compile(r"t(\d+)_l(\d+)g(\d+)\.png")
+NUMBERED_PATTERN = re.compile(r"(.*)_(\d{2})\.png")
+
+class Chunk(NamedTuple):
+    name: str
+    mask: int
+    line: int
+    chunk: int
+    suffix: Optional[str]  # "+" for a join, "-" for a split piece, None for a plain chunk
+    piece: Optional[int]
+
+class Line(NamedTuple):
+    name: str
+    mask: int
+    line: int
+    piece: Optional[int]
+
+class Glyph(NamedTuple):
+    name: str
+    table: int
+    line: int
+    glyph: int
+
+class Numbered(NamedTuple):
+    name: str
+    prefix: str
+    number: int
+
+def _optional_int(text):
+    return int(text) if text is not None else None
+
+def parse_name(name):
+    """Return the records of every scheme name belongs to, as a dict scheme -> record."""
+    records = {}
+    if name.startswith("m"):
+        match = CHUNK_PATTERN.fullmatch(name)
+        if match:
+            mask, line, chunk, suffix, piece = match.groups()
+            records["chunks"] = Chunk(name, int(mask), int(line), int(chunk), suffix, _optional_int(piece))
+        else:
+            match = LINE_PATTERN.fullmatch(name)
+            if match:
+                mask, line, piece = match.groups()
+                records["lines"] = Line(name, int(mask), int(line), _optional_int(piece))
+    elif name.startswith("t"):
+        match = GLYPH_PATTERN.fullmatch(name)
+        if match:
+            records["glyphs"] = Glyph(name, *map(int, match.groups()))
+    match = NUMBERED_PATTERN.fullmatch(name)
+    if match:
+        records["numbered"] = Numbered(name, match.group(1), int(match.group(2)))
+    return records
+
+SCHEMES = {"chunks": Chunk, "lines": Line, "glyphs": Glyph, "numbered": Numbered}
+
+class FilenameIndex:
+    """The file names of one directory (or glyph archive), parsed once into records of every naming scheme.
+
+    Each scheme's records are kept in name order, so queries return what a
+    sorted os.listdir followed by the script's own regex used to.
+    """
+
+    def __init__(self, source, names, records=None):
+        self.source = source
+        self.names = names  # Every file name, sorted
+        if records is None:
+            records = {scheme: [] for scheme in SCHEMES}
+            for name in names:
+                for scheme, record in parse_name(name).items():
+                    records[scheme].append(record)
+        self.chunks = records["chunks"]
+        self.lines = records["lines"]
+        self.glyphs = records["glyphs"]
+        self.numbered = records["numbered"]
+
+    def images(self):
+        """Return the PNG names, as glyphpack.list_images does."""
+        return [name for name in self.names if name.lower().endswith('.png')]
+
+    def chunks_by_line(self):
+        """Return {(mask, line): [Chunk, ...]} in name order."""
+        grouped = defaultdict(list)
+        for record in self.chunks:
+            grouped[record.mask, record.line].append(record)
+        return dict(grouped)
+
+    def glyphs_by_table(self):
+        """Return {table: [Glyph, ...]} in name order."""
+        grouped = defaultdict(list)
+        for record in self.glyphs:
+            grouped[record.table].append(record)
+        return dict(grouped)
+
+    def numbered_by_prefix(self):
+        """Return {prefix: [Numbered, ...]} in name order."""
+        grouped = defaultdict(list)
+        for record in self.numbered:
+            grouped[record.prefix].append(record)
+        return dict(grouped)
+
+    def to_json(self, mtime_ns):
+        data = {"version": VERSION, "mtime_ns": mtime_ns, "names": self.names,
+                "records": {scheme: [list(record) for record in getattr(self, scheme)] for scheme in SCHEMES}}
+        return json.dumps(data, separators=(",", ":")).encode('utf-8')
+
+def cache_path(source):
+    """The cached index of a directory lives next to it, so writing it does not change the directory's mtime."""
+    parent, name = os.path.split(os.path.abspath(source))
+    return os.path.join(parent, f".{name}.nameindex.json")
+
+def _list_names(source):
+    if source.endswith(".ptpack"):
+        from glyphpack import GlyphPack
+        with GlyphPack(source) as pack:
+            return pack.names()
+    with os.scandir(source) as entries:
+        return sorted(entry.name for entry in entries if entry.is_file())
+
+def scan(source, cache=False):
+    """Index the file names of a directory or glyph archive in one scandir pass.
+
+    With cache the index is saved next to the source and reused for as long
+    as the source's mtime (which changes whenever a file is added, removed
+    or renamed in it) stays the same, unless the index was written within
+    RACY_NS of that mtime; it is then rebuilt.
+    """
+    if not cache:
+        return FilenameIndex(source, _list_names(source))
+    mtime_ns = os.stat(source).st_mtime_ns
+    path = cache_path(source)
+    try:
+        with open(path, 'rb') as f:
+            data = json.load(f)
+            written_ns = os.fstat(f.fileno()).st_mtime_ns
+        if data["version"] == VERSION and data["mtime_ns"] == mtime_ns and written_ns - mtime_ns >= RACY_NS:
+            records = {scheme: [SCHEMES[scheme](*record) for record in data["records"][scheme]] for scheme in SCHEMES}
+            return FilenameIndex(source, data["names"], records)
+    except (OSError, ValueError, KeyError, TypeError):
+        pass  # Missing, stale or unreadable: rebuild
+    index = FilenameIndex(source, _list_names(source))
+    try:
+        atomic_write_bytes(path, index.to_json(mtime_ns))
+    except OSError:
+        pass  # Read-only parent: work without the cache
+    return index
+
+def parse_index_cache(args):
+    """Remove '--index-cache' from an argument list and return (whether it was given, remaining arguments)."""
+    args = list(args)
+    return "--index-cache" in args, [arg for arg in args if arg != "--index-cache"]
+
+if __name__ == "__main__":
+    index_cache, args = parse_index_cache(sys.argv[1:])
+    if len(args) != 1:
+        print("Usage: python nameindex.py <directory | archive.ptpack> [--index-cache]")
+        sys.exit(1)
+
+    index = scan(args[0], cache=index_cache)
+    print(f"{len(index.names)} files: {len(index.chunks)} chunks on {len(index.chunks_by_line())} lines, "
+          f"{len(index.lines)} lines, {len(index.glyphs)} glyphs in {len(index.glyphs_by_table())} tables, "
+          f"{len(index.numbered)} numbered files")
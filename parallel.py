@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from ptlog import Logger
+
+# Module version
+VERSION = "1.3"
+
+def parse_jobs(args):
+    """Remove '--jobs N' from an argument list and return (jobs, remaining arguments).
+
+    N defaults to 1; 0 means one worker per CPU core.
+    """
+    args = list(args)
+    jobs = 1
+    if "--jobs" in args:
+        index = args.index("--jobs")
+        try:
+            jobs = int(args[index + 1])
+        except (IndexError, ValueError):
+            print("Error: --jobs needs an integer argument.")
+            sys.exit(1)
+        del args[index:index + 2]
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    return jobs, args
+
+def pool_context():
+    """Return a multiprocessing context whose pools are safe to start from a threaded process.
+
+    A forked worker inherits every lock as it was at the fork, so a lock held
+    by another thread at that moment (a logger's, the import lock) is never
+    released in the child. forkserver and spawn workers start from a fresh interpreter.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def _run_with_private_log(task):
+    """Run one unit of work in a pool worker, logging to memory; the log text is returned."""
+    process, file_path, output_dir, fmt, verbosity = task
+    logger = Logger(None, fmt=fmt, verbosity=verbosity)
+    result = process(file_path, output_dir, logger)
+    return result, logger.getvalue()
+
+def process_files(process, file_paths, output_dir, logger, jobs=1, on_result=None, mp_context=None):
+    """Run process(file_path, output_dir, logger) on every file and return (results, elapsed seconds).
+
+    With jobs > 1 the files are handed to a process pool. Each worker logs to
+    memory and its text is appended to logger in file order, so the log and
+    the results come back in the same order as a sequential run.
+    on_result(file_path, result) is called in the parent as each result arrives.
+    mp_context is the multiprocessing context of the pool (see pool_context()).
+    """
+    start = time.perf_counter()
+    results = []
+    if jobs <= 1:
+        for file_path in file_paths:
+            results.append(process(file_path, output_dir, logger))
+            if on_result is not None:
+                on_result(file_path, results[-1])
+    else:
+        tasks = [(process, file_path, output_dir, logger.fmt, logger.verbosity) for file_path in file_paths]
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=mp_context) as pool:
+            for file_path, (result, text) in zip(file_paths, pool.map(_run_with_private_log, tasks)):
+                logger.write_raw(text)
+                results.append(result)
+                if on_result is not None:
+                    on_result(file_path, result)
+    return results, time.perf_counter() - start
+
+def throughput_message(count, elapsed, jobs=1):
+    """Format the aggregate throughput of a directory run."""
+    rate = count / elapsed if elapsed > 0 else 0.0
+    return f"Processed {count} images in {elapsed:.2f} s with {jobs} job(s) ({rate:.1f} images/s)"
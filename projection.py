@@ -0,0 +1,32 @@
+import numpy as np
+
+# Module version
+VERSION = "1.0"
+
+def ink_profile(binary, axis, background=255):
+    """Count the ink pixels of every row (axis=1) or column (axis=0) in one reduction."""
+    return np.count_nonzero(binary != background, axis=axis)
+
+def _flag_runs(flags):
+    """Return half-open (start, stop) pairs of the True runs in a boolean vector."""
+    padded = np.concatenate(([False], flags, [False])).astype(np.int8)
+    return np.flatnonzero(np.diff(padded)).reshape(-1, 2)
+
+def find_runs(profile, cutoff=0, min_run=1, min_gap=1):
+    """Find the runs where the profile exceeds cutoff.
+
+    Gaps shorter than min_gap are bridged before runs shorter than min_run
+    are dropped. Returns an (N, 2) array of half-open (start, stop) pairs.
+    """
+    runs = _flag_runs(np.asarray(profile) > cutoff)
+    if len(runs) > 1 and min_gap > 1:
+        keep = np.flatnonzero(runs[1:, 0] - runs[:-1, 1] >= min_gap)
+        starts = runs[np.concatenate(([0], keep + 1)), 0]
+        stops = runs[np.concatenate((keep, [len(runs) - 1])), 1]
+        runs = np.stack((starts, stops), axis=1)
+    return runs[runs[:, 1] - runs[:, 0] >= min_run]
+
+def find_gaps(profile, cutoff=0, min_gap=1):
+    """Find the runs where the profile is at or below cutoff, as half-open pairs."""
+    gaps = _flag_runs(np.asarray(profile) <= cutoff)
+    return gaps[gaps[:, 1] - gaps[:, 0] >= min_gap]
@@ -0,0 +1,297 @@
+import os
+import sys
+import sqlite3
+import cv2
+
+# Module version
+VERSION = "1.1"
+
+# Regions are keyed by file name, which the naming scheme keeps unique across a project:
+# m01_R.png -> m01_R_lines_01.png -> m01_R_lines_01_chunk_05.png -> ..._chunk_05-1.png -> t01_l01g05.png
+#
+# x and y place a region in the image file of its parent (padding included),
+# w and h are its unpadded size and pad is the padding of its own file, so
+# page coordinates are found by walking the parents up to the page.
+#
+# A joined file puts the kept columns of its chunks side by side without the
+# gaps between them, so its columns do not map linearly onto its line. Each
+# chunk is a segment: the width columns from position in the joined file come
+# from column start of the chunk file, which is column x of the line file.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS regions (
+    name TEXT PRIMARY KEY,
+    stage TEXT NOT NULL,
+    parent TEXT,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    w INTEGER NOT NULL,
+    h INTEGER NOT NULL,
+    pad INTEGER NOT NULL DEFAULT 0,
+    path TEXT
+);
+CREATE INDEX IF NOT EXISTS regions_parent ON regions (parent, stage);
+CREATE TABLE IF NOT EXISTS segments (
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    member TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    PRIMARY KEY (name, position)
+);
+"""
+
+class ProvenanceStore:
+    """SQLite record of where every page, line, chunk and glyph file comes from.
+
+    Segmentation scripts record the regions they cut, the join and split
+    tools record the regions they merge or divide, and the renumbering
+    scripts record each new name as an alias of the old one, so any final
+    glyph can be traced back to its box on the page mask and re-cropped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)  # Pool workers write to the same file
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def replace_children(self, parent, stage, regions):
+        """Record the regions one stage cut from parent, dropping what it recorded there before."""
+        with self.connection:
+            self.connection.execute("DELETE FROM regions WHERE parent = ? AND stage = ?", (parent, stage))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO regions (name, stage, parent, x, y, w, h, pad, path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(name, stage, parent, int(x), int(y), int(w), int(h), int(pad), path)
+                 for name, x, y, w, h, pad, path in regions])
+
+    def record_page(self, path, width, height):
+        """Record a page mask, the root of every chain."""
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO regions (name, stage, parent, x, y, w, h, pad, path) VALUES (?, 'page', NULL, 0, 0, ?, ?, 0, ?)",
+                (os.path.basename(path), int(width), int(height), os.path.abspath(path)))
+
+    def record_alias(self, old_name, new_name, path=None, stage="rename"):
+        """Record new_name as a copy of old_name (renumbering); False if old_name is unknown."""
+        old = self.region(old_name)
+        if old is None:
+            return False
+        self.replace_children(old_name, stage, [(new_name, old["pad"], old["pad"], old["w"], old["h"], old["pad"], path)])
+        return True
+
+    def record_join(self, names, new_name, columns, path=None, pad=0):
+        """Record the horizontal join of consecutive regions of one parent; False if they cannot be traced.
+
+        columns are the (start, stop) columns of each region's file that the joined file keeps, in order.
+        """
+        members = [self.region(name) for name in names]
+        if any(member is None for member in members) or len({member["parent"] for member in members}) != 1:
+            return False
+        segments, position = [], 0
+        for member, (start, stop) in zip(members, columns):
+            segments.append((new_name, position, member["name"], start, stop - start, member["x"] - member["pad"] + start))
+            position += stop - start
+        first = members[0]
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO regions (name, stage, parent, x, y, w, h, pad, path) VALUES (?, 'join', ?, ?, ?, ?, ?, ?, ?)",
+                (new_name, first["parent"], first["x"] - first["pad"] + pad, first["y"], position - 2 * pad, first["h"], pad, path))
+            self.connection.execute("DELETE FROM segments WHERE name = ?", (new_name,))
+            self.connection.executemany(
+                "INSERT INTO segments (name, position, member, start, width, x) VALUES (?, ?, ?, ?, ?, ?)", segments)
+        return True
+
+    def region(self, name):
+        """Return the row recorded for a file name, or None."""
+        return self.connection.execute("SELECT * FROM regions WHERE name = ?", (name,)).fetchone()
+
+    def _trace(self, name):
+        """Map the file of a region onto its page mask.
+
+        Returns (region row, page row, top, runs): the file's first row is page
+        row top, and each (column, width, page_x) run maps width file columns
+        from column onto the page from page_x. Files cut from a joined file
+        have one run per chunk they cover, other files a single run.
+        """
+        row = self.region(name)
+        if row is None:
+            raise KeyError(f"{name} is not in the provenance store")
+        runs = [(0, row["w"] + 2 * row["pad"], 0)]  # Columns of the region's file, in the current file
+        top = 0
+        current = row
+        while current["parent"] is not None:
+            parent = self.region(current["parent"])
+            if parent is None:
+                raise KeyError(f"The provenance of {name} stops at {current['parent']}")
+            top += current["y"] - current["pad"]
+            segments = self.connection.execute(
+                "SELECT position, width, x FROM segments WHERE name = ? ORDER BY position", (current["name"],)).fetchall()
+            if not segments:
+                shift = current["x"] - current["pad"]
+                runs = [(column, width, x + shift) for column, width, x in runs]
+            else:
+                runs = _map_segments(runs, segments)
+            current = parent
+        return row, current, top, runs
+
+    def locate(self, name):
+        """Return (page row, x, y, w, h, pad): the box of a region in page coordinates.
+
+        The box of a file cut from a joined file spans the page columns of all
+        the chunks it covers, gaps included. Raises KeyError if the region or
+        one of its ancestors was never recorded.
+        """
+        row, page, top, runs = self._trace(name)
+        w, h, pad = row["w"], row["h"], row["pad"]
+        x = _page_column(runs, pad)
+        return page, x, top + pad, _page_column(runs, pad + w - 1) + 1 - x, h, pad
+
+    def recrop(self, name, pad=None):
+        """Cut a region again from its page mask with pad pixels of the page around it.
+
+        By default the file is rebuilt as it was cut, with as much padding as
+        it had, so a file cut from a joined file leaves out the gaps between
+        its chunks as the joined file did. With an explicit pad the page box
+        of locate() is cut in one piece.
+        Beyond the page edge the padding is white. Note that page padding may show ink of a close neighbour
+        that the white padding of the original file did not.
+        """
+        row, page, top, runs = self._trace(name)
+        image = cv2.imread(page["path"], cv2.IMREAD_UNCHANGED)
+        if image is None:
+            raise FileNotFoundError(f"Unable to read page mask {page['path']}")
+        if pad is None:
+            bottom = top + row["h"] + 2 * row["pad"]
+            return cv2.hconcat([_crop(image, top, bottom, x, x + width) for _, width, x in runs])
+        _, x, y, w, h, _ = self.locate(name)
+        return _crop(image, y - pad, y + h + pad, x - pad, x + w + pad)
+
+    def check(self, name):
+        """Compare the recorded file of a region with recrop(); returns the number of its ink pixels that differ.
+
+        Pixels white in the file are not compared: the split whitens the ink of
+        other glyphs in its box, which the page still has. Returns None if the
+        file was not recorded or cannot be read.
+        """
+        row = self.region(name)
+        if row is None or not row["path"]:
+            return None
+        original = cv2.imread(row["path"], cv2.IMREAD_GRAYSCALE)
+        if original is None:
+            return None
+        again = self.recrop(name)
+        if again.ndim == 3:
+            again = cv2.cvtColor(again, cv2.COLOR_BGRA2GRAY if again.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+        if again.shape != original.shape:
+            return original.size
+        return int(((original != again) & (original != 255)).sum())
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _map_segments(runs, segments):
+    """Map (column, width, x) runs onto the parent of a joined file through its (position, width, x) segments.
+
+    x is the column of the joined file a run starts at. Columns before the
+    first segment or after the last one (padding) continue the nearest segment.
+    """
+    mapped = []
+    for column, width, x in runs:
+        for i, (position, segment_width, segment_x) in enumerate(segments):
+            low = x if i == 0 else max(x, position)
+            high = x + width if i == len(segments) - 1 else min(x + width, position + segment_width)
+            if low < high:
+                mapped.append((column + low - x, high - low, segment_x + low - position))
+    return mapped
+
+def _page_column(runs, column):
+    """Return the page column of a file column."""
+    for start, width, x in runs:
+        if start <= column < start + width:
+            return x + column - start
+    raise ValueError(f"Column {column} is outside the file")
+
+def _crop(image, top, bottom, left, right):
+    """Cut rows top:bottom and columns left:right of image, white beyond its edges."""
+    height, width = image.shape[:2]
+    crop = image[max(top, 0):min(bottom, height), max(left, 0):min(right, width)]
+    white = (255,) * (image.shape[2] if image.ndim == 3 else 1)
+    return cv2.copyMakeBorder(crop, max(-top, 0), max(bottom - height, 0), max(-left, 0), max(right - width, 0),
+                              cv2.BORDER_CONSTANT, value=white)
+
+def record_regions(db_path, parent, stage, regions):
+    """Record (name, x, y, w, h, pad, path) regions of parent in the store at db_path; no-op without a store.
+
+    Each call opens its own connection, so pool workers can record the files they write.
+    """
+    if db_path is None:
+        return
+    with ProvenanceStore(db_path) as store:
+        store.replace_children(parent, stage, regions)
+
+def parse_provenance(args):
+    """Remove '--provenance DB' from an argument list and return (database path or None, remaining arguments)."""
+    args = list(args)
+    db_path = None
+    if "--provenance" in args:
+        index = args.index("--provenance")
+        if index + 1 >= len(args):
+            print("Error: --provenance needs a database path.")
+            sys.exit(1)
+        db_path = os.path.abspath(args[index + 1])
+        del args[index:index + 2]
+    return db_path, args
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[2] not in ("show", "recrop", "check") or \
+            (sys.argv[2] != "check" and len(sys.argv) not in (4, 5, 6)):
+        print("Usage: python provenance.py <database> show <file_name>")
+        print("       python provenance.py <database> recrop <file_name> <output.png> [padding]")
+        print("       python provenance.py <database> check [file_name ...]")
+        sys.exit(1)
+
+    database, command = sys.argv[1:3]
+    with ProvenanceStore(database) as store:
+        if command == "check":
+            # Every region whose file was recorded, unless names are given
+            names = sys.argv[3:] or [row["name"] for row in store.connection.execute(
+                "SELECT name FROM regions WHERE path IS NOT NULL AND stage != 'page' ORDER BY name")]
+            checked = failed = 0
+            for name in names:
+                try:
+                    differing = store.check(name)
+                except (KeyError, FileNotFoundError) as e:
+                    print(f"{name}: {e.args[0]}")
+                    failed += 1
+                    continue
+                if differing is None:
+                    continue
+                checked += 1
+                if differing:
+                    print(f"{name}: {differing} ink pixels differ from the page")
+                    failed += 1
+            print(f"Checked {checked} files against their page masks: {failed} problems")
+            sys.exit(1 if failed else 0)
+
+        file_name = sys.argv[3]
+        try:
+            page, x, y, w, h, pad = store.locate(file_name)
+        except KeyError as e:
+            print(f"Error: {e.args[0]}")
+            sys.exit(1)
+        if command == "show":
+            print(f"{file_name}: page {page['name']} x={x} y={y} w={w} h={h} (file padding {pad})")
+        else:
+            if len(sys.argv) < 5:
+                print("Error: recrop needs an output file.")
+                sys.exit(1)
+            cv2.imwrite(sys.argv[4], store.recrop(file_name, int(sys.argv[5]) if len(sys.argv) == 6 else None))
+            print(f"Saved {file_name} re-cropped from {page['name']} to {sys.argv[4]}")
@@ -0,0 +1,102 @@
+import io
+import os
+import sys
+import json
+from datetime import datetime
+
+# Module version
+VERSION = "1.0"
+
+FORMATS = ("text", "jsonl")
+
+# Console verbosity: 0 prints only errors, 1 prints summaries, 2 also prints every per-item event
+QUIET, NORMAL, VERBOSE = 0, 1, 2
+
+class Logger:
+    """Buffered log shared by the segmentation and renumbering scripts.
+
+    The file is opened once and written through a large buffer instead of
+    being reopened for every message. fmt="text" keeps the historical
+    '<timestamp> - <message>' lines; fmt="jsonl" writes one JSON object per
+    message with the event fields passed to log(). A logger without a path
+    collects its output in memory (see getvalue).
+    """
+
+    def __init__(self, path, fmt="text", verbosity=NORMAL, buffer_size=1 << 16):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown log format {fmt}; use one of {', '.join(FORMATS)}.")
+        if path is not None and fmt == "jsonl":
+            path = os.path.splitext(path)[0] + ".jsonl"
+        self.path = path
+        self.fmt = fmt
+        self.verbosity = verbosity
+        self.buffer_size = buffer_size
+        self._file = io.StringIO() if path is None else None
+
+    def _stream(self):
+        if self._file is None:
+            self._file = open(self.path, 'a', buffering=self.buffer_size, encoding='utf-8')
+        return self._file
+
+    def log(self, message, event=None, **fields):
+        """Record a message; per-item messages pass an event name and its fields."""
+        if self.fmt == "jsonl":
+            record = {"time": datetime.now().isoformat(), "message": message}
+            if event is not None:
+                record["event"] = event
+            record.update(fields)
+            self._stream().write(json.dumps(record, ensure_ascii=False) + "\n")
+        else:
+            self._stream().write(f"{datetime.now()} - {message}\n")
+
+        is_error = message.startswith("ERROR")
+        if is_error or self.verbosity >= (VERBOSE if event is not None else NORMAL):
+            print(message, file=sys.stderr if is_error else sys.stdout)
+
+    def write_raw(self, text):
+        """Append already formatted log text, e.g. collected by a pool worker."""
+        self._stream().write(text)
+
+    def getvalue(self):
+        """Return the text collected by an in-memory logger."""
+        return self._file.getvalue()
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None and self.path is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def log_message(logger, message, event=None, **fields):
+    """Helper function to write messages to the log."""
+    logger.log(message, event=event, **fields)
+
+def parse_log_options(args, verbosity=NORMAL):
+    """Remove --quiet, --verbose and '--log-format text|jsonl' from an argument list.
+
+    Returns (options, remaining arguments); options are keyword arguments for Logger.
+    """
+    args = list(args)
+    fmt = "text"
+    if "--log-format" in args:
+        index = args.index("--log-format")
+        if index + 1 >= len(args) or args[index + 1] not in FORMATS:
+            print(f"Error: --log-format needs one of: {', '.join(FORMATS)}.")
+            sys.exit(1)
+        fmt = args[index + 1]
+        del args[index:index + 2]
+    if "--quiet" in args:
+        verbosity = QUIET
+    elif "--verbose" in args:
+        verbosity = VERBOSE
+    args = [arg for arg in args if arg not in ("--quiet", "--verbose")]
+    return {"fmt": fmt, "verbosity": verbosity}, args
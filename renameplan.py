@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import errno
+import shutil
+from datetime import datetime
+from manifest import atomic_write_bytes
+
+# Module version
+VERSION = "1.0"
+
+# auto tries a hardlink, then a reflink; copy is only used when asked for (method copy or allow_copy)
+METHODS = ("auto", "link", "reflink", "move", "copy")
+
+# Linux ioctl that makes one file share the data blocks of another (Btrfs, XFS, bcachefs)
+FICLONE = 0x40049409
+
+def reflink(source, target):
+    """Create target as a copy-on-write clone of source; raises OSError where the file system cannot."""
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError(errno.ENOTSUP, "Reflinks are not supported on this platform", target)
+    with open(source, 'rb') as src, open(target, 'xb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        except OSError:
+            dst.close()
+            os.remove(target)
+            raise
+
+def _temporary(path):
+    """Hidden name next to path used while an entry is being placed, so no *.png reader picks it up."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.renaming")
+
+def _two_phase_rename(pairs):
+    """Rename (source, target) path pairs through temporary names, so swaps and cycles within one directory work."""
+    moved = []
+    try:
+        for source, target in pairs:
+            os.rename(source, _temporary(target))
+            moved.append((source, target))
+    except OSError:
+        for source, target in reversed(moved):
+            os.rename(_temporary(target), source)
+        raise
+    for _, target in pairs:
+        os.rename(_temporary(target), target)
+
+class RenamePlan:
+    """A complete list of (old name, new name) renames, checked before any file is touched.
+
+    The new files are normally hardlinks (or reflinks) of the old ones, so
+    no bytes are copied and the input directory stays as it was. Note that a
+    hardlinked output shares its inode with the input: a tool that rewrites
+    the file in place changes both, while one that replaces it (as every
+    script here does when it writes) does not. Method move renames the files
+    instead, in two phases so that a plan may also renumber a directory in place.
+
+    Every applied plan is written as a JSON journal, which undo() reverses.
+    """
+
+    def __init__(self, source_dir, target_dir):
+        self.source_dir = os.path.abspath(source_dir)
+        self.target_dir = os.path.abspath(target_dir)
+        self.entries = []  # (source name, target name)
+
+    def add(self, source_name, target_name):
+        self.entries.append((source_name, target_name))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def source_path(self, source_name):
+        return os.path.join(self.source_dir, source_name)
+
+    def target_path(self, target_name):
+        return os.path.join(self.target_dir, target_name)
+
+    def collisions(self, method="auto", replace=False):
+        """Return a message for every entry the plan cannot apply safely; an empty list means it can be applied."""
+        problems = []
+        seen = {}
+        for source_name, target_name in self.entries:
+            if target_name in seen:
+                problems.append(f"{source_name} and {seen[target_name]} both become {target_name}")
+            seen[target_name] = source_name
+        vacated = {self.source_path(source_name) for source_name, _ in self.entries} if method == "move" else set()
+        for source_name, target_name in self.entries:
+            target = self.target_path(target_name)
+            if target == self.source_path(source_name):
+                continue  # Keeps its name
+            if os.path.lexists(target) and target not in vacated and not replace and \
+                    not (os.path.exists(self.source_path(source_name)) and os.path.samefile(self.source_path(source_name), target)):  # Linked by an earlier run
+                problems.append(f"{target_name} already exists in {self.target_dir}")
+        return problems
+
+    def check(self, method="auto", replace=False):
+        """Raise ValueError listing the collisions of the plan, if any."""
+        problems = self.collisions(method, replace)
+        if problems:
+            shown = problems[:10] + ([f"... and {len(problems) - 10} more"] if len(problems) > 10 else [])
+            raise ValueError(f"The rename plan has {len(problems)} collision(s); nothing was renamed:\n  " + "\n  ".join(shown))
+
+    def _place(self, source, target, method, allow_copy):
+        """Create target from source with method, replacing an existing target atomically; returns the method used."""
+        temporary = _temporary(target)
+        tries = {"auto": ("link", "reflink"), "link": ("link",), "reflink": ("reflink",), "copy": ("copy",)}[method]
+        if allow_copy and "copy" not in tries:
+            tries += ("copy",)
+        error = None
+        for attempt in tries:
+            try:
+                if attempt == "link":
+                    os.link(source, temporary)
+                elif attempt == "reflink":
+                    reflink(source, temporary)
+                else:
+                    shutil.copy(source, temporary)
+                os.replace(temporary, target)
+                return attempt
+            except OSError as e:
+                error = e
+                if os.path.lexists(temporary):
+                    os.remove(temporary)
+        raise OSError(error.errno, f"Unable to {' or '.join(tries)} {source} to {target} ({error.strerror}); "
+                                   "use --method copy or --allow-copy to copy instead", target)
+
+    def apply(self, method="auto", allow_copy=False, replace=False, journal_path=None, pack=None):
+        """Check the plan, write its journal and apply it; returns the path of the journal.
+
+        With pack (an open GlyphPack) the sources are archive entries, which are written out as files.
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown method {method}; use one of {', '.join(METHODS)}.")
+        if pack is not None:
+            method = "extract"
+        self.check(method, replace)
+        os.makedirs(self.target_dir, exist_ok=True)
+        if journal_path is None:
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            journal_path = self.target_path(f"rename_journal_{stamp}.json")
+            number = 1
+            while os.path.exists(journal_path):  # Two runs within one second
+                number += 1
+                journal_path = self.target_path(f"rename_journal_{stamp}_{number}.json")
+        used = [None] * len(self.entries)
+        self._write_journal(journal_path, method, "planned", used)  # An interrupted run can still be undone
+
+        if method == "move":
+            pairs = [(self.source_path(source_name), self.target_path(target_name))
+                     for source_name, target_name in self.entries
+                     if self.source_path(source_name) != self.target_path(target_name)]
+            _two_phase_rename(pairs)
+            used = ["move"] * len(self.entries)
+        else:
+            try:
+                for i, (source_name, target_name) in enumerate(self.entries):
+                    target = self.target_path(target_name)
+                    if pack is not None:
+                        atomic_write_bytes(target, pack.read(source_name))
+                        used[i] = "extract"
+                    else:
+                        used[i] = self._place(self.source_path(source_name), target, method, allow_copy)
+            finally:
+                if not all(used):
+                    self._write_journal(journal_path, method, "partial", used)
+                    print(f"Rename stopped after {sum(map(bool, used))} of {len(used)} files; undo with: "
+                          f"python renameplan.py undo {journal_path}")
+        self._write_journal(journal_path, method, "applied", used)
+        return journal_path
+
+    def _write_journal(self, journal_path, method, state, used):
+        journal = {
+            "version": VERSION, "created": datetime.now().isoformat(timespec="seconds"),
+            "source_dir": self.source_dir, "target_dir": self.target_dir,
+            "method": method, "state": state,
+            "entries": [[source_name, target_name, entry_method]
+                        for (source_name, target_name), entry_method in zip(self.entries, used)],
+        }
+        atomic_write_bytes(journal_path, json.dumps(journal, indent=1).encode('utf-8'))
+
+def undo(journal_path):
+    """Reverse the plan recorded in a journal; returns the number of files restored or removed.
+
+    Linked, cloned, copied and extracted files are removed and moved files
+    are renamed back. Files a plan replaced with --replace are not restored.
+    """
+    with open(journal_path, encoding='utf-8') as f:
+        journal = json.load(f)
+    if journal["state"] == "undone":
+        return 0
+    source_dir, target_dir = journal["source_dir"], journal["target_dir"]
+    count = 0
+    if journal["method"] == "move":
+        pairs = [(os.path.join(target_dir, target_name), os.path.join(source_dir, source_name))
+                 for source_name, target_name, _ in journal["entries"]
+                 if source_name != target_name or source_dir != target_dir]
+        pairs = [(target, source) for target, source in pairs if os.path.lexists(target)]
+        _two_phase_rename(pairs)
+        count = len(pairs)
+    else:
+        for _, target_name, entry_method in journal["entries"]:
+            target = os.path.join(target_dir, target_name)
+            if entry_method is not None and os.path.lexists(target):
+                os.remove(target)
+                count += 1
+    journal["state"] = "undone"
+    atomic_write_bytes(journal_path, json.dumps(journal, indent=1).encode('utf-8'))
+    return count
+
+def parse_rename_options(args):
+    """Remove '--method M', '--allow-copy' and '--replace' from an argument list.
+
+    Returns ({"method": M, "allow_copy": bool, "replace": bool}, remaining arguments).
+    """
+    args = list(args)
+    options = {"method": "auto", "allow_copy": False, "replace": False}
+    if "--method" in args:
+        index = args.index("--method")
+        if index + 1 >= len(args) or args[index + 1] not in METHODS:
+            print(f"Error: --method needs one of {', '.join(METHODS)}.")
+            sys.exit(1)
+        options["method"] = args[index + 1]
+        del args[index:index + 2]
+    for flag in ("--allow-copy", "--replace"):
+        if flag in args:
+            options[flag[2:].replace("-", "_")] = True
+            args = [arg for arg in args if arg != flag]
+    return options, args
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("undo", "show"):
+        print("Usage: python renameplan.py undo <rename_journal.json>")
+        print("       python renameplan.py show <rename_journal.json>")
+        sys.exit(1)
+
+    if sys.argv[1] == "undo":
+        print(f"Undid {undo(sys.argv[2])} renames recorded in {sys.argv[2]}")
+    else:
+        with open(sys.argv[2], encoding='utf-8') as f:
+            journal = json.load(f)
+        print(f"{journal['state']} {journal['method']} plan of {len(journal['entries'])} files, "
+              f"{journal['source_dir']} -> {journal['target_dir']}")
+        for source_name, target_name, entry_method in journal["entries"]:
+            print(f"{source_name}\t{target_name}\t{entry_method or '-'}")
@@ -3,8 +3,9 @@ import os
 from PyQt5.QtWidgets import QApplication, QWidget, QGridLayout, QLabel, QScrollArea
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtCore import Qt
+from glyphpack import GlyphPack, is_pack, list_images
 
-SCRIPT_VERSION = "2.2"
+SCRIPT_VERSION = "2.3"
 
 class ImageGrid(QWidget):
     def __init__(self, image_dir):
@@ -15,9 +16,10 @@ class ImageGrid(QWidget):
         # Initialize navigation variables
         self.current_index = 0
 
-        # Get PNG files sorted alphabetically
-        self.images = sorted([f for f in os.listdir(image_dir) if f.lower().endswith('.png')])
+        # Get PNG files sorted alphabetically, from a directory or a glyph archive
+        self.images = list_images(image_dir)
         self.image_dir = image_dir
+        self.pack = GlyphPack(image_dir) if is_pack(image_dir) else None
 
         # Create a scrollable area
         scroll_area = QScrollArea(self)
@@ -34,8 +36,7 @@ class ImageGrid(QWidget):
             row = index // self.max_col
             col = index % self.max_col
             label = QLabel(self)
-            pixmap = QPixmap(os.path.join(image_dir, image))
-            label.setPixmap(pixmap)
+            label.setPixmap(self.load_pixmap(image))
             label.setStyleSheet("border: 2px solid transparent;")
             self.grid_layout.addWidget(label, row, col)
             self.labels.append(label)
@@ -55,6 +56,14 @@ class ImageGrid(QWidget):
         # Set focus after initialization
         self.setFocus()
 
+    def load_pixmap(self, image):
+        """Load an image from the directory, or decode it from the archive without extracting it."""
+        if self.pack is None:
+            return QPixmap(os.path.join(self.image_dir, image))
+        pixmap = QPixmap()
+        pixmap.loadFromData(self.pack.read(image), "PNG")
+        return pixmap
+
     def update_selection(self, new_index):
         """Update the selection highlighting."""
         # Clear previous selection
@@ -100,12 +109,12 @@ def main():
     print(f"Script version: {SCRIPT_VERSION}")
 
     if len(sys.argv) != 2:
-        print("Usage: python image_grid.py <image_directory>")
+        print("Usage: python image_grid.py <image_directory | archive.ptpack>")
         sys.exit(1)
 
     image_dir = sys.argv[1]
-    if not os.path.isdir(image_dir):
-        print(f"Error: {image_dir} is not a valid directory.")
+    if not os.path.isdir(image_dir) and not (is_pack(image_dir) and os.path.isfile(image_dir)):
+        print(f"Error: {image_dir} is not a valid directory or glyph archive.")
         sys.exit(1)
 
     app = QApplication(sys.argv)
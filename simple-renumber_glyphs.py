@@ -1,37 +1,27 @@
 import os
-import re
-import shutil
 from collections import defaultdict
-from datetime import datetime
-
-def log_message(log_file, message):
-    """Helper function to write messages to the log file and print to console."""
-    with open(log_file, 'a') as f:
-        f.write(f"{datetime.now()} - {message}\n")
-    print(message)
-
-def parse_filename(filename):
-    """Extract number1, number2, number3 from filename."""
-    match = re.match(r"m(\d+)_R_lines_(\d+)_chunk_(\d+)\.png", filename)
-    if match:
-        return tuple(map(int, match.groups()))  # Convert to integers for sorting
-    return None
-
-def rename_files(input_dir, output_dir):
-    """Rename files while keeping order and continuity in number2."""
+from ptlog import Logger, log_message, parse_log_options
+from provenance import ProvenanceStore, parse_provenance
+from renameplan import RenamePlan, parse_rename_options
+from nameindex import parse_index_cache, scan
+
+def rename_files(input_dir, output_dir, log_options=None, provenance=None, rename_options=None, index_cache=False):
+    """Rename files while keeping order and continuity in number2.
+
+    The whole plan is checked for collisions before any file is touched and
+    applied with hardlinks by default (see renameplan); its journal is saved in output_dir.
+    """
     
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    log_file = os.path.join(output_dir, "rename_log.txt")
-    log_message(log_file, "Starting renaming process...")
+    logger = Logger(os.path.join(output_dir, "rename_log.txt"), **(log_options or {}))
+    store = ProvenanceStore(provenance) if provenance is not None else None
+    log_message(logger, "Starting renaming process...")
 
-    # Step 1: Read and parse all valid filenames
-    file_data = []
-    for filename in sorted(os.listdir(input_dir)):  # Ensure alphabetical order
-        parsed = parse_filename(filename)
-        if parsed:
-            file_data.append((filename, *parsed))
+    # Step 1: Read the plain chunk filenames (no + joins or - splits) in alphabetical order
+    file_data = [(chunk.name, chunk.mask, chunk.line, chunk.chunk)
+                 for chunk in scan(input_dir, cache=index_cache).chunks if chunk.suffix is None]
 
     # Step 2: Process files grouped by number1
     grouped_files = defaultdict(list)
@@ -42,6 +32,7 @@ def rename_files(input_dir, output_dir):
     stats_max_number2 = {}  # Max number2 per number1
     stats_max_number3 = defaultdict(int)  # Max number3 per number2
     total_files = len(file_data)
+    plan = RenamePlan(input_dir, output_dir)
 
     for number1, files in grouped_files.items():
         files.sort(key=lambda x: (x[1], x[2]))  # Sort by number2, then number3
@@ -55,36 +46,57 @@ def rename_files(input_dir, output_dir):
 
             new_number2 = new_number2_map[number2]
             new_name = f"t{number1:02d}_l{new_number2:02d}g{number3:02d}.png"
-            shutil.copy(os.path.join(input_dir, filename), os.path.join(output_dir, new_name))
-
-            # Log renaming action
-            log_message(log_file, f"Renamed: {filename} -> {new_name}")
+            plan.add(filename, new_name)
 
             # Update statistics
             stats_max_number2[number1] = max(stats_max_number2.get(number1, 0), new_number2)
             stats_max_number3[new_number2] = max(stats_max_number3[new_number2], number3)
 
-    # Step 4: Print and log statistics
-    log_message(log_file, "\nStatistics:")
-    for number1, max_n2 in stats_max_number2.items():
-        log_message(log_file, f"Max number2 for {number1:02d}: {max_n2:02d}")
-
-    for number2, max_n3 in stats_max_number3.items():
-        log_message(log_file, f"Max number3 for {number2:02d}: {max_n3:02d}")
-
-    log_message(log_file, f"Total number of files: {total_files}")
+    # Step 4: Apply the checked plan and log every renaming action
+    try:
+        journal = plan.apply(**(rename_options or {}))
+    except (ValueError, OSError) as e:
+        log_message(logger, f"ERROR: {e}")
+        journal = None
+    for filename, new_name in plan.entries if journal is not None else []:
+        log_message(logger, f"Renamed: {filename} -> {new_name}", event="rename", source=filename, target=new_name)
+        if store is not None and not store.record_alias(filename, new_name, path=plan.target_path(new_name)):
+            log_message(logger, f"No provenance recorded for {new_name}: {filename} is not in {provenance}")
+    if journal is not None:
+        log_message(logger, f"Rename journal: {journal}")
+
+    # Step 5: Print and log statistics
+    if journal is not None:
+        log_message(logger, "\nStatistics:")
+        for number1, max_n2 in stats_max_number2.items():
+            log_message(logger, f"Max number2 for {number1:02d}: {max_n2:02d}")
+
+        for number2, max_n3 in stats_max_number3.items():
+            log_message(logger, f"Max number3 for {number2:02d}: {max_n3:02d}")
+
+        log_message(logger, f"Total number of files: {total_files}")
+    logger.close()
+    if store is not None:
+        store.close()
+    return journal
 
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) != 3:
-        print("Usage: python simple-renumber_lines.py <input_directory> <output_directory>")
+    log_options, args = parse_log_options(sys.argv[1:])
+    provenance, args = parse_provenance(args)
+    rename_options, args = parse_rename_options(args)
+    index_cache, args = parse_index_cache(args)
+    if len(args) != 2:
+        print("Usage: python simple-renumber_lines.py <input_directory> <output_directory> [--method auto|link|reflink|move|copy] [--allow-copy] [--replace] [--index-cache] [--provenance DB] [--quiet | --verbose] [--log-format text|jsonl]")
         sys.exit(1)
 
-    input_directory = sys.argv[1]
-    output_directory = sys.argv[2]
+    input_directory = args[0]
+    output_directory = args[1]
 
     if not os.path.isdir(input_directory):
         print(f"Error: {input_directory} is not a valid directory.")
         sys.exit(1)
 
-    rename_files(input_directory, output_directory)
+    if rename_files(input_directory, output_directory, log_options=log_options, provenance=provenance,
+                    rename_options=rename_options, index_cache=index_cache) is None:
+        sys.exit(1)
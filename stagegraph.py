@@ -0,0 +1,70 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Module version
+VERSION = "1.0"
+
+class StageGraph:
+    """Named pipeline stages, each started as soon as the stages it depends on have finished.
+
+    Stages are plain functions called in threads of one process, so they
+    share the imported modules and independent branches overlap: the OpenCV,
+    file and subprocess work of the stages releases the GIL. A stage may only
+    depend on stages added before it, so the graph cannot have a cycle.
+    """
+
+    def __init__(self):
+        self.stages = {}  # name -> (function, names of the stages it depends on)
+        self.results = {}  # name -> return value of the stage's function, once it has run
+
+    def add(self, name, function, after=()):
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already in the graph")
+        unknown = [dependency for dependency in after if dependency not in self.stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on unknown stage(s) {', '.join(unknown)}")
+        self.stages[name] = (function, tuple(after))
+
+    def __len__(self):
+        return len(self.stages)
+
+    def run(self, on_start=None, on_finish=None):
+        """Run every stage once, keeping what each returns in results, and return {name: seconds}.
+
+        on_start(name) and on_finish(name, seconds) are called as stages start and end.
+        The first exception raised by a stage (SystemExit included) stops new
+        stages from starting; it is raised again once the running ones have finished.
+        """
+        remaining = dict(self.stages)
+        done, timings, running = set(), {}, {}
+        failure = None
+        with ThreadPoolExecutor(max_workers=max(len(self.stages), 1)) as pool:
+            while remaining or running:
+                if failure is None:
+                    for name, (function, after) in list(remaining.items()):
+                        if all(dependency in done for dependency in after):
+                            del remaining[name]
+                            if on_start is not None:
+                                on_start(name)
+                            running[pool.submit(_timed, function)] = name
+                if not running:
+                    break  # Stopped by a failure
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        self.results[name], timings[name] = future.result()
+                    except BaseException as e:
+                        failure = failure or e
+                        continue
+                    done.add(name)
+                    if on_finish is not None:
+                        on_finish(name, timings[name])
+        if failure is not None:
+            raise failure
+        return timings
+
+def _timed(function):
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
@@ -0,0 +1,190 @@
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from parallel import parse_jobs
+from manifest import atomic_write_bytes, file_hash, write_if_changed
+
+# Module version
+VERSION = "1.0"
+
+# Build files are kept in a hidden directory next to the document:
+#   <unit>.tex and <unit>.pdf for every unit, and index.json with the input
+#   key and page count of each unit's PDF.
+BUILD_DIR = ".tablebuild"
+
+NEWPAGE = re.compile(r"^\s*\\newpage\s*$")
+TABLE_INPUT = re.compile(r"^\s*\\input\s*\{\s*t(\d+)_", re.M)
+INPUT = re.compile(r"^[^%\n]*?\\input\s*\{\s*([^}\s]+)\s*\}", re.M)
+GRAPHICS = re.compile(r"\\(?:PTglyph\{[^}]*\}|includegraphics(?:\[[^]]*\])?)\{([^}]+)\}")
+DECLARATION = re.compile(r"^\s*\\(?:def|newcommand|renewcommand|catcode)\b")
+ROUNDS = 3  # Page offsets settle in two rounds unless a rebuilt table changed its page count again
+
+def split_document(path):
+    """Split a font table document into its preamble, body declarations and units.
+
+    The body (up to the first \\end{document}) is cut at every \\newpage
+    line. A part that inputs the files of one table (tNN_glyphs.tex and
+    tNN_glyphids.tex) starts a unit named tNN; the parts before the first
+    table form the unit "front" and any other part stays with the unit before it.
+    The declarations of the front matter (\\def, \\newcommand, \\catcode ...)
+    are repeated in every table unit, so each one compiles on its own.
+
+    Returns (preamble, declarations, [(name, body), ...]).
+    """
+    with open(path, encoding='utf-8') as f:
+        lines = f.read().split("\n")
+    begin = next(i for i, line in enumerate(lines) if line.strip().startswith("\\begin{document}"))
+    end = next((i for i, line in enumerate(lines[begin:], begin) if line.strip().startswith("\\end{document}")), len(lines))
+    parts = [[]]
+    for line in lines[begin + 1:end]:
+        if NEWPAGE.match(line):
+            parts.append([])
+        parts[-1].append(line)
+
+    units = []
+    for part in parts:
+        text = "\n".join(part)
+        tables = sorted(set(TABLE_INPUT.findall(text)))
+        if len(tables) == 1 or not units:
+            units.append([f"t{tables[0]}" if len(tables) == 1 else "front", text])
+        else:
+            units[-1][1] += "\n" + text
+    declarations = "\n".join(line for line in units[0][1].split("\n") if DECLARATION.match(line)) \
+        if units[0][0] == "front" else ""
+    return "\n".join(lines[:begin]), declarations, [tuple(unit) for unit in units]
+
+def unit_source(preamble, declarations, name, body, first_page):
+    """Return the standalone document of one unit, numbered from first_page."""
+    return "\n".join([preamble, "\\begin{document}", f"\\setcounter{{page}}{{{first_page}}}",
+                      declarations if name != "front" else "", body, "\\end{document}", ""])
+
+def unit_inputs(source, directory):
+    """Return the files a unit reads: its \\input files and the images they and it include, recursively."""
+    seen, texts, files = set(), [source], []
+    while texts:
+        text = texts.pop()
+        for name in INPUT.findall(text):
+            path = os.path.join(directory, name if name.endswith(".tex") else f"{name}.tex")
+            if path not in seen and os.path.exists(path):
+                seen.add(path)
+                files.append(path)
+                with open(path, encoding='utf-8') as f:
+                    texts.append(f.read())
+        for name in GRAPHICS.findall(text):
+            path = os.path.join(directory, name if "/" in name else os.path.join("glyphs", name))
+            if path not in seen and os.path.exists(path):
+                seen.add(path)
+                files.append(path)
+    return sorted(files)
+
+def unit_key(source, directory):
+    """Hash of a unit's source and of the content of every file it reads; equal keys give the same PDF."""
+    digest = hashlib.sha256(f"{VERSION}\n{source}".encode('utf-8'))
+    for path in unit_inputs(source, directory):
+        digest.update(f"\n{os.path.relpath(path, directory)} {file_hash(path)}".encode('utf-8'))
+    return digest.hexdigest()
+
+def compile_unit(directory, name):
+    """Run xelatex on BUILD_DIR/<name>.tex from directory; returns the page count of the PDF."""
+    build_dir = os.path.join(directory, BUILD_DIR)
+    result = subprocess.run(['xelatex', '-file-line-error', '-interaction=nonstopmode',
+                             f'-output-directory={BUILD_DIR}', os.path.join(BUILD_DIR, f"{name}.tex")],
+                            cwd=directory, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    log_path = os.path.join(build_dir, f"{name}.log")
+    if result.returncode != 0 or not os.path.exists(os.path.join(build_dir, f"{name}.pdf")):
+        raise RuntimeError(f"xelatex failed on unit {name}; see {log_path}")
+    with open(log_path, encoding='utf-8', errors='replace') as f:
+        match = re.search(r"Output written on .*?\((\d+) pages?", f.read(), re.S)
+    return int(match.group(1)) if match else 1
+
+def merge_pdfs(paths, output_path):
+    """Concatenate PDFs with pypdf if it is installed, else with pdfunite or qpdf."""
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        PdfWriter = None
+    if PdfWriter is not None:
+        writer = PdfWriter()
+        for path in paths:
+            writer.append(path)
+        with open(output_path, 'wb') as f:
+            writer.write(f)
+    elif shutil.which('pdfunite'):
+        subprocess.run(['pdfunite'] + paths + [output_path], check=True)
+    elif shutil.which('qpdf'):
+        subprocess.run(['qpdf', '--empty', '--pages'] + paths + ['--', output_path], check=True)
+    else:
+        raise RuntimeError("Merging PDFs needs pypdf, pdfunite (poppler-utils) or qpdf")
+
+def build(document, jobs=1, log=print):
+    """Compile a font table document one unit at a time and merge the units into <document>.pdf.
+
+    Units are compiled concurrently, jobs xelatex processes at a time, and
+    a unit whose source, \\input files and glyph images are unchanged reuses
+    its PDF from the previous build. Each unit starts at the page after the
+    one before it ends; a unit whose page count changes therefore also
+    rebuilds the units after it, in a further round. Returns the names of the units compiled.
+    """
+    directory = os.path.dirname(os.path.abspath(document))
+    build_dir = os.path.join(directory, BUILD_DIR)
+    os.makedirs(build_dir, exist_ok=True)
+    index_path = os.path.join(build_dir, "index.json")
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        index = {}
+    if index.get("version") != VERSION:
+        index = {"version": VERSION, "units": {}}
+    preamble, declarations, units = split_document(document)
+
+    compiled = []
+    for round_number in range(ROUNDS + 1):
+        # Page numbers from the page counts known so far
+        stale, first_page = [], 1
+        for name, body in units:
+            source = unit_source(preamble, declarations, name, body, first_page)
+            key = unit_key(source, directory)
+            entry = index["units"].get(name)
+            if entry is None or entry["key"] != key or not os.path.exists(os.path.join(build_dir, f"{name}.pdf")):
+                write_if_changed(os.path.join(build_dir, f"{name}.tex"), source.encode('utf-8'))
+                stale.append((name, key))
+            first_page += entry["pages"] if entry is not None else 1
+        if not stale:
+            break
+        if round_number == ROUNDS:
+            log(f"Page numbers did not settle after {ROUNDS} rounds; {len(stale)} units may be numbered wrongly")
+            break
+        log(f"Compiling {len(stale)} of {len(units)} units: {', '.join(name for name, _ in stale)}")
+        with ThreadPoolExecutor(max_workers=jobs) as pool:  # Each worker waits on its own xelatex process
+            pages = list(pool.map(lambda item: compile_unit(directory, item[0]), stale))
+        for (name, key), count in zip(stale, pages):
+            index["units"][name] = {"key": key, "pages": count}
+        atomic_write_bytes(index_path, json.dumps(index, indent=1).encode('utf-8'))
+        compiled.extend(name for name, _ in stale)
+
+    output_path = os.path.splitext(os.path.abspath(document))[0] + ".pdf"
+    merge_pdfs([os.path.join(build_dir, f"{name}.pdf") for name, _ in units], output_path)
+    log(f"Merged {len(units)} units into {output_path}")
+    return compiled
+
+if __name__ == "__main__":
+    jobs, args = parse_jobs(sys.argv[1:])
+    if len(args) != 1:
+        print("Usage: python tablebuild.py <document.tex> [--jobs N]")
+        sys.exit(1)
+
+    if not os.path.isfile(args[0]):
+        print(f"Error: {args[0]} is not a valid file.")
+        sys.exit(1)
+
+    try:
+        build(args[0], jobs=jobs)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
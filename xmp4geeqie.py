@@ -1,11 +1,18 @@
 import os
+import queue
+import struct
 import subprocess
 import sys
 import hashlib
 import json
+from datetime import datetime
+from xml.sax.saxutils import escape
+from concurrent.futures import ThreadPoolExecutor
+from parallel import parse_jobs
+from manifest import atomic_write_bytes
 
 # Script version
-SCRIPT_VERSION = "1.7"
+SCRIPT_VERSION = "1.9"
 
 # Exiv2-style sorting order for TIFF and EXIF tags
 TIFF_TAGS = [
@@ -20,79 +27,315 @@ EXIF_TAGS = [
     "41990", "41991", "41992", "41993", "41994", "41995", "41996", "42016"
 ]
 
-def extract_exif_binary(image_path, tag_list):
+BATCH_SIZE = 100  # Images read by one exiftool request
+
+# A new sidecar laid out as exiftool writes one: a Description per namespace, in prefix order
+XMP_TEMPLATE = """<?xpacket begin='\ufeff' id='W5M0MpCehiHzreSzNTczkc9d'?>
+<x:xmpmeta xmlns:x='adobe:ns:meta/' x:xmptk='xmp4geeqie v{version}'>
+<rdf:RDF xmlns:rdf='http://www.w3.org/1999/02/22-rdf-syntax-ns#'>
+
+ <rdf:Description rdf:about=''
+  xmlns:dc='http://purl.org/dc/elements/1.1/'>
+  <dc:description>
+   <rdf:Alt>
+    <rdf:li xml:lang='x-default'>{description}</rdf:li>
+   </rdf:Alt>
+  </dc:description>
+ </rdf:Description>
+
+ <rdf:Description rdf:about=''
+  xmlns:exif='http://ns.adobe.com/exif/1.0/'>
+  <exif:NativeDigest>{exif_digest}</exif:NativeDigest>
+ </rdf:Description>
+
+ <rdf:Description rdf:about=''
+  xmlns:tiff='http://ns.adobe.com/tiff/1.0/'>
+  <tiff:NativeDigest>{tiff_digest}</tiff:NativeDigest>
+ </rdf:Description>
+
+ <rdf:Description rdf:about=''
+  xmlns:xmp='http://ns.adobe.com/xap/1.0/'>
+  <xmp:CreateDate>{create_date}</xmp:CreateDate>
+  <xmp:Rating>1</xmp:Rating>
+ </rdf:Description>
+</rdf:RDF>
+</x:xmpmeta>
+<?xpacket end='w'?>"""
+
+# PNG chunks that can carry EXIF or TIFF tags: eXIf, and the text chunks with the keywords
+# ImageMagick and exiftool use for raw EXIF profiles and XMP (not e.g. date:create)
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+TEXT_CHUNKS = {b"tEXt", b"zTXt", b"iTXt"}
+METADATA_KEYWORDS = {b"Raw profile type exif", b"Raw profile type APP1", b"XML:com.adobe.xmp"}
+
+class ExifToolSession:
+    """One exiftool process kept open with -stay_open, reading argument lists from stdin.
+
+    Each execute() sends the arguments of one command, one per line, and
+    reads its output up to the {readyN} line exiftool prints when it is done,
+    so the Perl interpreter is started once instead of once per command.
+    """
+
+    def __init__(self, executable="exiftool"):
+        self.process = subprocess.Popen([executable, "-stay_open", "True", "-@", "-"],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.count = 0
+
+    def _read_until(self, stream, marker):
+        lines = []
+        while True:
+            line = stream.readline()
+            if not line:
+                raise RuntimeError("exiftool exited unexpectedly")
+            line = line.decode('utf-8', errors='replace')
+            if line.rstrip("\r\n") == marker:
+                return "".join(lines)
+            lines.append(line)
+
+    def execute(self, *args):
+        """Run one exiftool command; returns (stdout, stderr) as text."""
+        self.count += 1
+        marker = f"{{ready{self.count}}}"
+        lines = list(args) + ["-echo4", marker, f"-execute{self.count}"]
+        self.process.stdin.write("".join(f"{arg}\n" for arg in lines).encode('utf-8'))
+        self.process.stdin.flush()
+        # -echo4 writes the marker to stderr once the command has finished
+        return self._read_until(self.process.stdout, marker), self._read_until(self.process.stderr, marker)
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.stdin.write(b"-stay_open\nFalse\n")
+            self.process.stdin.flush()
+            self.process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def tag_bytes(exif_data, tag_list):
+    """Return the binary value of every tag in tag_list from exiftool's JSON for one image."""
+    tag_values = []
+    for tag in tag_list:
+        value = exif_data.get(tag, None)
+        if value is not None:
+            tag_values.append(value.encode() if isinstance(value, str) else bytes(value))
+        else:
+            tag_values.append(b"")  # Include empty fields for Exiv2 consistency
+    return tag_values
+
+def native_digest(tag_values, tag_list):
+    """Format a NativeDigest as 'tagID1,tagID2,...;MD5_HASH'."""
+    # Compute MD5 hash of concatenated binary values
+    md5_hash = hashlib.md5(b"".join(tag_values)).hexdigest().upper()
+
+    return f"{','.join(tag_list)};{md5_hash}" if tag_list else f";{md5_hash}"
+
+def read_exif(session, image_paths, tag_list):
+    """Read tag_list from many images in one exiftool request; returns {image path: JSON data}."""
+    stdout, _ = session.execute("-b", "-j", *[f"-{tag}" for tag in tag_list], *image_paths)
+    try:
+        return {entry.get("SourceFile"): entry for entry in json.loads(stdout)}
+    except json.JSONDecodeError:
+        return {}  # No readable image in the batch
+
+def extract_exif_binary(image_path, tag_list, session=None):
     """Extracts binary EXIF/TIFF metadata based on tag list."""
+    if session is not None:
+        return tag_bytes(read_exif(session, [image_path], tag_list).get(image_path, {}), tag_list)
     try:
         result = subprocess.run(
             ["exiftool", "-b", "-j"] + [f"-{tag}" for tag in tag_list] + [image_path],
             capture_output=True, text=True, check=True
         )
-        exif_data = json.loads(result.stdout)[0]
-
-        tag_values = []
-        for tag in tag_list:
-            value = exif_data.get(tag, None)
-            if value is not None:
-                tag_values.append(value.encode() if isinstance(value, str) else bytes(value))
-            else:
-                tag_values.append(b"")  # Include empty fields for Exiv2 consistency
-
-        return tag_values
+        return tag_bytes(json.loads(result.stdout)[0], tag_list)
 
     except (subprocess.CalledProcessError, IndexError, json.JSONDecodeError):
         return [b""] * len(tag_list)  # Return empty list if metadata is missing
 
-def compute_native_digest(image_path, tiff_only=False):
+def compute_native_digest(image_path, tiff_only=False, session=None):
     """Computes NativeDigest in the format 'tagID1,tagID2,...;MD5_HASH'."""
     tag_list = TIFF_TAGS if tiff_only else EXIF_TAGS
-    tag_values = extract_exif_binary(image_path, tag_list)
+    return native_digest(extract_exif_binary(image_path, tag_list, session=session), tag_list)
 
-    # Compute MD5 hash of concatenated binary values
-    md5_hash = hashlib.md5(b"".join(tag_values)).hexdigest().upper()
+def sidecar_is_current(image_path, xmp_path):
+    """True if the sidecar exists and is not older than its image."""
+    try:
+        return os.stat(xmp_path).st_mtime_ns >= os.stat(image_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
 
-    return f"{','.join(tag_list)};{md5_hash}" if tag_list else f";{md5_hash}"
+def write_batch(session, image_paths):
+    """Create the sidecars of a batch of images through one exiftool session; returns the messages to print."""
+    messages = []
+    # One read for both digests: the TIFF and EXIF values come from the same JSON entry
+    exif = read_exif(session, image_paths, TIFF_TAGS + EXIF_TAGS)
+    for image_path in image_paths:
+        filename = os.path.basename(image_path)
+        xmp_path = f"{image_path}.gq.xmp"
+        if os.path.exists(xmp_path):
+            messages.append(f"Warning: {xmp_path} already exists and will be overwritten.")
+            os.remove(xmp_path)  # Force overwrite
+
+        exif_data = exif.get(image_path, {})
+        tiff_digest = native_digest(tag_bytes(exif_data, TIFF_TAGS), TIFF_TAGS)
+        exif_digest = native_digest(tag_bytes(exif_data, EXIF_TAGS), EXIF_TAGS)
+
+        _, stderr = session.execute(
+            "-XMP:CreateDate=now",
+            "-XMP:Rating=1",
+            "-XMP-dc:Description=Geeqie XMP generated by xmp4geeqie v" + SCRIPT_VERSION,
+            "-XMP-tiff:NativeDigest=" + tiff_digest,  # Set TIFF NativeDigest
+            "-XMP-exif:NativeDigest=" + exif_digest,  # Set EXIF NativeDigest
+            "-overwrite_original",  # Ensure file is modified, not recreated
+            xmp_path
+        )
+        if "Error" in stderr or not os.path.exists(xmp_path):
+            messages.append(f"❌ Error processing {filename}: {stderr.strip()}")
+            continue
+        messages.append(f"✅ XMP file created for {filename}")
+        messages.append(f"   → TIFF NativeDigest: {tiff_digest}")
+        messages.append(f"   → EXIF NativeDigest: {exif_digest}")
+    return messages
+
+def carries_metadata(image_path):
+    """True unless the file is a PNG without any chunk that could hold EXIF or TIFF tags."""
+    try:
+        with open(image_path, 'rb') as f:
+            if f.read(8) != PNG_SIGNATURE:
+                return True
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return False
+                length, chunk_type = struct.unpack(">I4s", header)
+                if chunk_type == b"eXIf":
+                    return True
+                if chunk_type == b"IEND":
+                    return False
+                if chunk_type in TEXT_CHUNKS:
+                    data = f.read(min(length, 80))
+                    if data.split(b"\0", 1)[0] in METADATA_KEYWORDS:
+                        return True
+                    f.seek(length - len(data) + 4, os.SEEK_CUR)
+                else:
+                    f.seek(length + 4, os.SEEK_CUR)  # Data and CRC
+    except OSError:
+        return True
+
+def xmp_packet(tiff_digest, exif_digest, create_date=None):
+    """Return the sidecar xmp4geeqie writes, as bytes."""
+    create_date = create_date or datetime.now().astimezone().isoformat(timespec="seconds")
+    return XMP_TEMPLATE.format(version=SCRIPT_VERSION, create_date=create_date,
+                               description=escape(f"Geeqie XMP generated by xmp4geeqie v{SCRIPT_VERSION}"),
+                               tiff_digest=escape(tiff_digest), exif_digest=escape(exif_digest)).encode('utf-8')
+
+class DigestCache:
+    """NativeDigests computed once per distinct tag values; images without tags all share one."""
+
+    def __init__(self):
+        self.digests = {}
 
-def generate_xmp_files(image_dir):
-    """Creates Geeqie-compatible XMP files for PNG images."""
+    def get(self, exif_data, tag_list):
+        tag_values = tag_bytes(exif_data, tag_list)
+        key = (tuple(tag_list), tuple(tag_values))
+        if key not in self.digests:
+            self.digests[key] = native_digest(tag_values, tag_list)
+        return self.digests[key]
+
+def write_native(image_paths, digests, exif=None, create_date=None):
+    """Write the sidecars of images in Python; exif maps an image to its exiftool JSON, if it was read.
+
+    Returns the messages to print.
+    """
+    messages = []
+    for image_path in image_paths:
+        filename = os.path.basename(image_path)
+        xmp_path = f"{image_path}.gq.xmp"
+        if os.path.exists(xmp_path):
+            messages.append(f"Warning: {xmp_path} already exists and will be overwritten.")
+
+        exif_data = (exif or {}).get(image_path, {})
+        tiff_digest = digests.get(exif_data, TIFF_TAGS)
+        exif_digest = digests.get(exif_data, EXIF_TAGS)
+        atomic_write_bytes(xmp_path, xmp_packet(tiff_digest, exif_digest, create_date))
+        messages.append(f"✅ XMP file created for {filename}")
+        messages.append(f"   → TIFF NativeDigest: {tiff_digest}")
+        messages.append(f"   → EXIF NativeDigest: {exif_digest}")
+    return messages
+
+def run_sessions(batches, work, jobs):
+    """Call work(session, batch) for every batch on up to jobs exiftool sessions; prints the messages in order."""
+    sessions = queue.Queue()
+    for _ in range(min(jobs, len(batches))):
+        sessions.put(ExifToolSession())
+
+    def process(batch):
+        session = sessions.get()
+        try:
+            return work(session, batch)
+        finally:
+            sessions.put(session)
+
+    try:
+        with ThreadPoolExecutor(max_workers=sessions.qsize()) as pool:
+            for messages in pool.map(process, batches):  # Printed in directory order
+                for message in messages:
+                    print(message)
+    finally:
+        while not sessions.empty():
+            sessions.get().close()
+
+def generate_xmp_files(image_dir, jobs=1, force=False, use_exiftool=False):
+    """Creates Geeqie-compatible XMP files for PNG images.
+
+    Sidecars are written in Python. The NativeDigests of a PNG without
+    metadata chunks are those of empty tags, computed once for the whole
+    run; only images that carry metadata have their tags read by exiftool,
+    in batches over jobs sessions kept open for the run. With use_exiftool
+    exiftool reads and writes every sidecar, as earlier versions did.
+    Images whose sidecar is not older than the image are skipped unless force is set.
+    """
     if not os.path.exists(image_dir):
         print(f"Error: Directory {image_dir} does not exist.")
         sys.exit(1)
 
-    for filename in os.listdir(image_dir):
-        if filename.lower().endswith(".png"):
-            image_path = os.path.join(image_dir, filename)
-            xmp_path = f"{image_path}.gq.xmp"
-
-            if os.path.exists(xmp_path):
-                print(f"Warning: {xmp_path} already exists and will be overwritten.")
-                os.remove(xmp_path)  # Force overwrite
-
-            tiff_digest = compute_native_digest(image_path, tiff_only=True)
-            exif_digest = compute_native_digest(image_path, tiff_only=False)
-
-            command = [
-                "exiftool",
-                "-XMP:CreateDate=now",
-                "-XMP:Rating=1",
-                "-XMP-dc:Description=Geeqie XMP generated by xmp4geeqie v" + SCRIPT_VERSION,
-                "-XMP-tiff:NativeDigest=" + tiff_digest,  # Set TIFF NativeDigest
-                "-XMP-exif:NativeDigest=" + exif_digest,  # Set EXIF NativeDigest
-                "-overwrite_original",  # Ensure file is modified, not recreated
-                xmp_path
-            ]
-
-            try:
-                subprocess.run(command, check=True)
-                print(f"✅ XMP file created for {filename}")
-                print(f"   → TIFF NativeDigest: {tiff_digest}")
-                print(f"   → EXIF NativeDigest: {exif_digest}")
-            except subprocess.CalledProcessError as e:
-                print(f"❌ Error processing {filename}: {e}")
+    image_paths = [os.path.join(image_dir, filename) for filename in sorted(os.listdir(image_dir))
+                   if filename.lower().endswith(".png")]
+    pending = [image_path for image_path in image_paths
+               if force or not sidecar_is_current(image_path, f"{image_path}.gq.xmp")]
+    if len(pending) < len(image_paths):
+        print(f"Skipping {len(image_paths) - len(pending)} images with up-to-date sidecars")
+
+    if use_exiftool:
+        batches = [pending[i:i + BATCH_SIZE] for i in range(0, len(pending), BATCH_SIZE)]
+        if batches:
+            run_sessions(batches, write_batch, jobs)
+        return
+
+    digests = DigestCache()
+    create_date = datetime.now().astimezone().isoformat(timespec="seconds")
+    tagged = [image_path for image_path in pending if carries_metadata(image_path)]
+    tagged_set = set(tagged)
+    plain = [image_path for image_path in pending if image_path not in tagged_set]
+    for message in write_native(plain, digests, create_date=create_date):
+        print(message)
+
+    batches = [tagged[i:i + BATCH_SIZE] for i in range(0, len(tagged), BATCH_SIZE)]
+    if batches:
+        print(f"Reading the tags of {len(tagged)} images with metadata through exiftool")
+        run_sessions(batches, lambda session, batch: write_native(
+            batch, digests, read_exif(session, batch, TIFF_TAGS + EXIF_TAGS), create_date), jobs)
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python xmp4geeqie.py <image_directory>")
+    jobs, args = parse_jobs(sys.argv[1:])
+    force = "--force" in args
+    use_exiftool = "--exiftool" in args
+    args = [arg for arg in args if arg not in ("--force", "--exiftool")]
+    if len(args) != 1:
+        print("Usage: python xmp4geeqie.py <image_directory> [--jobs N] [--force] [--exiftool]")
         sys.exit(1)
 
-    image_directory = sys.argv[1]
-    generate_xmp_files(image_directory)
+    image_directory = args[0]
+    generate_xmp_files(image_directory, jobs=jobs, force=force, use_exiftool=use_exiftool)